@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Runners of ``benchmarks/suite.py`` for the asyncio client, Python 3.5+.
+"""
+import asyncio
+
+from gredis.instrument import timer
+
+
+async def run_aio(op, rounds, warmup):
+    for _ in range(warmup):
+        await op()
+    latencies = []
+    start = timer()
+    for _ in range(rounds):
+        started_at = timer()
+        await op()
+        latencies.append(timer() - started_at)
+    return timer() - start, latencies
+
+
+async def run_aio_concurrent(op, rounds, warmup, concurrency):
+    "Run ``rounds`` ops in ``concurrency`` tasks"
+    await asyncio.gather(*[run_aio(op, warmup // concurrency, 0)
+                           for _ in range(concurrency)])
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            started_at = timer()
+            await op()
+            latencies.append(timer() - started_at)
+
+    start = timer()
+    await asyncio.gather(*[worker(rounds // concurrency)
+                           for _ in range(concurrency)])
+    return timer() - start, latencies
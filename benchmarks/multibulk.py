@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Measure the throughput of big replies: a multi-bulk ``LRANGE`` reply and
+a large bulk string which contains many CRLFs.
+
+    python benchmarks/multibulk.py --host 127.0.0.1 --elements 10000
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import argparse
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from gredis.client import AsyncRedis
+
+
+LIST_KEY = "gredis::bench::multibulk::list"
+BULK_KEY = "gredis::bench::multibulk::bulk"
+
+
+@gen.coroutine
+def prepare(client, elements, element_size, bulk_size):
+    yield client.delete(LIST_KEY, BULK_KEY)
+    value = ("x" * (element_size - 2)) + "\r\n"
+    pipeline = client.pipeline(transaction=False)
+    for _ in range(elements):
+        pipeline.rpush(LIST_KEY, value)
+    yield pipeline.execute()
+    yield client.set(BULK_KEY, ("y" * 30 + "\r\n") * (bulk_size // 32))
+
+
+@gen.coroutine
+def measure(name, rounds, func, *args):
+    start = time.time()
+    for _ in range(rounds):
+        yield func(*args)
+    elapsed = time.time() - start
+    print("{0:<8} {1:>6} rounds {2:>9.3f}s {3:>10.1f} ops/sec".format(
+        name, rounds, elapsed, rounds / elapsed))
+
+
+@gen.coroutine
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--elements", type=int, default=10000)
+    parser.add_argument("--element-size", type=int, default=64)
+    parser.add_argument("--bulk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--rounds", type=int, default=20)
+    options = parser.parse_args()
+
+    client = AsyncRedis(options.host, options.port)
+    yield prepare(client, options.elements, options.element_size,
+                  options.bulk_size)
+    try:
+        yield measure("LRANGE", options.rounds, client.lrange, LIST_KEY, 0, -1)
+        yield measure("GET", options.rounds, client.get, BULK_KEY)
+    finally:
+        yield client.delete(LIST_KEY, BULK_KEY)
+
+
+if __name__ == "__main__":
+    IOLoop.current().run_sync(main)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Benchmark suite of the asynchronous and the blocking clients.
+
+Runs against an in-process fake server, ``gredis.testing.FakeRedisServer``
+in a child process, and optionally a real redis-server: ``SET``/``GET`` of
+several value sizes, a large multi-bulk ``LRANGE`` reply, pipelines,
+concurrent coroutines and pub/sub fan-out. Each benchmark reports the ops/sec
+and the latency percentiles, ``--json`` writes them to a file and
+``--baseline`` compares them with such a file, exiting with 1 when a
+benchmark got slower than ``--tolerance``. ``--aio`` also runs the
+``gredis.aio`` client, all the clients then run on Tornado's asyncio loop.
+
+    python benchmarks/suite.py --json results.json
+    python benchmarks/suite.py --redis-server redis-server \\
+        --baseline results.json
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+
+import redis
+import tornado
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Event
+from tornado.testing import bind_unused_port
+
+import gredis
+from gredis.client import AsyncRedis
+from gredis.instrument import timer
+from gredis.testing import FakeRedisServer
+
+try:
+    import asyncio
+    from tornado.platform.asyncio import AsyncIOMainLoop, to_tornado_future
+    from gredis.aio import AioRedis
+    from aio_runners import run_aio, run_aio_concurrent
+except (ImportError, SyntaxError):  # Python < 3.5
+    AioRedis = None
+
+
+KEY = "gredis::bench::key"
+LIST_KEY = "gredis::bench::list"
+CHANNEL = "gredis::bench::channel"
+
+
+def serve_fake(queue):
+    "Run a fake server in this process, its port is put in ``queue``"
+    io_loop = IOLoop()
+    io_loop.make_current()
+    server = FakeRedisServer()
+    server.start()
+    queue.put(server.port)
+    io_loop.start()
+
+
+def start_fake_server():
+    "Start a fake server in a child process, return it and its port"
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_fake, args=(queue,))
+    process.daemon = True
+    process.start()
+    return process, queue.get(timeout=10)
+
+
+def start_redis_server(path):
+    "Start a redis-server without persistence, return it and its port"
+    sock, port = bind_unused_port()
+    sock.close()
+    process = subprocess.Popen(
+        [path, "--port", str(port), "--bind", "127.0.0.1", "--save", "",
+         "--appendonly", "no"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    client = redis.StrictRedis("127.0.0.1", port)
+    for _ in range(100):
+        try:
+            client.ping()
+            return process, port
+        except redis.ConnectionError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("redis-server didn't start on port %d" % port)
+
+
+def percentile(latencies, percent):
+    "Return the ``percent`` percentile of the sorted ``latencies``"
+    index = int(math.ceil(len(latencies) * percent / 100.0)) - 1
+    return latencies[min(max(index, 0), len(latencies) - 1)]
+
+
+def make_result(server, client, benchmark, param, ops, elapsed, latencies):
+    latencies = sorted(latencies)
+    return {
+        "server": server,
+        "client": client,
+        "benchmark": benchmark,
+        "param": param,
+        "ops": ops,
+        "elapsed": elapsed,
+        "ops_per_sec": ops / elapsed,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p90_us": percentile(latencies, 90) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+        "max_us": latencies[-1] * 1e6,
+    }
+
+
+def print_result(result):
+    print("{server:<6} {client:<8} {benchmark:<10} {param:>7} {ops:>7} "
+          "{ops_per_sec:>11.1f} {p50_us:>9.1f} {p90_us:>9.1f} "
+          "{p99_us:>9.1f} {max_us:>10.1f}".format(**result))
+    sys.stdout.flush()
+
+
+def print_header():
+    print("{0:<6} {1:<8} {2:<10} {3:>7} {4:>7} {5:>11} {6:>9} {7:>9} "
+          "{8:>9} {9:>10}".format("server", "client", "benchmark", "param",
+                                  "ops", "ops/sec", "p50 us", "p90 us",
+                                  "p99 us", "max us"))
+
+
+# RUNNERS, ``op`` is called without arguments and returns the reply, or a
+# future of it with the asynchronous client
+@gen.coroutine
+def run_async(op, rounds, warmup):
+    for _ in range(warmup):
+        yield op()
+    latencies = []
+    start = timer()
+    for _ in range(rounds):
+        started_at = timer()
+        yield op()
+        latencies.append(timer() - started_at)
+    raise gen.Return((timer() - start, latencies))
+
+
+def run_blocking(op, rounds, warmup):
+    for _ in range(warmup):
+        op()
+    latencies = []
+    start = timer()
+    for _ in range(rounds):
+        started_at = timer()
+        op()
+        latencies.append(timer() - started_at)
+    return timer() - start, latencies
+
+
+@gen.coroutine
+def run_concurrent(op, rounds, warmup, concurrency):
+    "Run ``rounds`` ops in ``concurrency`` coroutines"
+    yield [run_async(op, warmup // concurrency, 0) for _ in range(concurrency)]
+    latencies = []
+
+    @gen.coroutine
+    def worker(count):
+        for _ in range(count):
+            started_at = timer()
+            yield op()
+            latencies.append(timer() - started_at)
+
+    start = timer()
+    yield [worker(rounds // concurrency) for _ in range(concurrency)]
+    raise gen.Return((timer() - start, latencies))
+
+
+@gen.coroutine
+def run_pubsub(client, subscribers, messages):
+    """ Publish ``messages`` to ``subscribers``, the latency of a message is
+    the time from its publication until a subscriber got it.
+    """
+    latencies = []
+    received = Event()
+
+    def on_message(message):
+        latencies.append(timer() - float(message["data"]))
+        if len(latencies) == subscribers * messages:
+            received.set()
+
+    pubsubs = []
+    for _ in range(subscribers):
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        yield pubsub.subscribe(**{CHANNEL: on_message})
+        pubsubs.append((pubsub, pubsub.listen()))
+
+    start = timer()
+    for _ in range(messages):
+        yield client.publish(CHANNEL, repr(timer()))
+    yield received.wait(timeout=IOLoop.current().time() + 60)
+    elapsed = timer() - start
+
+    for pubsub, listener in pubsubs:
+        yield pubsub.unsubscribe()
+        yield listener
+        pubsub.close()
+    raise gen.Return((elapsed, latencies))
+
+
+def run_blocking_future(op, rounds, warmup):
+    return gen.maybe_future(run_blocking(op, rounds, warmup))
+
+
+def run_aio_future(op, rounds, warmup):
+    return to_tornado_future(asyncio.ensure_future(
+        run_aio(op, rounds, warmup)))
+
+
+def run_aio_concurrent_future(op, rounds, warmup, concurrency):
+    return to_tornado_future(asyncio.ensure_future(
+        run_aio_concurrent(op, rounds, warmup, concurrency)))
+
+
+def make_pipeline_op(client, depth):
+    def op():
+        pipeline = client.pipeline(transaction=False)
+        for _ in range(depth):
+            pipeline.get(KEY)
+        return pipeline.execute()
+    return op
+
+
+@gen.coroutine
+def run_server(server, port, options):
+    "Run every benchmark against the server on ``port``, return the results"
+    results = []
+
+    def report(*args):
+        result = make_result(server, *args)
+        print_result(result)
+        results.append(result)
+
+    admin = redis.StrictRedis("127.0.0.1", port)
+    async_client = AsyncRedis("127.0.0.1", port)
+    # name, client, runner, concurrent runner, a blocking client can't run
+    # concurrent coroutines
+    clients = [("async", async_client, run_async, run_concurrent),
+               ("blocking", async_client.to_blocking_client(),
+                run_blocking_future, None)]
+    if options.aio:
+        clients.append(("aio", AioRedis("127.0.0.1", port), run_aio_future,
+                        run_aio_concurrent_future))
+    requests, warmup = options.requests, options.warmup
+
+    for name, client, run, _ in clients:
+        for size in options.sizes:
+            value = b"x" * size
+            admin.delete(KEY)
+            elapsed, latencies = yield run(
+                lambda: client.set(KEY, value), requests, warmup)
+            report(name, "SET", size, requests, elapsed, latencies)
+            elapsed, latencies = yield run(
+                lambda: client.get(KEY), requests, warmup)
+            report(name, "GET", size, requests, elapsed, latencies)
+
+        admin.delete(LIST_KEY)
+        for i in range(0, options.elements, 1000):
+            admin.rpush(LIST_KEY, *[b"x" * options.element_size] *
+                        min(1000, options.elements - i))
+        rounds = max(requests // 100, 10)
+        elapsed, latencies = yield run(
+            lambda: client.lrange(LIST_KEY, 0, -1), rounds, 2)
+        report(name, "LRANGE", options.elements, rounds, elapsed, latencies)
+
+        admin.set(KEY, b"x" * 64)
+        rounds = max(requests // options.pipeline, 10)
+        elapsed, latencies = yield run(
+            make_pipeline_op(client, options.pipeline), rounds, 2)
+        # ops are the commands, latencies are of whole pipelines
+        report(name, "PIPELINE", options.pipeline,
+               rounds * options.pipeline, elapsed, latencies)
+
+    concurrency = options.concurrency
+    rounds = requests // concurrency * concurrency
+    for name, client, _, run in clients:
+        if run is None:
+            continue
+        elapsed, latencies = yield run(
+            lambda: client.get(KEY), rounds, warmup, concurrency)
+        report(name, "CONCURRENT", concurrency, rounds, elapsed, latencies)
+
+    # only the Tornado client has pub/sub, a blocking client can't listen
+    # without blocking the publisher
+    messages = max(requests // options.subscribers, 10)
+    elapsed, latencies = yield run_pubsub(async_client, options.subscribers,
+                                          messages)
+    report("async", "PUBSUB", options.subscribers, len(latencies), elapsed,
+           latencies)
+
+    admin.delete(KEY, LIST_KEY)
+    for _, client, _, _ in clients:
+        client.connection_pool.disconnect()
+    raise gen.Return(results)
+
+
+def result_key(result):
+    return (result["server"], result["client"], result["benchmark"],
+            result["param"])
+
+
+def compare(results, baseline, tolerance):
+    "Print the benchmarks slower than ``baseline``, return their number"
+    previous = dict((result_key(result), result) for result in baseline)
+    regressions = 0
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        change = result["ops_per_sec"] / old["ops_per_sec"] - 1
+        if change < -tolerance:
+            regressions += 1
+            print("REGRESSION {0} {1} {2} {3}: {4:.1f} -> {5:.1f} ops/sec "
+                  "({6:+.1%})".format(
+                      result["server"], result["client"],
+                      result["benchmark"], result["param"],
+                      old["ops_per_sec"], result["ops_per_sec"], change))
+    return regressions
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--no-fake", action="store_true",
+                        help="don't run against the fake server")
+    parser.add_argument("--redis-server", metavar="PATH",
+                        help="also start and run against this redis-server")
+    parser.add_argument("--aio", action="store_true",
+                        help="also run the asyncio client")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--sizes", type=parse_sizes, default=[16, 1024, 65536],
+                        help="value sizes of SET and GET, comma separated")
+    parser.add_argument("--elements", type=int, default=10000,
+                        help="elements of the LRANGE reply")
+    parser.add_argument("--element-size", type=int, default=64)
+    parser.add_argument("--pipeline", type=int, default=100,
+                        help="commands per pipeline")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--subscribers", type=int, default=10)
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with the results in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown allowed by --baseline, 0.1 is 10%%")
+    options = parser.parse_args()
+    if options.aio and AioRedis is None:
+        parser.error("--aio needs Python 3.5+")
+
+    servers = []
+    try:
+        if not options.no_fake:
+            servers.append(("fake",) + start_fake_server())
+        if options.redis_server:
+            servers.append(("redis",) + start_redis_server(
+                options.redis_server))
+        if options.aio:
+            # after the fork of the fake server, it has a loop of its own
+            AsyncIOMainLoop().install()
+
+        print_header()
+        results = []
+        for name, _, port in servers:
+            results.extend(IOLoop.current().run_sync(
+                lambda: run_server(name, port, options)))
+    finally:
+        for _, process, _ in servers:
+            process.terminate()
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump({
+                "environment": {
+                    "python": platform.python_version(),
+                    "implementation": platform.python_implementation(),
+                    "tornado": tornado.version,
+                    "redis": redis.__version__,
+                    "gredis": gredis.version,
+                },
+                "options": dict((name, value) for name, value
+                                in vars(options).items()
+                                if name not in ("json", "baseline")),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
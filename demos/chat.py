@@ -14,9 +14,11 @@ import uuid
 from tornado import gen
 from tornado import web
 from tornado import ioloop
+from gredis.blocking import CancelledError
 from gredis.client import AsyncRedis
 
-client = AsyncRedis("192.168.1.50")
+# the long polls waiting in BLPOP get connections of their own
+client = AsyncRedis("192.168.1.50", blocking_connections=256)
 
 
 CHAT_PEER_KEY = "chat::peer"
@@ -48,6 +50,8 @@ class ChatHandler(web.RequestHandler):
 
 
 class ChatMessageHandler(web.RequestHandler):
+    waiting = None
+
     @gen.coroutine
     def post(self):
         chat_id = self.get_argument("chat_id")
@@ -55,10 +59,19 @@ class ChatMessageHandler(web.RequestHandler):
 
         send_key = "chat::{0}::message".format(dist_id)
 
-        key, message = yield client.blpop(send_key)
+        self.waiting = client.blpop(send_key)
+        try:
+            key, message = yield self.waiting
+        except CancelledError:
+            return
 
         self.write(message)
 
+    def on_connection_close(self):
+        # the browser went away, don't pop a message for it
+        if self.waiting is not None:
+            client.cancel(self.waiting)
+
 
 # from tornado import gen
 # from tornado import web
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Native ``async def`` client on asyncio streams, for Python 3.5+.
+
+:class:`AioRedis` has the commands and pipelines of
+:class:`gredis.client.AsyncRedis`, but they are native coroutines awaited
+on an asyncio event loop, without a Tornado ``Future`` and generator step
+for each call. The replies are decoded by the same parser.
+
+.. code-block:: python
+
+    client = AioRedis("localhost", 6379)
+    value = await client.get("key")
+
+Pub/sub, scripts, streaming and the other extensions of the Tornado client
+aren't available here.
+"""
+import asyncio
+import inspect
+import socket
+import sys
+
+from redis._compat import izip, nativestr
+from redis.client import StrictRedis, BasePipeline
+from redis.connection import (
+    Connection, ConnectionPool, SERVER_CLOSED_CONNECTION_ERROR, SYM_EMPTY)
+from redis.exceptions import (
+    AuthenticationError, ConnectionError, ExecAbortError, RedisError,
+    ResponseError, TimeoutError, WatchError)
+
+from gredis.connection import AsyncParser, StreamBuffer, NOT_ENOUGH_DATA
+
+
+class AioStreamBuffer(StreamBuffer):
+    "Receive buffer of an :class:`asyncio.StreamReader`"
+
+    async def fill(self, length=None):
+        """ Read whatever is available, up to ``socket_read_size`` bytes, or
+        exactly ``length`` bytes
+        """
+        try:
+            if length is None:
+                data = await self._stream.read(self.socket_read_size)
+                if not data:
+                    raise asyncio.IncompleteReadError(data, None)
+            else:
+                data = await self._stream.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Error while reading from stream: %s" %
+                                  (SERVER_CLOSED_CONNECTION_ERROR, ))
+        except OSError as e:
+            raise ConnectionError(
+                "Error while reading from stream: %s" % (e.args, ))
+        self.append(data)
+
+
+class AioParser(AsyncParser):
+    "Parser of :class:`AioConnection`"
+
+    def on_connect(self, connection):
+        self._stream = connection._reader
+        self._buffer = AioStreamBuffer(self._stream, self.socket_read_size)
+        self.encoder = connection.encoder
+        self._reset_state()
+
+    def on_disconnect(self):
+        # the connection closes the stream
+        self._stream = None
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._reset_state()
+
+    async def read_response(self):
+        buf = self._buffer
+        while True:
+            response = self._parse()
+            if response is not NOT_ENOUGH_DATA:
+                return response
+
+            if self._bulk_length is None:
+                await buf.fill()
+            else:
+                # read the rest of the payload with one exact-length read
+                await buf.fill(self._bulk_length + 2 - buf.length)
+
+
+class AioConnection(Connection):
+    """ Connection on asyncio streams, its I/O methods are coroutines.
+
+    Writes only wait for the stream to drain once more than
+    ``write_buffer_high_water`` bytes are buffered.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.write_buffer_high_water = kwargs.pop("write_buffer_high_water",
+                                                  65536)
+        kwargs["parser_class"] = AioParser
+        Connection.__init__(self, *args, **kwargs)
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        if self._writer is not None:
+            return
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port),
+                self.socket_connect_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout connecting to server")
+        except OSError as e:
+            raise ConnectionError(self._error_message(e))
+
+        if self.socket_keepalive:
+            sock = writer.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for k, v in (self.socket_keepalive_options or {}).items():
+                sock.setsockopt(socket.SOL_TCP, k, v)
+        self._reader, self._writer = reader, writer
+
+        try:
+            await self.on_connect()
+        except RedisError:
+            self.disconnect()
+            raise
+
+        for callback in self._connect_callbacks:
+            result = callback(self)
+            if inspect.isawaitable(result):
+                await result
+
+    async def on_connect(self):
+        self._parser.on_connect(self)
+
+        if self.password:
+            await self.send_command('AUTH', self.password)
+            if nativestr(await self.read_response()) != 'OK':
+                raise AuthenticationError('Invalid Password')
+
+        if self.db:
+            await self.send_command('SELECT', self.db)
+            if nativestr(await self.read_response()) != 'OK':
+                raise ConnectionError('Invalid Database')
+
+    def disconnect(self):
+        "Disconnects from the Redis server"
+        self._parser.on_disconnect()
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def send_packed_command(self, command):
+        "Send an already packed command to the Redis server"
+        if self._writer is None:
+            await self.connect()
+        if not isinstance(command, bytes):
+            command = SYM_EMPTY.join(command)
+        writer = self._writer
+        try:
+            writer.write(command)
+            if (writer.transport.get_write_buffer_size() >
+                    self.write_buffer_high_water):
+                await writer.drain()
+        except OSError as e:
+            self.disconnect()
+            raise ConnectionError("Error while writing to socket. %s." %
+                                  (e.args, ))
+        except BaseException:
+            self.disconnect()
+            raise
+
+    async def send_command(self, *args):
+        "Pack and send a command to the Redis server"
+        await self.send_packed_command(self.pack_command(*args))
+
+    async def read_response(self):
+        "Read the response from a previously sent command"
+        try:
+            if self.socket_timeout:
+                response = await asyncio.wait_for(
+                    self._parser.read_response(), self.socket_timeout)
+            else:
+                response = await self._parser.read_response()
+        except asyncio.TimeoutError:
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
+        except BaseException:
+            self.disconnect()
+            raise
+
+        if isinstance(response, ResponseError):
+            raise response
+        return response
+
+
+class AioConnectionPool(ConnectionPool):
+    "Connection pool of :class:`AioConnection`"
+
+    def __init__(self, connection_class=AioConnection, max_connections=None,
+                 **connection_kwargs):
+        ConnectionPool.__init__(self, connection_class, max_connections,
+                                **connection_kwargs)
+
+
+class AioStrictRedis(StrictRedis):
+    """ Version of :class:`redis.client.StrictRedis` whose commands are
+    native coroutines on asyncio streams
+    """
+
+    def __init__(self, *args, **kwargs):
+        write_buffer_high_water = kwargs.pop("write_buffer_high_water", None)
+        StrictRedis.__init__(self, *args, **kwargs)
+
+        pool = self.connection_pool
+        if not isinstance(pool, AioConnectionPool):
+            connection_kwargs = dict(pool.connection_kwargs)
+            if write_buffer_high_water is not None:
+                connection_kwargs["write_buffer_high_water"] = \
+                    write_buffer_high_water
+            self.connection_pool = AioConnectionPool(
+                AioConnection, pool.max_connections, **connection_kwargs)
+
+    async def execute_command(self, *args, **options):
+        "Execute a command and return the parsed response"
+        pool = self.connection_pool
+        command_name = args[0]
+        connection = pool.get_connection(command_name, **options)
+        try:
+            await connection.send_command(*args)
+            return await self.parse_response(connection, command_name,
+                                             **options)
+        except (ConnectionError, TimeoutError) as e:
+            connection.disconnect()
+            if not connection.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            await connection.send_command(*args)
+            return await self.parse_response(connection, command_name,
+                                             **options)
+        finally:
+            pool.release(connection)
+
+    async def parse_response(self, connection, command_name, **options):
+        "Parse a response from the Redis server"
+        response = await connection.read_response()
+        if command_name in self.response_callbacks:
+            return self.response_callbacks[command_name](response, **options)
+        return response
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """ Return a new pipeline object, ``execute()`` of it is a
+        coroutine.
+        """
+        return AioStrictPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint)
+
+    def pubsub(self, **kwargs):
+        raise NotImplementedError("Pub/sub isn't supported by the asyncio "
+                                  "client, use gredis.client.AsyncRedis")
+
+
+class AioRedis(AioStrictRedis):
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AioPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint)
+
+
+class AioBasePipeline(BasePipeline):
+    """ Version of :class:`redis.client.BasePipeline` for
+    :class:`AioConnection`, the buffered commands are sent in one write.
+    """
+
+    def reset(self):
+        self.command_stack = []
+        self.scripts = set()
+        # ``UNWATCH`` would need a round trip which can't be done here,
+        # disconnecting will also remove any previous WATCHes
+        if self.watching and self.connection:
+            self.connection.disconnect()
+        self.watching = False
+        self.explicit_transaction = False
+        if self.connection:
+            self.connection_pool.release(self.connection)
+            self.connection = None
+
+    async def immediate_execute_command(self, *args, **options):
+        """ Execute a command immediately, but don't auto-retry on a
+        ConnectionError if we're already WATCHing a variable.
+        """
+        command_name = args[0]
+        conn = self.connection
+        if not conn:
+            conn = self.connection_pool.get_connection(command_name,
+                                                       self.shard_hint)
+            self.connection = conn
+        try:
+            await conn.send_command(*args)
+            return await self.parse_response(conn, command_name, **options)
+        except (ConnectionError, TimeoutError) as e:
+            conn.disconnect()
+            if not conn.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            if self.watching:
+                self.reset()
+                raise WatchError("A ConnectionError occured on while watching "
+                                 "one or more keys")
+            try:
+                await conn.send_command(*args)
+                return await self.parse_response(conn, command_name,
+                                                 **options)
+            except ConnectionError:
+                conn.disconnect()
+                self.reset()
+                raise
+
+    async def _execute_transaction(self, connection, commands, raise_on_error):
+        cmds = [(('MULTI', ), {})] + list(commands) + [(('EXEC', ), {})]
+        await connection.send_packed_command(
+            connection.pack_commands([args for args, _ in cmds]))
+        errors = []
+
+        # read the reply of every command even after an error
+        try:
+            await self.parse_response(connection, '_')
+        except ResponseError:
+            errors.append((0, sys.exc_info()[1]))
+
+        for i, command in enumerate(commands):
+            try:
+                await self.parse_response(connection, '_')
+            except ResponseError:
+                ex = sys.exc_info()[1]
+                self.annotate_exception(ex, i + 1, command[0])
+                errors.append((i, ex))
+
+        # the server forgets all the WATCHes after EXEC
+        try:
+            response = await self.parse_response(connection, 'EXEC')
+        except ExecAbortError:
+            self.watching = False
+            if errors:
+                raise errors[0][1]
+            raise
+
+        if response is None:
+            raise WatchError("Watched variable changed.")
+
+        for i, e in errors:
+            response.insert(i, e)
+
+        if len(response) != len(commands):
+            connection.disconnect()
+            raise ResponseError("Wrong number of response items from "
+                                "pipeline execution")
+
+        if raise_on_error:
+            self.raise_first_error(commands, response)
+
+        data = []
+        for r, cmd in izip(response, commands):
+            if not isinstance(r, Exception):
+                args, options = cmd
+                command_name = args[0]
+                if command_name in self.response_callbacks:
+                    r = self.response_callbacks[command_name](r, **options)
+            data.append(r)
+        return data
+
+    async def _execute_pipeline(self, connection, commands, raise_on_error):
+        await connection.send_packed_command(
+            connection.pack_commands([args for args, _ in commands]))
+
+        response = []
+        for args, options in commands:
+            try:
+                response.append(await self.parse_response(
+                    connection, args[0], **options))
+            except ResponseError:
+                response.append(sys.exc_info()[1])
+
+        if raise_on_error:
+            self.raise_first_error(commands, response)
+        return response
+
+    async def parse_response(self, connection, command_name, **options):
+        result = await AioStrictRedis.parse_response(
+            self, connection, command_name, **options)
+        if command_name in self.UNWATCH_COMMANDS:
+            self.watching = False
+        elif command_name == 'WATCH':
+            self.watching = True
+        return result
+
+    async def load_scripts(self):
+        # the script_* methods would be buffered in the pipeline
+        scripts = list(self.scripts)
+        immediate = self.immediate_execute_command
+        exists = await immediate('SCRIPT EXISTS', *[s.sha for s in scripts])
+        if not all(exists):
+            for s, exist in izip(scripts, exists):
+                if not exist:
+                    s.sha = await immediate('SCRIPT LOAD', s.script)
+
+    async def execute(self, raise_on_error=True):
+        "Execute all the commands in the current pipeline"
+        stack = self.command_stack
+        if not stack:
+            return []
+        if self.scripts:
+            await self.load_scripts()
+        if self.transaction or self.explicit_transaction:
+            execute = self._execute_transaction
+        else:
+            execute = self._execute_pipeline
+
+        conn = self.connection
+        if not conn:
+            conn = self.connection_pool.get_connection('MULTI',
+                                                       self.shard_hint)
+            # reset() releases it back to the pool
+            self.connection = conn
+
+        try:
+            return await execute(conn, stack, raise_on_error)
+        except (ConnectionError, TimeoutError) as e:
+            conn.disconnect()
+            if not conn.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            # the WATCHes were lost with the connection
+            if self.watching:
+                raise WatchError("A ConnectionError occured on while watching "
+                                 "one or more keys")
+            return await execute(conn, stack, raise_on_error)
+        finally:
+            self.reset()
+
+
+class AioStrictPipeline(AioBasePipeline, AioStrictRedis):
+    "Pipeline for the AioStrictRedis class"
+    pass
+
+
+class AioPipeline(AioBasePipeline, AioRedis):
+    "Pipeline for the AioRedis class"
+    pass
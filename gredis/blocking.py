@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""A lane of connections of their own for the blocking commands.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+from collections import deque
+
+from tornado import gen
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+from redis._compat import nativestr, unicode
+from redis.exceptions import RedisError, TimeoutError
+
+# commands which may wait on the server for as long as their timeout
+LANE_COMMANDS = frozenset([
+    'BLPOP', 'BRPOP', 'BRPOPLPUSH', 'BZPOPMIN', 'BZPOPMAX', 'XREAD',
+    'XREADGROUP',
+])
+# commands whose waiters can share one wait, and the command pushing back
+# a value nobody waits for anymore
+COALESCED_COMMANDS = {'BLPOP': 'LPUSH', 'BRPOP': 'RPUSH'}
+
+# key of the options of a command carrying its BlockingCall
+CALL_OPTION = '_blocking_call'
+
+
+class CancelledError(RedisError):
+    "The blocking command was cancelled by :meth:`BlockingLane.cancel`"
+
+
+def _is_blocking(args):
+    command = args[0]
+    if command not in ('XREAD', 'XREADGROUP'):
+        return True
+    # XREAD only blocks with the BLOCK option, given before STREAMS
+    for arg in args[1:]:
+        if not isinstance(arg, (bytes, unicode)):
+            continue
+        arg = nativestr(arg).upper()
+        if arg == 'BLOCK':
+            return True
+        if arg == 'STREAMS':
+            break
+    return False
+
+
+class BlockingCall(object):
+    "State of a command running on the lane"
+
+    __slots__ = ('future', 'connection', 'group', 'waiter', 'cancelled')
+
+    def __init__(self):
+        self.future = None
+        self.connection = None
+        # the _Group and the future of the call when it's coalesced
+        self.group = None
+        self.waiter = None
+        self.cancelled = False
+
+
+class BlockingLane(object):
+    """ Runs the blocking commands of a client, ``BLPOP``, ``BRPOP``,
+    ``BRPOPLPUSH``, ``BZPOPMIN``, ``BZPOPMAX`` and ``XREAD`` with ``BLOCK``,
+    on the connections of ``pool`` so waiting commands don't starve the
+    other commands.
+
+    A command waiting for too long can be cancelled, its connection is
+    closed since its reply could still come.
+
+    With ``coalesce`` the ``BLPOP`` and ``BRPOP`` without a timeout waiting
+    on the same keys share one command on the server, each popped value
+    goes to the oldest waiter. A value popped after its waiter left is
+    pushed back.
+    """
+
+    def __init__(self, client, pool, coalesce=False):
+        self.client = client
+        self.pool = pool
+        self.coalesce = coalesce
+        # future returned to the caller -> BlockingCall
+        self._calls = {}
+        # args -> _Group of the waiters coalesced on a shared command
+        self._groups = {}
+
+    def accepts(self, args):
+        "Whether the command ``args`` runs on the lane"
+        return args[0] in LANE_COMMANDS and _is_blocking(args)
+
+    def execute(self, args, options, execute):
+        """ Run the command with ``execute(args, options)`` of the client
+        and return a future which :meth:`cancel` can fail
+        """
+        call = BlockingCall()
+        options[CALL_OPTION] = call
+        future = call.future = Future()
+        self._calls[future] = call
+        future.add_done_callback(lambda f: self._calls.pop(f, None))
+
+        result = execute(args, options)
+        # the result of a cancelled call is dropped
+        result.add_done_callback(lambda f: f.exception())
+        chain_future(result, future)
+        return future
+
+    def cancel(self, future):
+        """ Cancel the command of ``future``, it fails with
+        :class:`CancelledError`. Return ``False`` if it already completed.
+        """
+        call = self._calls.get(future)
+        if call is None or future.done():
+            return False
+        if call.waiter is not None and call.waiter.done():
+            # a value was popped for it already
+            return False
+        del self._calls[future]
+        call.cancelled = True
+        future.set_exception(CancelledError("Blocking command cancelled"))
+        if call.connection is not None:
+            call.connection.disconnect()
+        if call.group is not None:
+            self._leave_group(call)
+        return True
+
+    @gen.coroutine
+    def run(self, args, options, event, deadline=None, decoding=None):
+        """ Run a command given to :meth:`execute`, return its parsed reply.
+        It fails with ``TimeoutError`` at the IOLoop time ``deadline``. The
+        replies of a shared command ignore ``decoding``.
+        """
+        call = options.pop(CALL_OPTION, None) or BlockingCall()
+        command_name = args[0]
+        if (self.coalesce and command_name in COALESCED_COMMANDS and
+                args[-1] in (0, '0', b'0')):
+            response = yield self._wait_in_group(args, call, deadline)
+        else:
+            response = yield self._wait(args, call, deadline, decoding)
+        raise gen.Return(
+            self.client._handle_response(response, command_name, options))
+
+    @gen.coroutine
+    def _wait(self, args, call, deadline, decoding):
+        pool = self.pool
+        connection = yield pool.get_connection(args[0])
+        connection.deadline = deadline
+        connection.decoding = decoding
+        try:
+            if not call.cancelled:
+                yield connection.connect()
+            if call.cancelled:
+                raise CancelledError("Blocking command cancelled")
+            call.connection = connection
+            yield connection.send_command(*args)
+            response = yield connection.read_response(blocking=True)
+        finally:
+            call.connection = None
+            pool.release(connection)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def _wait_in_group(self, args, call, deadline):
+        group = self._groups.get(args)
+        if group is None:
+            group = self._groups[args] = _Group(args)
+            IOLoop.current().add_callback(self._run_group, group)
+        call.group = group
+        call.waiter = Future()
+        group.waiters.append(call.waiter)
+        if deadline is None:
+            response = yield call.waiter
+            raise gen.Return(response)
+        try:
+            response = yield gen.with_timeout(deadline, call.waiter,
+                                              quiet_exceptions=RedisError)
+        except gen.TimeoutError:
+            self._leave_group(call)
+            raise TimeoutError("Timeout waiting for the reply")
+        raise gen.Return(response)
+
+    def _leave_group(self, call):
+        group, waiter = call.group, call.waiter
+        if waiter.done():
+            return
+        group.waiters.remove(waiter)
+        waiter.set_exception(CancelledError("Blocking command cancelled"))
+        if not group.waiters:
+            # nobody waits for the shared command anymore, the next
+            # waiters get a new one
+            if self._groups.get(group.args) is group:
+                del self._groups[group.args]
+            if group.connection is not None:
+                group.connection.disconnect()
+
+    @gen.coroutine
+    def _run_group(self, group):
+        "Send the shared command until no caller waits on it"
+        pool = self.pool
+        args = group.args
+        waiters = group.waiters
+        connection = None
+        try:
+            connection = yield pool.get_connection(args[0])
+            # connected first, so leaving the group can close it
+            yield connection.connect()
+            group.connection = connection
+            while waiters:
+                yield connection.send_command(*args)
+                response = yield connection.read_response(blocking=True)
+                if waiters:
+                    waiters.popleft().set_result(response)
+                elif response is not None:
+                    yield self._push_back(connection, args[0], response)
+        except Exception as e:
+            while waiters:
+                waiters.popleft().set_exception(e)
+        finally:
+            if self._groups.get(args) is group:
+                del self._groups[args]
+            if connection is not None:
+                pool.release(connection)
+
+    @gen.coroutine
+    def _push_back(self, connection, command_name, response):
+        "Push back a value popped after its waiter left"
+        key, value = response
+        try:
+            yield connection.send_command(COALESCED_COMMANDS[command_name],
+                                          key, value)
+            yield connection.read_response()
+        except Exception:
+            app_log.error("Lost a value popped from %r", key, exc_info=True)
+            raise
+
+
+class _Group(object):
+    "Waiters sharing one blocking command"
+
+    __slots__ = ('args', 'waiters', 'connection')
+
+    def __init__(self, args):
+        self.args = args
+        self.waiters = deque()
+        self.connection = None
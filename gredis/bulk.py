@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Streaming of large bulk values, without holding them in memory.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import os
+
+from tornado import gen
+
+from redis._compat import b
+from redis.connection import SYM_CRLF, SYM_DOLLAR, SYM_STAR, SYM_EMPTY
+from redis.exceptions import DataError
+
+from gredis.scan import StopAsyncIteration
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+class BulkReader(object):
+    """ The payload of a bulk reply read in chunks straight from its
+    connection, returned by :meth:`gredis.client.AsyncStrictRedis.get_stream`.
+
+    The chunks are ``bytes`` whatever the ``decode_responses`` of the
+    client. The connection goes back to the pool once the payload is read,
+    :meth:`close` drops it before that.
+
+    .. code-block:: python
+
+        reader = yield client.get_stream("blob")
+        while True:
+            chunk = yield reader.next_chunk()
+            if chunk is None:
+                break
+
+    On Python 3.5+ the chunks can also be iterated with ``async for``.
+    """
+
+    def __init__(self, pool, connection, length,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self._pool = pool
+        self._connection = connection
+        self.length = length
+        self.remaining = length
+        self.chunk_size = chunk_size
+
+    @gen.coroutine
+    def next_chunk(self):
+        "Return the next chunk of the payload, or ``None`` once it's read"
+        connection = self._connection
+        if connection is None:
+            raise gen.Return(None)
+        try:
+            if self.remaining:
+                data = yield connection.read_bulk_chunk(
+                    min(self.chunk_size, self.remaining))
+            else:
+                yield connection.read_bulk_end()
+                data = None
+        except Exception:
+            self.close()
+            raise
+        if data is None:
+            self._release()
+            raise gen.Return(None)
+        self.remaining -= len(data)
+        raise gen.Return(data)
+
+    @gen.coroutine
+    def readinto(self, buffer):
+        """ Read the rest of the payload into the writable ``buffer``, e.g.
+        a ``bytearray``, and return its size
+        """
+        if len(buffer) < self.remaining:
+            self.close()
+            raise ValueError("A buffer of %d bytes can't hold %d bytes" %
+                             (len(buffer), self.remaining))
+        view = memoryview(buffer)
+        position = 0
+        while True:
+            chunk = yield self.next_chunk()
+            if chunk is None:
+                break
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        raise gen.Return(position)
+
+    @gen.coroutine
+    def copy_to(self, fileobj):
+        "Write the rest of the payload to ``fileobj``, return its size"
+        size = 0
+        while True:
+            chunk = yield self.next_chunk()
+            if chunk is None:
+                break
+            fileobj.write(chunk)
+            size += len(chunk)
+        raise gen.Return(size)
+
+    def _release(self):
+        connection, self._connection = self._connection, None
+        self._pool.release(connection)
+
+    def close(self):
+        """ Stop reading, the connection is closed if the payload wasn't
+        completely read
+        """
+        if self._connection is None:
+            return
+        self._connection.disconnect()
+        self._release()
+
+    def __aiter__(self):
+        return self
+
+    @gen.coroutine
+    def __anext__(self):
+        chunk = yield self.next_chunk()
+        if chunk is None:
+            raise StopAsyncIteration
+        raise gen.Return(chunk)
+
+
+def source_length(source):
+    "Return the bytes left in the file-like ``source``, or ``None``"
+    try:
+        return os.fstat(source.fileno()).st_size - source.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        pass
+    try:
+        position = source.tell()
+        source.seek(0, os.SEEK_END)
+        length = source.tell() - position
+        source.seek(position)
+        return length
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+
+def iter_source(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    "Return an iterator of the chunks of a file-like or iterable ``source``"
+    if hasattr(source, "read"):
+        return iter(lambda: source.read(chunk_size), SYM_EMPTY)
+    return iter(source)
+
+
+def _pack_args(encoder, args):
+    output = []
+    for arg in args:
+        arg = encoder.encode(arg)
+        output.append(SYM_DOLLAR + b(str(len(arg))) + SYM_CRLF + arg +
+                      SYM_CRLF)
+    return SYM_EMPTY.join(output)
+
+
+@gen.coroutine
+def send_bulk_command(connection, args, source, length, trailing_args=(),
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Send the command ``args`` with a last argument of ``length`` bytes
+    streamed from ``source``, followed by ``trailing_args``.
+
+    The chunks are written as they come, the write buffer of the
+    connection bounds the memory used. The connection is closed if the
+    source doesn't give exactly ``length`` bytes.
+    """
+    encoder = connection.encoder
+    count = len(args) + 1 + len(trailing_args)
+    yield connection.send_packed_command(
+        SYM_STAR + b(str(count)) + SYM_CRLF + _pack_args(encoder, args) +
+        SYM_DOLLAR + b(str(length)) + SYM_CRLF)
+
+    sent = 0
+    for chunk in iter_source(source, chunk_size):
+        if not chunk:
+            continue
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        elif isinstance(chunk, bytearray):
+            chunk = bytes(chunk)
+        else:
+            chunk = encoder.encode(chunk)
+        sent += len(chunk)
+        if sent > length:
+            connection.disconnect()
+            raise DataError("The source gave more than %d bytes" % length)
+        yield connection.send_packed_command(chunk)
+    if sent != length:
+        connection.disconnect()
+        raise DataError("The source gave %d bytes instead of %d" %
+                        (sent, length))
+
+    yield connection.send_packed_command(
+        SYM_CRLF + _pack_args(encoder, trailing_args))
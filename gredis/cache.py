@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Client side cache of read command replies.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import copy
+from collections import OrderedDict
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from redis._compat import nativestr, unicode
+
+# read commands whose reply only depends on the key at ``args[1]``, ``TTL``
+# and ``PTTL`` are left out since their reply changes by itself
+READ_COMMANDS = frozenset([
+    'GET', 'GETRANGE', 'STRLEN', 'GETBIT', 'BITCOUNT',
+    'HGET', 'HGETALL', 'HMGET', 'HKEYS', 'HVALS', 'HLEN', 'HEXISTS',
+    'HSTRLEN',
+    'LRANGE', 'LLEN', 'LINDEX',
+    'SMEMBERS', 'SISMEMBER', 'SCARD',
+    'ZRANGE', 'ZREVRANGE', 'ZRANGEBYSCORE', 'ZREVRANGEBYSCORE',
+    'ZRANGEBYLEX', 'ZREVRANGEBYLEX', 'ZSCORE', 'ZRANK', 'ZREVRANK',
+    'ZCARD', 'ZCOUNT', 'ZLEXCOUNT',
+    'TYPE',
+])
+
+# commands which may change any key
+FLUSH_COMMANDS = frozenset(['FLUSHDB', 'FLUSHALL', 'SWAPDB'])
+
+# commands which never change a key
+NON_WRITE_COMMANDS = READ_COMMANDS | frozenset([
+    'TTL', 'PTTL', 'MGET', 'EXISTS', 'KEYS', 'SCAN', 'SSCAN', 'HSCAN',
+    'ZSCAN', 'RANDOMKEY', 'DBSIZE', 'DUMP', 'OBJECT',
+    'SINTER', 'SUNION', 'SDIFF', 'SRANDMEMBER', 'HRANDFIELD', 'ZRANDMEMBER',
+    'GEOPOS', 'GEODIST', 'GEOHASH', 'PFCOUNT', 'XRANGE', 'XREVRANGE',
+    'XLEN', 'XREAD', 'XINFO', 'XPENDING', 'BITPOS',
+    'PING', 'ECHO', 'INFO', 'TIME', 'LASTSAVE', 'AUTH', 'SELECT', 'QUIT',
+    'PUBLISH', 'SUBSCRIBE', 'UNSUBSCRIBE', 'PSUBSCRIBE', 'PUNSUBSCRIBE',
+    'PUBSUB NUMSUB', 'PUBSUB NUMPAT', 'PUBSUB CHANNELS',
+    'WATCH', 'UNWATCH', 'MULTI', 'EXEC', 'DISCARD', 'WAIT', 'READONLY',
+    'READWRITE', 'SCRIPT EXISTS', 'SCRIPT LOAD', 'CONFIG GET', 'CONFIG SET',
+    'CLIENT LIST', 'CLIENT GETNAME', 'CLIENT SETNAME', 'CLIENT KILL',
+    'CLUSTER SLOTS', 'CLUSTER INFO', 'CLUSTER NODES', 'SENTINEL',
+])
+# write commands whose arguments are all keys
+ALL_KEYS_COMMANDS = frozenset([
+    'DEL', 'UNLINK', 'RENAME', 'RENAMENX', 'RPOPLPUSH', 'SINTERSTORE',
+    'SUNIONSTORE', 'SDIFFSTORE', 'PFMERGE',
+])
+# write commands whose keys are ``args[1:-1]``, followed by a timeout
+TIMEOUT_COMMANDS = frozenset([
+    'BLPOP', 'BRPOP', 'BZPOPMIN', 'BZPOPMAX',
+])
+
+
+def command_keys(args):
+    "Return the names of the keys a command may change"
+    command = args[0]
+    if command in NON_WRITE_COMMANDS:
+        return ()
+    if command in ALL_KEYS_COMMANDS:
+        return args[1:]
+    if command in TIMEOUT_COMMANDS:
+        return args[1:-1]
+    if command in ('MSET', 'MSETNX'):
+        return args[1::2]
+    if command in ('SMOVE', 'BRPOPLPUSH', 'LMOVE', 'BLMOVE'):
+        return args[1:3]
+    if command in ('EVAL', 'EVALSHA'):
+        return args[3:3 + int(args[2])]
+    if command in ('ZUNIONSTORE', 'ZINTERSTORE'):
+        return (args[1], ) + tuple(args[3:3 + int(args[2])])
+    if command in ('BITOP', 'COPY'):
+        return args[2:3]
+    if command == 'SORT':
+        # the sorted key isn't changed, only the one it's stored to
+        for index, arg in enumerate(args[2:-1], 2):
+            if (isinstance(arg, (bytes, unicode)) and
+                    nativestr(arg).upper() == 'STORE'):
+                return args[index + 1:index + 2]
+        return ()
+    return args[1:2]
+
+MISSING = object()
+
+
+class ClientCache(object):
+    """ Size bounded LRU cache of the parsed replies of read commands, used
+    by :class:`gredis.client.AsyncStrictRedis` with its ``client_cache``
+    option.
+
+    At most ``max_size`` replies are kept, each for ``ttl`` seconds if it's
+    given. Every write command sent through the client evicts the replies
+    of its keys, see :func:`command_keys`. Writes from other clients are
+    only seen when :meth:`listen_keyspace` runs.
+
+    ``hits``, ``misses``, ``evictions`` and ``invalidations`` count what
+    happened, see :meth:`stats`.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, commands=READ_COMMANDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.commands = commands
+        # set by the client, to normalize key names
+        self.encoder = None
+        # subscription of listen_keyspace()
+        self.pubsub = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # (command arguments, options) -> (reply, expires at)
+        self._entries = OrderedDict()
+        # key name -> the cached entries of the key
+        self._keys = {}
+        # key name -> [reads in flight, generation], the generation is
+        # incremented when the key is invalidated and a reply is only stored
+        # if its key wasn't invalidated while its command was running
+        self._reads = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _normalize(self, key):
+        if self.encoder is None:
+            return key
+        return self.encoder.encode(key)
+
+    def make_key(self, args, options):
+        "Return the cache key of a command, or ``None`` if it's not cached"
+        if args[0] not in self.commands or len(args) < 2:
+            return None
+        if options:
+            return args, tuple(sorted(options.items()))
+        return args, ()
+
+    def get(self, cache_key):
+        "Return a copy of the cached reply, or ``MISSING``"
+        entry = self._entries.pop(cache_key, MISSING)
+        if entry is MISSING:
+            self.misses += 1
+            return MISSING
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= IOLoop.current().time():
+            self._unlink(cache_key)
+            self.misses += 1
+            return MISSING
+
+        # move it to the most recently used end
+        self._entries[cache_key] = entry
+        self.hits += 1
+        if isinstance(value, (list, dict, set)):
+            value = copy.copy(value)
+        return value
+
+    def begin_read(self, cache_key):
+        """ Note that the command of ``cache_key`` is sent, return the
+        generation of its key to give to :meth:`set`. :meth:`end_read` must
+        be called once its reply came.
+        """
+        key = self._normalize(cache_key[0][1])
+        reads = self._reads.get(key)
+        if reads is None:
+            reads = self._reads[key] = [0, 0]
+        reads[0] += 1
+        return reads[1]
+
+    def end_read(self, cache_key):
+        "Note that the command of ``cache_key`` completed"
+        key = self._normalize(cache_key[0][1])
+        reads = self._reads[key]
+        reads[0] -= 1
+        if not reads[0]:
+            del self._reads[key]
+
+    def set(self, cache_key, value, generation):
+        """ Store the reply of a command which started at ``generation``
+        of its key, unless the key was invalidated since.
+        """
+        reads = self._reads.get(self._normalize(cache_key[0][1]))
+        if reads is None or reads[1] != generation:
+            return
+        if isinstance(value, (list, dict, set)):
+            value = copy.copy(value)
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = IOLoop.current().time() + self.ttl
+
+        self._entries.pop(cache_key, None)
+        self._entries[cache_key] = (value, expires_at)
+        key = self._normalize(cache_key[0][1])
+        self._keys.setdefault(key, set()).add(cache_key)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._entries.pop(oldest)
+            self._unlink(oldest)
+            self.evictions += 1
+
+    def _unlink(self, cache_key):
+        self._entries.pop(cache_key, None)
+        key = self._normalize(cache_key[0][1])
+        cache_keys = self._keys.get(key)
+        if cache_keys is not None:
+            cache_keys.discard(cache_key)
+            if not cache_keys:
+                del self._keys[key]
+
+    def invalidate(self, key):
+        "Evict the cached replies of ``key``"
+        key = self._normalize(key)
+        reads = self._reads.get(key)
+        if reads is not None:
+            reads[1] += 1
+        cache_keys = self._keys.pop(key, None)
+        if not cache_keys:
+            return
+        self.invalidations += len(cache_keys)
+        for cache_key in cache_keys:
+            self._entries.pop(cache_key, None)
+
+    def invalidate_command(self, args):
+        "Evict the cached replies of the keys a write command may change"
+        if args[0] in FLUSH_COMMANDS:
+            self.clear()
+            return
+        for key in command_keys(args):
+            if not isinstance(key, (list, tuple, dict)):
+                self.invalidate(key)
+
+    def clear(self):
+        "Evict every cached reply"
+        for reads in self._reads.values():
+            reads[1] += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._keys.clear()
+
+    def stats(self):
+        "Counters of the cache as a dict"
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    @gen.coroutine
+    def listen_keyspace(self, client, db=None):
+        """ Evict the keys changed by any client, using keyspace
+        notifications of database ``db`` (the one of ``client`` by default).
+
+        The server has to publish them, e.g. with
+        ``notify-keyspace-events KA``. The returned future resolves once
+        subscribed, then the notifications are handled in the background
+        until ``self.pubsub`` is closed. The whole cache is cleared when the
+        subscription connection is reestablished, since notifications could
+        have been missed meanwhile.
+        """
+        if db is None:
+            db = client.connection_pool.connection_kwargs.get('db', 0)
+        prefix = self._normalize("__keyspace@{0}__:".format(db))
+
+        def on_keyspace_event(message):
+            self.invalidate(self._normalize(message['channel'])[len(prefix):])
+
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub = pubsub
+        yield pubsub.psubscribe(**{
+            "__keyspace@{0}__:*".format(db): on_keyspace_event})
+        pubsub.connection.register_connect_callback(lambda c: self.clear())
+        pubsub.listen()
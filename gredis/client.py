@@ -8,60 +8,541 @@
 #
 from __future__ import absolute_import, print_function, division, with_statement
 
+import sys
+import copy
+import random
+import datetime
+from itertools import chain
+
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future, chain_future, is_future
+from tornado.queues import Queue
 
-from redis.client import StrictRedis, Redis, PubSub
-from redis.exceptions import ConnectionError, TimeoutError
+from redis._compat import izip, iteritems, nativestr
+from redis.client import StrictRedis, Redis, PubSub, BasePipeline, Script
+from redis.exceptions import (
+    ConnectionError, TimeoutError, ResponseError, ExecAbortError, WatchError,
+    NoScriptError, DataError, RedisError)
 from redis.connection import Connection, ConnectionPool
 
-from gredis.connection import AsyncConnection
+from gredis.blocking import BlockingLane, CALL_OPTION
+from gredis.bulk import (
+    BulkReader, DEFAULT_CHUNK_SIZE, send_bulk_command, source_length)
+from gredis.cache import MISSING, READ_COMMANDS
+from gredis.connection import AsyncConnection, AsyncConnectionPool, DECODINGS
+from gredis.instrument import CommandEvent, timer
+from gredis.scan import ScanIterator
+
+
+# keyword arguments only known by AsyncConnection
+_ASYNC_CONNECTION_OPTIONS = frozenset(["write_buffer_high_water"])
 
 
 def _construct_connection_pool(pool):
     """ Construct a blocking socket connection pool based on asynchronous pool
     """
-    _pool = ConnectionPool(Connection, pool.max_connections, **pool.connection_kwargs)
+    kwargs = dict((k, v) for k, v in pool.connection_kwargs.items()
+                  if k not in _ASYNC_CONNECTION_OPTIONS)
+    _pool = ConnectionPool(Connection, pool.max_connections, **kwargs)
 
     return _pool
 
 
+# client keyword arguments passed on to the AsyncConnectionPool
+_POOL_OPTIONS = {
+    "min_connections": "min_connections",
+    "pool_timeout": "timeout",
+    "idle_timeout": "idle_timeout",
+    "health_check_interval": "health_check_interval",
+    "multiplexed_connections": "multiplexed_connections",
+    "write_buffer_high_water": "write_buffer_high_water",
+    "blocking_connections": "blocking_connections",
+}
+
+# commands which block the connection or change its state, they are never
+# multiplexed or batched with other commands
+BLOCKING_COMMANDS = frozenset([
+    'BLPOP', 'BRPOP', 'BRPOPLPUSH', 'BZPOPMIN', 'BZPOPMAX', 'XREAD',
+    'XREADGROUP', 'WAIT',
+])
+CONNECTION_STATE_COMMANDS = frozenset([
+    'AUTH', 'SELECT', 'MULTI', 'EXEC', 'DISCARD', 'WATCH', 'UNWATCH',
+    'SUBSCRIBE', 'PSUBSCRIBE', 'UNSUBSCRIBE', 'PUNSUBSCRIBE', 'MONITOR',
+    'QUIT', 'CLIENT SETNAME', 'CLIENT REPLY', 'READONLY', 'READWRITE',
+])
+# commands which only read, they can be sent twice. The SCAN family is left
+# out, a cursor is only valid on the server which issued it
+READ_ONLY_COMMANDS = READ_COMMANDS | frozenset([
+    'MGET', 'EXISTS', 'SINTER', 'SUNION', 'SDIFF', 'SRANDMEMBER',
+    'HRANDFIELD', 'ZRANDMEMBER', 'GEOPOS', 'GEODIST', 'GEOHASH', 'PFCOUNT',
+    'TTL', 'PTTL',
+])
+
+
 class AsyncStrictRedis(StrictRedis):
+    """ Asynchronous version of :class:`redis.client.StrictRedis`, every
+    command returns a future.
+
+    With ``auto_pipeline`` the commands issued during the same IOLoop
+    iteration are sent together in one write at the next iteration.
+
+    ``client_cache`` takes a :class:`gredis.cache.ClientCache` which serves
+    the replies of read commands.
+
+    ``instruments`` is a list of :class:`gredis.instrument.Instrument` whose
+    hooks are called around every command.
+
+    With ``blocking_connections`` the blocking commands such as ``BLPOP``
+    run on at most that many connections of their own, they can be stopped
+    with :meth:`cancel`. ``coalesce_blocking`` lets the ``BLPOP`` and
+    ``BRPOP`` without a timeout on the same keys share one connection, see
+    :class:`gredis.blocking.BlockingLane`.
+
+    ``socket_connect_timeout`` and ``socket_timeout`` limit each connect,
+    and each write or reply. ``command_timeout`` is the deadline of a whole
+    command, :meth:`with_timeout` gives one to some commands only. A
+    connection which timed out is closed, the rest of its reply is never
+    read.
+
+    With ``hedge_after`` a read-only command whose reply didn't come after
+    that many seconds is sent again on another connection, the first reply
+    is used.
+
+    With ``decode_responses``, ``decoding="raw"`` leaves the replies as
+    ``bytes`` and ``decoding="lazy"`` returns the multi-bulk replies as
+    :class:`gredis.connection.LazyList` whose items are decoded when they
+    are accessed. :meth:`with_decoding` sets it for some commands only.
+    Otherwise the items of a multi-bulk reply are decoded in one pass.
+    """
 
     def __init__(self, *args, **kwargs):
+        self.auto_pipeline = kwargs.pop("auto_pipeline", False)
+        coalesce_blocking = kwargs.pop("coalesce_blocking", False)
+        self.command_timeout = kwargs.pop("command_timeout", None)
+        self.hedge_after = kwargs.pop("hedge_after", None)
+        self.decoding = kwargs.pop("decoding", None)
+        if self.decoding not in DECODINGS:
+            raise ValueError("Unknown decoding %r" % (self.decoding, ))
+        self._batch = None
+        self.client_cache = kwargs.pop("client_cache", None)
+        # None rather than an empty list, to check it fast
+        self.instruments = list(kwargs.pop("instruments", None) or ()) or None
+        self._scripts = []
+
+        pool_options = {}
+        for name, option in _POOL_OPTIONS.items():
+            if name in kwargs:
+                pool_options[option] = kwargs.pop(name)
+
         StrictRedis.__init__(self, *args, **kwargs)
-        self.connection_pool.connection_class = AsyncConnection
 
-    # COMMAND EXECUTION AND PROTOCOL PARSING
+        pool = self.connection_pool
+        if not isinstance(pool, AsyncConnectionPool):
+            pool_options.update(pool.connection_kwargs)
+            self.connection_pool = AsyncConnectionPool(
+                AsyncConnection, pool.max_connections, **pool_options)
+
+        if self.client_cache is not None and self.client_cache.encoder is None:
+            self.client_cache.encoder = self.connection_pool.get_encoder()
+
+        blocking_pool = self.connection_pool.get_blocking_pool()
+        self.blocking_lane = None
+        if blocking_pool is not None:
+            self.blocking_lane = BlockingLane(self, blocking_pool,
+                                              coalesce_blocking)
+
+    def add_instrument(self, instrument):
+        "Call the hooks of ``instrument`` around every command"
+        self.instruments = (self.instruments or []) + [instrument]
+
+    def remove_instrument(self, instrument):
+        "Stop calling the hooks of ``instrument``"
+        instruments = [i for i in self.instruments or () if i is not instrument]
+        self.instruments = instruments or None
+
+    def with_timeout(self, timeout):
+        """ Return a client sharing everything with this one but whose
+        commands fail with :class:`redis.exceptions.TimeoutError` after
+        ``timeout`` seconds.
+
+        .. code-block:: python
+
+            value = yield client.with_timeout(0.05).get("key")
+        """
+        client = copy.copy(self)
+        client._batch = None
+        client.command_timeout = timeout
+        return client
+
+    def with_decoding(self, decoding):
+        """ Return a client sharing everything with this one but whose
+        replies are decoded as given by ``decoding``, ``"raw"``, ``"lazy"``
+        or ``None`` for the usual decoding.
+
+        .. code-block:: python
+
+            values = yield client.with_decoding("raw").lrange("key", 0, -1)
+        """
+        if decoding not in DECODINGS:
+            raise ValueError("Unknown decoding %r" % (decoding, ))
+        client = copy.copy(self)
+        client._batch = None
+        client.decoding = decoding
+        return client
+
+    def _deadline(self):
+        "Return the IOLoop time at which a command starting now times out"
+        if self.command_timeout is None:
+            return None
+        return IOLoop.current().time() + self.command_timeout
+
+    def _wait_reply(self, future):
+        """ Return the reply ``future`` of a shared connection, failing
+        after ``command_timeout`` seconds. The connection is left open.
+        """
+        if self.command_timeout is None or future.done():
+            return future
+        return self._wait_reply_until(future, self._deadline())
+
     @gen.coroutine
+    def _wait_reply_until(self, future, deadline):
+        try:
+            # a number is an IOLoop time
+            result = yield gen.with_timeout(deadline, future,
+                                            quiet_exceptions=RedisError)
+        except gen.TimeoutError:
+            raise TimeoutError("Timeout waiting for the reply")
+        raise gen.Return(result)
+
+    def cancel(self, future):
+        """ Cancel the blocking command of ``future``, returned by e.g.
+        ``blpop()``, its connection is closed. ``future`` fails with
+        :class:`gredis.blocking.CancelledError`. Return ``False`` if the
+        command already completed, or didn't run on ``blocking_connections``.
+        """
+        if self.blocking_lane is None:
+            return False
+        return self.blocking_lane.cancel(future)
+
+    # COMMAND EXECUTION AND PROTOCOL PARSING
     def execute_command(self, *args, **options):
-        "Execute a command and return a parsed response"
+        "Execute a command and return a future of the parsed response"
+        if (self.blocking_lane is not None and
+                self.blocking_lane.accepts(args)):
+            return self.blocking_lane.execute(args, options,
+                                              self._execute_any)
+        return self._execute_any(args, options)
+
+    def _execute_any(self, args, options):
+        "Execute a command, through the client cache if there is one"
+        if self.client_cache is not None:
+            return self._execute_cached(args, options)
+        return self._execute(args, options)
+
+    def _execute(self, args, options):
+        "Execute a command, instrumented if there are instruments"
+        if self.instruments is not None:
+            return self._execute_instrumented(args, options)
+        return self._execute_command(args, options, None)
+
+    @gen.coroutine
+    def _execute_instrumented(self, args, options):
+        "Execute a command, calling the hooks of the instruments around it"
+        event = CommandEvent(args)
+        instruments = self.instruments
+        for instrument in instruments:
+            instrument.before_command(event)
+        try:
+            result = yield self._execute_command(args, options, event)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.duration = timer() - event.started_at
+            for instrument in instruments:
+                instrument.after_command(event)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _execute_cached(self, args, options):
+        cache = self.client_cache
+        cache_key = cache.make_key(args, options)
+        if cache_key is None:
+            cache.invalidate_command(args)
+            try:
+                result = yield self._execute(args, options)
+            finally:
+                # a read sent before this write was applied may have been
+                # stored meanwhile
+                cache.invalidate_command(args)
+            raise gen.Return(result)
+
+        if self.decoding is not None:
+            # the cache holds the replies decoded as usual
+            result = yield self._execute(args, options)
+            raise gen.Return(result)
+
+        result = cache.get(cache_key)
+        if result is MISSING:
+            generation = cache.begin_read(cache_key)
+            try:
+                result = yield self._execute(args, options)
+                cache.set(cache_key, result, generation)
+            finally:
+                cache.end_read(cache_key)
+        raise gen.Return(result)
+
+    def _execute_command(self, args, options, event):
+        "Send a command the way the client is configured to"
+        command_name = args[0]
+        if (command_name not in BLOCKING_COMMANDS and
+                command_name not in CONNECTION_STATE_COMMANDS):
+            if self.decoding is not None:
+                # shared connections decode their replies as usual
+                pass
+            elif self.auto_pipeline:
+                return self._execute_batched(args, options)
+            elif self.connection_pool.multiplexed_connections:
+                return self._execute_multiplexed(args, options)
+            if (self.hedge_after is not None and
+                    command_name in READ_ONLY_COMMANDS):
+                return self._execute_hedged(args, options, event)
+        elif CALL_OPTION in options:
+            return self.blocking_lane.run(args, options, event,
+                                          self._deadline(), self.decoding)
+        return self._execute_pooled(args, options, event)
+
+    @gen.coroutine
+    def _execute_pooled(self, args, options, event=None):
+        """ Execute a command on a connection of the pool, filling the
+        measurements of ``event`` if it's given
+        """
         pool = self.connection_pool
         command_name = args[0]
-        connection = pool.get_connection(command_name, **options)
+        deadline = self._deadline()
+        if event is not None:
+            started_at = timer()
+        connection = yield pool.get_connection(command_name, **options)
+        if event is not None:
+            event.pool_wait = timer() - started_at
+        connection.deadline = deadline
+        connection.decoding = self.decoding
         try:
-            yield connection.send_command(*args)
-            result = yield self.parse_response(connection, command_name, **options)
+            packed = connection.pack_command(*args)
+            if event is not None:
+                if connection._stream is None:
+                    started_at = timer()
+                    yield connection.connect()
+                    event.connect_time = timer() - started_at
+                event.bytes_written = sum(len(chunk) for chunk in packed)
+
+            retried = False
+            while True:
+                if event is not None:
+                    started_at = timer()
+                    received = connection.bytes_received
+                try:
+                    yield connection.send_packed_command(packed)
+                    result = yield self.parse_response(connection,
+                                                       command_name, **options)
+                    break
+                except (ConnectionError, TimeoutError) as e:
+                    connection.disconnect()
+                    if retried or (not connection.retry_on_timeout and
+                                   isinstance(e, TimeoutError)):
+                        raise
+                    retried = True
+
+            if event is not None:
+                event.round_trip = timer() - started_at
+                event.bytes_read = connection.bytes_received - received
+            raise gen.Return(result)
+        finally:
+            pool.release(connection)
+
+    @gen.coroutine
+    def _execute_hedged(self, args, options, event):
+        "Execute a read, sent again on another connection if it's slow"
+        first = self._execute_pooled(args, options)
+        try:
+            result = yield gen.with_timeout(
+                datetime.timedelta(seconds=self.hedge_after), first,
+                quiet_exceptions=RedisError)
             raise gen.Return(result)
+        except gen.TimeoutError:
+            pass
+
+        if event is not None:
+            event.hedged = True
+        second = self._execute_pooled(args, options)
+        # the slower reply is dropped
+        for future in (first, second):
+            future.add_done_callback(lambda f: f.exception())
+        error = None
+        replies = gen.WaitIterator(first, second)
+        while not replies.done():
+            try:
+                result = yield replies.next()
+            except Exception as e:
+                error = e
+            else:
+                raise gen.Return(result)
+        raise error
+
+    @gen.coroutine
+    def _execute_multiplexed(self, args, options):
+        connection = self.connection_pool.get_multiplexed_connection()
+        try:
+            response = yield self._wait_reply(
+                connection.execute_multiplexed([args])[0])
         except (ConnectionError, TimeoutError) as e:
-            connection.disconnect()
             if not connection.retry_on_timeout and isinstance(e, TimeoutError):
                 raise
-            connection.send_command(*args)
-            result = yield self.parse_response(connection, command_name, **options)
-            raise  gen.Return(result)
+            response = yield self._wait_reply(
+                connection.execute_multiplexed([args])[0])
+        raise gen.Return(self._handle_response(response, args[0], options))
+
+    @gen.coroutine
+    def _execute_batched(self, args, options):
+        try:
+            response = yield self._wait_reply(self._queue_command(args))
+        except (ConnectionError, TimeoutError) as e:
+            retry_on_timeout = self.connection_pool.connection_kwargs.get(
+                'retry_on_timeout', False)
+            if not retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            response = yield self._wait_reply(self._queue_command(args))
+        raise gen.Return(self._handle_response(response, args[0], options))
+
+    def _queue_command(self, args):
+        future = Future()
+        if self._batch is None:
+            self._batch = []
+            IOLoop.current().add_callback(self._flush_batch)
+        self._batch.append((args, future))
+        return future
+
+    @gen.coroutine
+    def _flush_batch(self):
+        "Send the commands queued in the last IOLoop iteration in one write"
+        batch, self._batch = self._batch, None
+        commands = [args for args, _ in batch]
+        pool = self.connection_pool
+
+        if pool.multiplexed_connections:
+            connection = pool.get_multiplexed_connection()
+            replies = connection.execute_multiplexed(commands)
+            for reply, (_, future) in izip(replies, batch):
+                chain_future(reply, future)
+            return
+
+        try:
+            connection = yield pool.get_connection('AUTOPIPELINE')
+        except Exception:
+            error = sys.exc_info()[1]
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        try:
+            yield connection.send_packed_command(
+                connection.pack_commands(commands))
+            for _, future in batch:
+                try:
+                    response = yield connection.read_response()
+                except ResponseError:
+                    future.set_exception(sys.exc_info()[1])
+                else:
+                    future.set_result(response)
+        except Exception:
+            error = sys.exc_info()[1]
+            connection.disconnect()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
         finally:
             pool.release(connection)
 
     @gen.coroutine
     def parse_response(self, connection, command_name, **options):
         response = yield connection.read_response()
+        raise gen.Return(self._handle_response(response, command_name, options))
+
+    def _handle_response(self, response, command_name, options):
         if command_name in self.response_callbacks:
-            raise gen.Return(self.response_callbacks[command_name](response, **options))
-        raise gen.Return(response)
+            return self.response_callbacks[command_name](response, **options)
+        return response
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """ Return a new asynchronous pipeline object, ``execute()`` of it
+        returns a future.
+        """
+        return AsyncStrictPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+            self.client_cache)
+
+    @gen.coroutine
+    def transaction(self, func, *watches, **kwargs):
+        """ Run ``func(pipe)`` in a ``MULTI``/``EXEC`` block while the
+        keys ``watches`` are watched, again as long as one of them changed
+        before ``EXEC``. Return the replies of ``EXEC``, or the value of
+        ``func`` with ``value_from_callable``.
+
+        ``func`` reads the watched keys with the commands of ``pipe``, which
+        run on its connection right away, and may return a future. It then
+        calls ``pipe.multi()`` and queues the commands sent in one write
+        with ``EXEC``.
+
+        ``watch_delay`` seconds are waited after a conflict, with
+        ``max_watch_delay`` the wait doubles after each conflict up to that,
+        randomized. :class:`redis.exceptions.WatchError` is raised after
+        ``max_retries`` retries.
 
-    def pipeline(self, *args, **kwargs):
-        obj = self.to_blocking_client()
-        return obj.pipeline(*args, **kwargs)
+        .. code-block:: python
+
+            @gen.coroutine
+            def reserve(pipe):
+                seats = int((yield pipe.get("seats")) or 0)
+                if seats <= 0:
+                    raise SoldOut()
+                pipe.multi()
+                pipe.decr("seats")
+
+            yield client.transaction(reserve, "seats", watch_delay=0.001,
+                                     max_watch_delay=0.1)
+        """
+        shard_hint = kwargs.pop('shard_hint', None)
+        value_from_callable = kwargs.pop('value_from_callable', False)
+        watch_delay = kwargs.pop('watch_delay', None)
+        max_watch_delay = kwargs.pop('max_watch_delay', None)
+        max_retries = kwargs.pop('max_retries', None)
+        retries = 0
+        with self.pipeline(True, shard_hint) as pipe:
+            while True:
+                try:
+                    if watches:
+                        yield pipe.watch(*watches)
+                    func_value = func(pipe)
+                    if is_future(func_value):
+                        func_value = yield func_value
+                    exec_value = yield pipe.execute()
+                    raise gen.Return(func_value if value_from_callable
+                                     else exec_value)
+                except WatchError:
+                    if max_retries is not None and retries >= max_retries:
+                        raise
+                    pipe.reset()
+                delay = watch_delay
+                if delay and max_watch_delay is not None:
+                    delay = random.uniform(
+                        0, min(max_watch_delay, delay * 2 ** retries))
+                retries += 1
+                if delay:
+                    yield gen.sleep(delay)
 
     def to_blocking_client(self):
         """ Convert asynchronous client to blocking socket client
@@ -70,8 +551,184 @@ class AsyncStrictRedis(StrictRedis):
         obj.connection_pool = _construct_connection_pool(self.connection_pool)
         return obj
 
+    # SCRIPTING
+    def register_script(self, script):
+        """ Register a Lua ``script`` and return a callable
+        :class:`AsyncScript`. The registered scripts are loaded by every new
+        connection, so calling them sends only their SHA.
+        """
+        script = AsyncScript(self, script)
+        if not self._scripts:
+            self.connection_pool.register_connect_callback(self._load_scripts)
+        self._scripts.append(script)
+        return script
+
+    @gen.coroutine
+    def _load_scripts(self, connection):
+        "Load the registered scripts in the script cache of the server"
+        scripts = list(self._scripts)
+        yield connection.send_packed_command(connection.pack_commands(
+            [('SCRIPT LOAD', script.script) for script in scripts]))
+        for script in scripts:
+            try:
+                script.sha = nativestr((yield connection.read_response()))
+            except ResponseError:
+                # e.g. a syntax error, let the call of the script report it
+                pass
+
+    # STREAMING OF LARGE VALUES
+    @gen.coroutine
+    def get_stream(self, name, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Return a :class:`gredis.bulk.BulkReader` of the value of
+        ``name``, or ``None`` if it doesn't exist. The value is read in
+        chunks of up to ``chunk_size`` bytes, never as a whole.
+        """
+        pool = self.connection_pool
+        connection = yield pool.get_connection('GET')
+        try:
+            yield connection.send_command('GET', name)
+            length = yield connection.read_bulk_length()
+        except Exception:
+            pool.release(connection)
+            raise
+        if length is None:
+            pool.release(connection)
+            raise gen.Return(None)
+        raise gen.Return(BulkReader(pool, connection, length, chunk_size))
+
+    @gen.coroutine
+    def get_into(self, name, buffer):
+        """ Read the value of ``name`` into the writable ``buffer``, return
+        its size or ``None`` if it doesn't exist
+        """
+        reader = yield self.get_stream(name)
+        if reader is None:
+            raise gen.Return(None)
+        size = yield reader.readinto(buffer)
+        raise gen.Return(size)
+
+    @gen.coroutine
+    def get_to_file(self, name, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Write the value of ``name`` to ``fileobj``, return its size or
+        ``None`` if it doesn't exist
+        """
+        reader = yield self.get_stream(name, chunk_size)
+        if reader is None:
+            raise gen.Return(None)
+        size = yield reader.copy_to(fileobj)
+        raise gen.Return(size)
+
+    def set_stream(self, name, source, length=None, ex=None, px=None,
+                   nx=False, xx=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Set the value of ``name`` to the content of ``source``, a
+        file-like object or an iterable of ``bytes``, which is sent in
+        chunks as it's read.
+
+        ``length`` is required unless the size of ``source`` can be found
+        with ``fileno()`` or ``seek()``. The other arguments are the ones
+        of ``set``.
+        """
+        trailing_args = []
+        if ex is not None:
+            if isinstance(ex, datetime.timedelta):
+                ex = ex.seconds + ex.days * 24 * 3600
+            trailing_args.extend(('EX', ex))
+        if px is not None:
+            if isinstance(px, datetime.timedelta):
+                ms = int(px.microseconds / 1000)
+                px = (px.seconds + px.days * 24 * 3600) * 1000 + ms
+            trailing_args.extend(('PX', px))
+        if nx:
+            trailing_args.append('NX')
+        if xx:
+            trailing_args.append('XX')
+        return self._execute_streamed('SET', name, source, length,
+                                      trailing_args, chunk_size)
+
+    def append_stream(self, name, source, length=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Append the content of ``source`` to the value of ``name``, like
+        ``set_stream``. Returns the new length of the value.
+        """
+        return self._execute_streamed('APPEND', name, source, length, (),
+                                      chunk_size)
+
+    @gen.coroutine
+    def _execute_streamed(self, command_name, name, source, length,
+                          trailing_args, chunk_size):
+        if length is None:
+            length = source_length(source)
+            if length is None:
+                raise DataError("The length of the source is required")
+
+        cache = self.client_cache
+        if cache is not None:
+            cache.invalidate_command((command_name, name))
+        pool = self.connection_pool
+        connection = yield pool.get_connection(command_name)
+        try:
+            try:
+                yield send_bulk_command(connection, (command_name, name),
+                                        source, length, trailing_args,
+                                        chunk_size)
+            except Exception:
+                # don't leave a partial command on the connection
+                connection.disconnect()
+                raise
+            result = yield self.parse_response(connection, command_name)
+        finally:
+            pool.release(connection)
+            if cache is not None:
+                cache.invalidate_command((command_name, name))
+        raise gen.Return(result)
+
+    # SCAN ITERATORS
+    def scan_iter(self, match=None, count=None, lanes=1, prefetch=1):
+        """ Return a :class:`gredis.scan.ScanIterator` of the key names.
+
+        ``lanes`` splits the keyspace in as many parts scanned concurrently.
+        """
+        def fetch(cursor):
+            return self.scan(cursor, match=match, count=count)
+        return ScanIterator(fetch, lanes, prefetch)
+
+    def sscan_iter(self, name, match=None, count=None, prefetch=1):
+        "Return a :class:`gredis.scan.ScanIterator` of the members of a set"
+        def fetch(cursor):
+            return self.sscan(name, cursor, match=match, count=count)
+        return ScanIterator(fetch, prefetch=prefetch)
+
+    def hscan_iter(self, name, match=None, count=None, prefetch=1):
+        """ Return a :class:`gredis.scan.ScanIterator` of the
+        ``(field, value)`` pairs of a hash
+        """
+        @gen.coroutine
+        def fetch(cursor):
+            cursor, data = yield self.hscan(name, cursor,
+                                            match=match, count=count)
+            raise gen.Return((cursor, list(iteritems(data))))
+        return ScanIterator(fetch, prefetch=prefetch)
+
+    def zscan_iter(self, name, match=None, count=None,
+                   score_cast_func=float, prefetch=1):
+        """ Return a :class:`gredis.scan.ScanIterator` of the
+        ``(member, score)`` pairs of a sorted set
+        """
+        def fetch(cursor):
+            return self.zscan(name, cursor, match=match, count=count,
+                              score_cast_func=score_cast_func)
+        return ScanIterator(fetch, prefetch=prefetch)
+
 
 class AsyncRedis(AsyncStrictRedis):
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+            self.client_cache)
+
     def pubsub(self, **kwargs):
         return AsyncPubSub(self.connection_pool, **kwargs)
 
@@ -84,6 +741,7 @@ class AsyncRedis(AsyncStrictRedis):
 
 
 class AsyncPubSub(PubSub):
+    @gen.coroutine
     def execute_command(self, *args, **kwargs):
         "Execute a publish/subscribe command"
 
@@ -92,22 +750,108 @@ class AsyncPubSub(PubSub):
         # subscribed to one or more channels
 
         if self.connection is None:
-            self.connection = self.connection_pool.get_connection(
+            connection = yield self.connection_pool.get_connection(
                 'pubsub',
                 self.shard_hint
             )
-            # register a callback that re-subscribes to any channels we
-            # were listening to when we were disconnected
-            self.connection.register_connect_callback(self.on_connect)
+            # connect before registering the callback below, the channels
+            # being subscribed now must not be subscribed again by it
+            try:
+                yield connection.connect()
+            except:
+                self.connection_pool.release(connection)
+                raise
+            if self.connection is None:
+                self.connection = connection
+                # register a callback that re-subscribes to any channels we
+                # were listening to when we were disconnected
+                self.connection.register_connect_callback(self.on_connect)
+            else:
+                # a concurrent command got a connection first
+                self.connection_pool.release(connection)
         connection = self.connection
-        return self._execute(connection, connection.send_command, *args)
+        yield self._execute(connection, connection.send_command, *args)
 
-    def listen(self):
-        "Listen for messages on channels this client has been subscribed to"
-        raise NotImplementedError
+    @gen.coroutine
+    def _execute(self, connection, command, *args):
+        try:
+            result = yield command(*args)
+        except (ConnectionError, TimeoutError) as e:
+            connection.disconnect()
+            # don't reconnect when the pubsub was closed meanwhile
+            if self.connection is not connection:
+                raise
+            if not connection.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            # Connect manually here. If the Redis server is down, this will
+            # fail and raise a ConnectionError as desired.
+            yield connection.connect()
+            result = yield command(*args)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def on_connect(self, connection):
+        "Re-subscribe to any channels and patterns previously subscribed to"
+        # NOTE: for python3, we can't pass bytestrings as keyword arguments
+        # so we need to decode channel/pattern names back to unicode strings
+        # before passing them to [p]subscribe.
+        decode = self.encoder.decode
+        if self.channels:
+            channels = dict((decode(k, force=True), v)
+                            for k, v in iteritems(self.channels))
+            yield self.subscribe(**channels)
+        if self.patterns:
+            patterns = dict((decode(k, force=True), v)
+                            for k, v in iteritems(self.patterns))
+            yield self.psubscribe(**patterns)
+
+    @gen.coroutine
+    def listen(self, handler=None):
+        """ Listen for messages on channels this client has been subscribed
+        to, until all of them are unsubscribed or the pubsub is closed.
+
+        Messages of channels and patterns subscribed with a handler are
+        passed to it, the others to ``handler`` if it's given. All the
+        messages received together are parsed and dispatched at once, a
+        :class:`MessageQueue` can be used as a bounded buffer between the
+        listener and consumers. Don't call ``get_message`` meanwhile.
+        """
+        while self.subscribed:
+            try:
+                response = yield self.parse_response(block=True)
+            except (ConnectionError, RuntimeError):
+                if self.connection is None:
+                    # closed
+                    return
+                raise
+            connection = self.connection
+            responses = [response]
+            if connection is not None:
+                responses.extend(connection.read_buffered_responses())
+
+            for response in responses:
+                message = self.handle_message(response)
+                if message is not None and handler is not None:
+                    handler(message)
 
     @gen.coroutine
-    def get_message(self, block=False, ignore_subscribe_messages=False):
+    def parse_response(self, block=True, timeout=0):
+        "Parse the response from a publish/subscribe command"
+        connection = self.connection
+        if connection is None:
+            raise RuntimeError(
+                'pubsub connection not set: '
+                'did you forget to call subscribe() or psubscribe()?')
+        if not block:
+            readable = yield connection.can_read(timeout=timeout)
+            if not readable:
+                raise gen.Return(None)
+        response = yield self._execute(connection, connection.read_response)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def get_message(self, block=False, ignore_subscribe_messages=False,
+                    timeout=0):
         """
         Get the next message if one is available, otherwise None.
 
@@ -115,7 +859,312 @@ class AsyncPubSub(PubSub):
         before returning. Timeout should be specified as a floating point
         number.
         """
-        response = yield self.parse_response(block)
+        response = yield self.parse_response(block, timeout)
         if response:
             raise gen.Return(self.handle_message(response, ignore_subscribe_messages))
         raise gen.Return(None)
+
+
+class MessageQueue(Queue):
+    """ A bounded queue of pub/sub messages, it can be given as message
+    handler to :class:`AsyncPubSub` and consumed with ``yield queue.get()``.
+
+    When the queue is full ``overflow`` decides which message is dropped,
+    the oldest one in the queue (``"drop_oldest"``) or the new one
+    (``"drop_newest"``), the listener never waits for consumers.
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+    def __init__(self, maxsize=0, overflow=DROP_OLDEST):
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        Queue.__init__(self, maxsize)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def __call__(self, message):
+        if self.full():
+            self.dropped += 1
+            if self.overflow == self.DROP_NEWEST:
+                return
+            self.get_nowait()
+            self.task_done()
+        self.put_nowait(message)
+
+
+class AsyncScript(Script):
+    """ Asynchronous version of :class:`redis.client.Script`, calling it
+    returns a future, or the pipeline when it's called with one.
+
+    ``EVALSHA`` is always used, the script is loaded again if the server
+    doesn't know it.
+    """
+
+    def __call__(self, keys=[], args=[], client=None):
+        "Execute the script, passing any required ``args``"
+        if client is None:
+            client = self.registered_client
+        args = tuple(keys) + tuple(args)
+        if isinstance(client, BasePipeline):
+            # the pipeline loads the script before executing
+            client.scripts.add(self)
+            return client.evalsha(self.sha, len(keys), *args)
+        return self._execute(client, len(keys), args)
+
+    @gen.coroutine
+    def _execute(self, client, numkeys, args):
+        try:
+            result = yield client.evalsha(self.sha, numkeys, *args)
+        except NoScriptError:
+            # the server restarted, or the client points to another server
+            # than the one the script was loaded on
+            self.sha = nativestr((yield client.script_load(self.script)))
+            result = yield client.evalsha(self.sha, numkeys, *args)
+        raise gen.Return(result)
+
+
+class AsyncBasePipeline(BasePipeline):
+    """ Asynchronous version of :class:`redis.client.BasePipeline`.
+
+    Buffered commands are packed together and sent in one write, then all
+    the replies are read back through the :class:`AsyncParser` of the
+    connection.
+
+    The commands sent through it evict the replies of their keys from the
+    ``client_cache`` of the client, its replies are never cached.
+    """
+
+    def __init__(self, connection_pool, response_callbacks, transaction,
+                 shard_hint, client_cache=None):
+        BasePipeline.__init__(self, connection_pool, response_callbacks,
+                              transaction, shard_hint)
+        self.client_cache = client_cache
+
+    def _invalidate_cache(self, commands):
+        "Evict the cached replies of the keys ``commands`` may change"
+        cache = self.client_cache
+        for args, options in commands:
+            if (args[0] not in CONNECTION_STATE_COMMANDS and
+                    cache.make_key(args, options) is None):
+                cache.invalidate_command(args)
+
+    def reset(self):
+        self.command_stack = []
+        self.scripts = set()
+        # ``UNWATCH`` would need a round trip which can't be done here,
+        # disconnecting will also remove any previous WATCHes
+        if self.watching and self.connection:
+            self.connection.disconnect()
+        self.watching = False
+        self.explicit_transaction = False
+        if self.connection:
+            self.connection_pool.release(self.connection)
+            self.connection = None
+
+    @gen.coroutine
+    def immediate_execute_command(self, *args, **options):
+        """
+        Execute a command immediately, but don't auto-retry on a
+        ConnectionError if we're already WATCHing a variable. Used when
+        issuing WATCH or subsequent commands retrieving their values but before
+        MULTI is called.
+        """
+        command_name = args[0]
+        conn = self.connection
+        # if this is the first call, we need a connection
+        if not conn:
+            conn = yield self.connection_pool.get_connection(command_name,
+                                                             self.shard_hint)
+            self.connection = conn
+        commands = ((args, options), )
+        if self.client_cache is not None:
+            self._invalidate_cache(commands)
+        try:
+            yield conn.send_command(*args)
+            result = yield self.parse_response(conn, command_name, **options)
+            raise gen.Return(result)
+        except (ConnectionError, TimeoutError) as e:
+            conn.disconnect()
+            if not conn.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            # if we're not already watching, we can safely retry the command
+            if self.watching:
+                self.reset()
+                raise WatchError("A ConnectionError occured on while watching "
+                                 "one or more keys")
+            try:
+                yield conn.send_command(*args)
+                result = yield self.parse_response(conn, command_name,
+                                                   **options)
+            except ConnectionError:
+                # the retry failed so cleanup.
+                conn.disconnect()
+                self.reset()
+                raise
+            raise gen.Return(result)
+        finally:
+            # a read sent before this write was applied may have been
+            # stored meanwhile
+            if self.client_cache is not None:
+                self._invalidate_cache(commands)
+
+    @gen.coroutine
+    def _execute_transaction(self, connection, commands, raise_on_error):
+        cmds = chain([(('MULTI', ), {})], commands, [(('EXEC', ), {})])
+        all_cmds = connection.pack_commands([args for args, _ in cmds])
+        yield connection.send_packed_command(all_cmds)
+        errors = []
+
+        # parse off the response for MULTI
+        # NOTE: we need to handle ResponseErrors here and continue
+        # so that we read all the additional command messages from
+        # the stream
+        try:
+            yield self.parse_response(connection, '_')
+        except ResponseError:
+            errors.append((0, sys.exc_info()[1]))
+
+        # and all the other commands
+        for i, command in enumerate(commands):
+            try:
+                yield self.parse_response(connection, '_')
+            except ResponseError:
+                ex = sys.exc_info()[1]
+                self.annotate_exception(ex, i + 1, command[0])
+                errors.append((i, ex))
+
+        # parse the EXEC, the server forgets all the WATCHes after it
+        try:
+            response = yield self.parse_response(connection, 'EXEC')
+        except ExecAbortError:
+            self.watching = False
+            if errors:
+                raise errors[0][1]
+            raise
+
+        if response is None:
+            raise WatchError("Watched variable changed.")
+
+        # put any parse errors into the response
+        for i, e in errors:
+            response.insert(i, e)
+
+        if len(response) != len(commands):
+            connection.disconnect()
+            raise ResponseError("Wrong number of response items from "
+                                "pipeline execution")
+
+        # find any errors in the response and raise if necessary
+        if raise_on_error:
+            self.raise_first_error(commands, response)
+
+        # We have to run response callbacks manually
+        data = []
+        for r, cmd in izip(response, commands):
+            if not isinstance(r, Exception):
+                args, options = cmd
+                command_name = args[0]
+                if command_name in self.response_callbacks:
+                    r = self.response_callbacks[command_name](r, **options)
+            data.append(r)
+        raise gen.Return(data)
+
+    @gen.coroutine
+    def _execute_pipeline(self, connection, commands, raise_on_error):
+        # build up all commands into a single request to increase network perf
+        all_cmds = connection.pack_commands([args for args, _ in commands])
+        yield connection.send_packed_command(all_cmds)
+
+        response = []
+        for args, options in commands:
+            try:
+                result = yield self.parse_response(connection, args[0],
+                                                   **options)
+                response.append(result)
+            except ResponseError:
+                response.append(sys.exc_info()[1])
+
+        if raise_on_error:
+            self.raise_first_error(commands, response)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def parse_response(self, connection, command_name, **options):
+        result = yield AsyncStrictRedis.parse_response(
+            self, connection, command_name, **options)
+        if command_name in self.UNWATCH_COMMANDS:
+            self.watching = False
+        elif command_name == 'WATCH':
+            self.watching = True
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def load_scripts(self):
+        # make sure all scripts that are about to be run on this pipeline exist
+        scripts = list(self.scripts)
+        immediate = self.immediate_execute_command
+        shas = [s.sha for s in scripts]
+        # we can't use the normal script_* methods because they would just
+        # get buffered in the pipeline.
+        exists = yield immediate('SCRIPT EXISTS', *shas)
+        if not all(exists):
+            for s, exist in izip(scripts, exists):
+                if not exist:
+                    s.sha = yield immediate('SCRIPT LOAD', s.script)
+
+    @gen.coroutine
+    def execute(self, raise_on_error=True):
+        "Execute all the commands in the current pipeline"
+        stack = self.command_stack
+        if not stack:
+            raise gen.Return([])
+        if self.scripts:
+            yield self.load_scripts()
+        if self.transaction or self.explicit_transaction:
+            execute = self._execute_transaction
+        else:
+            execute = self._execute_pipeline
+
+        conn = self.connection
+        if not conn:
+            conn = yield self.connection_pool.get_connection('MULTI',
+                                                             self.shard_hint)
+            # assign to self.connection so reset() releases the connection
+            # back to the pool after we're done
+            self.connection = conn
+
+        cache = self.client_cache
+        if cache is not None:
+            self._invalidate_cache(stack)
+        try:
+            result = yield execute(conn, stack, raise_on_error)
+            raise gen.Return(result)
+        except (ConnectionError, TimeoutError) as e:
+            conn.disconnect()
+            if not conn.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            # if we were watching a variable, the watch is no longer valid
+            # since this connection has died. raise a WatchError, which
+            # indicates the user should retry his transaction.
+            if self.watching:
+                raise WatchError("A ConnectionError occured on while watching "
+                                 "one or more keys")
+            # otherwise, it's safe to retry since the transaction isn't
+            # predicated on any state
+            result = yield execute(conn, stack, raise_on_error)
+            raise gen.Return(result)
+        finally:
+            if cache is not None:
+                self._invalidate_cache(stack)
+            self.reset()
+
+
+class AsyncStrictPipeline(AsyncBasePipeline, AsyncStrictRedis):
+    "Asynchronous pipeline for the AsyncStrictRedis class"
+    pass
+
+
+class AsyncPipeline(AsyncBasePipeline, AsyncRedis):
+    "Asynchronous pipeline for the AsyncRedis class"
+    pass
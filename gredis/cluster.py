@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Asynchronous Redis Cluster client.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+from itertools import chain
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from redis._compat import izip, nativestr
+from redis.client import StrictRedis, Redis
+from redis.connection import Encoder
+from redis.exceptions import ConnectionError, TimeoutError, ResponseError
+
+from gredis.client import AsyncStrictRedis, AsyncRedis
+from gredis.scan import ScanIterator
+
+CLUSTER_SLOTS = 16384
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc <<= 1
+        table.append(crc & 0xffff)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data):
+    "CRC16-CCITT (XModem) of ``data``, as used by Redis Cluster"
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xff00) ^ _CRC16_TABLE[((crc >> 8) ^ byte) & 0xff]
+    return crc
+
+
+def hash_tag(key):
+    "Return the part of the encoded ``key`` between ``{`` and ``}`` if any"
+    start = key.find(b"{")
+    if start > -1:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def key_slot(key):
+    "Return the slot of the encoded ``key``, honoring ``{hash tags}``"
+    return crc16(hash_tag(key)) % CLUSTER_SLOTS
+
+
+def _parse_redirect(error):
+    "Return ``(kind, slot, node)`` of a MOVED or ASK error, or ``None``"
+    parts = str(error).split()
+    if len(parts) == 3 and parts[0] in ('MOVED', 'ASK'):
+        return parts[0], int(parts[1]), parts[2]
+    return None
+
+
+# commands sent to every primary, and how their replies are merged
+ALL_NODES_COMMANDS = {
+    'FLUSHDB': all,
+    'FLUSHALL': all,
+    'DBSIZE': sum,
+    'KEYS': lambda replies: list(chain.from_iterable(replies)),
+    'SCRIPT LOAD': lambda replies: replies[0],
+    'SCRIPT FLUSH': all,
+    'PING': all,
+}
+
+# multi-key commands split per slot, and how their replies are merged. The
+# keys of MSET are followed by a value. EXISTS is left out, its response
+# callback turns the count of each part into a bool
+SPLIT_COMMANDS = {
+    'MGET': None,
+    'MSET': all,
+    'DEL': sum,
+    'UNLINK': sum,
+    'TOUCH': sum,
+}
+PAIRS_COMMANDS = frozenset(['MSET'])
+
+# commands without a key at ``args[1]``, SCAN walks every node in turn
+KEYLESS_COMMANDS = frozenset([
+    'PUBLISH', 'INFO', 'CONFIG GET', 'CONFIG SET', 'ECHO', 'TIME',
+    'RANDOMKEY', 'SCRIPT EXISTS', 'CLUSTER SLOTS', 'CLUSTER INFO',
+    'CLUSTER NODES', 'LASTSAVE', 'SCAN', 'WAIT', 'PUBSUB CHANNELS',
+    'PUBSUB NUMSUB', 'PUBSUB NUMPAT', 'CLIENT LIST', 'CLIENT GETNAME',
+    'SLOWLOG GET',
+])
+
+
+def split_scan_cursor(cursor, nodes):
+    """ Return the index of the node and the cursor on that node of a
+    ``SCAN`` cursor walking ``nodes`` nodes in turn
+    """
+    index = int(cursor) % nodes
+    return index, int(cursor) // nodes
+
+
+def join_scan_cursor(index, cursor, nodes):
+    """ Return the ``SCAN`` cursor going on at ``cursor`` of the node
+    ``index``, the next node starts once it's 0 and 0 ends the walk
+    """
+    if cursor == 0:
+        index += 1
+        if index == nodes:
+            return 0
+    return cursor * nodes + index
+
+
+class AsyncStrictRedisCluster(StrictRedis):
+    """ Asynchronous Redis Cluster client, every command returns a future.
+
+    Commands are routed by the CRC16 slot of their key. Each primary gets
+    its own :class:`gredis.client.AsyncStrictRedis` and so its own
+    connection pool, the other keyword arguments are passed to them.
+
+    The slot map is loaded with ``CLUSTER SLOTS`` from the first reachable
+    node. ``MOVED`` updates the slot and reloads the map in the background,
+    ``ASK`` retries once on the given node after ``ASKING``, up to
+    ``max_redirects`` times.
+
+    ``MGET``, ``MSET``, ``DEL``, ``UNLINK`` and ``TOUCH`` are split by
+    slot, the parts are sent as one pipeline per node and the nodes run
+    concurrently.
+
+    ``SCAN`` walks the primaries one after the other, its cursor tells the
+    node and the cursor on it. It's only valid while the primaries stay the
+    same.
+
+    .. code-block:: python
+
+        client = AsyncStrictRedisCluster(
+            startup_nodes=[{"host": "127.0.0.1", "port": 7000}])
+        yield client.mset({"a": 1, "b": 2})
+    """
+
+    node_class = AsyncStrictRedis
+    pipeline_class = None  # AsyncStrictClusterPipeline, set below
+
+    def __init__(self, host=None, port=6379, startup_nodes=None,
+                 max_redirects=5, **kwargs):
+        self.response_callbacks = self.__class__.RESPONSE_CALLBACKS.copy()
+        self.max_redirects = max_redirects
+        self.node_kwargs = kwargs
+        self.encoder = Encoder(kwargs.get('encoding', 'utf-8'),
+                               kwargs.get('encoding_errors', 'strict'),
+                               kwargs.get('decode_responses', False))
+
+        self.startup_nodes = []
+        if host is not None:
+            self.startup_nodes.append("{0}:{1}".format(host, port))
+        for node in startup_nodes or ():
+            self.startup_nodes.append(
+                "{0}:{1}".format(node["host"], node["port"]))
+        if not self.startup_nodes:
+            raise ValueError("A host or startup nodes are required")
+
+        # node name -> client of the node
+        self.nodes = {}
+        # slot -> node name
+        self.slots = [None] * CLUSTER_SLOTS
+        self._primaries = []
+        self._refreshing = None
+
+    def get_node(self, name):
+        "Return the client of the node ``host:port``"
+        client = self.nodes.get(name)
+        if client is None:
+            host, port = name.rsplit(":", 1)
+            client = self.node_class(host=host, port=int(port),
+                                     **self.node_kwargs)
+            self.nodes[name] = client
+        return client
+
+    @property
+    def primaries(self):
+        "Names of the nodes serving slots"
+        return list(self._primaries)
+
+    def _set_slot(self, slot, node):
+        self.slots[slot] = node
+        if node not in self._primaries:
+            self._primaries.append(node)
+
+    # SLOT MAP
+    def refresh_slots(self):
+        "Reload the slot map, concurrent calls share one ``CLUSTER SLOTS``"
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = self._load_slots()
+        return self._refreshing
+
+    def _refresh_in_background(self):
+        future = self.refresh_slots()
+        # the next command reports the failure
+        IOLoop.current().add_future(future, lambda f: f.exception())
+
+    @gen.coroutine
+    def _load_slots(self):
+        error = None
+        for name in chain(self.primaries, self.startup_nodes):
+            try:
+                ranges = yield self.get_node(name).execute_command(
+                    'CLUSTER SLOTS')
+            except (ConnectionError, TimeoutError, ResponseError) as e:
+                error = e
+                continue
+
+            host = name.rsplit(":", 1)[0]
+            slots = [None] * CLUSTER_SLOTS
+            for entry in ranges:
+                start, end, primary = entry[0], entry[1], entry[2]
+                node = "{0}:{1}".format(nativestr(primary[0]) or host,
+                                        primary[1])
+                slots[start:end + 1] = [node] * (end - start + 1)
+            self.slots = slots
+            self._primaries = sorted(set(n for n in slots if n is not None))
+            return
+        raise ConnectionError("Can't load the slot map: {0}".format(error))
+
+    def key_slot(self, key):
+        "Return the slot of ``key``"
+        return key_slot(self.encoder.encode(key))
+
+    def _command_slot(self, args):
+        command = args[0]
+        if command in ('EVAL', 'EVALSHA'):
+            if len(args) > 3 and int(args[2]) > 0:
+                return self.key_slot(args[3])
+            return None
+        if command in KEYLESS_COMMANDS or len(args) < 2:
+            return None
+        return self.key_slot(args[1])
+
+    def _node_for_slot(self, slot):
+        if slot is None:
+            return self._primaries[0]
+        node = self.slots[slot]
+        if node is None:
+            raise ConnectionError("Slot {0} is not served".format(slot))
+        return node
+
+    # COMMAND EXECUTION
+    @gen.coroutine
+    def execute_command(self, *args, **options):
+        "Execute a command on the node serving its key"
+        if not self._primaries:
+            yield self.refresh_slots()
+
+        command = args[0]
+        if command in ALL_NODES_COMMANDS:
+            replies = yield [self.get_node(name).execute_command(
+                *args, **options) for name in self.primaries]
+            raise gen.Return(ALL_NODES_COMMANDS[command](replies))
+        if command in SPLIT_COMMANDS:
+            result = yield self._execute_split(args, options)
+            raise gen.Return(result)
+        if command == 'SCAN':
+            result = yield self._execute_scan(args, options)
+            raise gen.Return(result)
+
+        result = yield self._execute_on_slot(
+            self._command_slot(args), args, options)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _execute_scan(self, args, options):
+        "Run ``SCAN`` on the primaries in turn"
+        nodes = self.primaries
+        index, cursor = split_scan_cursor(args[1], len(nodes))
+        cursor, items = yield self.get_node(nodes[index]).execute_command(
+            'SCAN', cursor, *args[2:], **options)
+        raise gen.Return((join_scan_cursor(index, cursor, len(nodes)), items))
+
+    def scan_iter(self, match=None, count=None, prefetch=1):
+        """ Return a :class:`gredis.scan.ScanIterator` of the key names of
+        every primary
+        """
+        def fetch(cursor):
+            return self.scan(cursor, match=match, count=count)
+        return ScanIterator(fetch, prefetch=prefetch)
+
+    @gen.coroutine
+    def _execute_on_slot(self, slot, args, options):
+        "Execute a command on the node of ``slot``, following redirects"
+        node = self._node_for_slot(slot)
+        asking = False
+        redirects = 0
+        while True:
+            client = self.get_node(node)
+            try:
+                if asking:
+                    pipeline = client.pipeline(transaction=False)
+                    pipeline.execute_command('ASKING')
+                    pipeline.execute_command(*args, **options)
+                    replies = yield pipeline.execute(raise_on_error=False)
+                    if isinstance(replies[1], Exception):
+                        raise replies[1]
+                    raise gen.Return(replies[1])
+                result = yield client.execute_command(*args, **options)
+                raise gen.Return(result)
+            except ResponseError as e:
+                redirect = _parse_redirect(e)
+                if redirect is None or redirects >= self.max_redirects:
+                    raise
+                kind, slot, node = redirect
+                asking = kind == 'ASK'
+                if not asking:
+                    self._set_slot(slot, node)
+                    self._refresh_in_background()
+            except ConnectionError:
+                # the node may have failed over, ask the others
+                if redirects >= self.max_redirects:
+                    raise
+                yield self.refresh_slots()
+                node = self._node_for_slot(slot)
+                asking = False
+            redirects += 1
+
+    @gen.coroutine
+    def _execute_parts(self, parts):
+        """ Execute the ``(slot, args, options)`` commands of ``parts``, one
+        pipeline per node, and return their replies in order. Errors are
+        returned as exception instances.
+        """
+        by_node = {}
+        for i, (slot, _, _) in enumerate(parts):
+            by_node.setdefault(self._node_for_slot(slot), []).append(i)
+        replies = [None] * len(parts)
+
+        @gen.coroutine
+        def execute_on_node(node, indexes):
+            pipeline = self.get_node(node).pipeline(transaction=False)
+            for i in indexes:
+                _, args, options = parts[i]
+                pipeline.execute_command(*args, **options)
+            try:
+                results = yield pipeline.execute(raise_on_error=False)
+            except (ConnectionError, TimeoutError) as e:
+                results = [e] * len(indexes)
+            for i, result in izip(indexes, results):
+                if (isinstance(result, (ConnectionError, TimeoutError)) or
+                        isinstance(result, ResponseError) and
+                        _parse_redirect(result) is not None):
+                    slot, args, options = parts[i]
+                    try:
+                        result = yield self._execute_on_slot(
+                            slot, args, options)
+                    except (ConnectionError, TimeoutError,
+                            ResponseError) as e:
+                        result = e
+                replies[i] = result
+
+        yield [execute_on_node(node, indexes)
+               for node, indexes in by_node.items()]
+        raise gen.Return(replies)
+
+    def _split(self, args):
+        "Group the keys of a multi-key command by slot"
+        command = args[0]
+        step = 2 if command in PAIRS_COMMANDS else 1
+        items = args[1:]
+        groups = {}
+        for i in range(0, len(items), step):
+            slot = self.key_slot(items[i])
+            groups.setdefault(slot, []).append(i // step)
+        return step, items, groups
+
+    @gen.coroutine
+    def _execute_split(self, args, options):
+        command = args[0]
+        step, items, groups = self._split(args)
+        if len(groups) <= 1:
+            result = yield self._execute_on_slot(
+                next(iter(groups), None), args, options)
+            raise gen.Return(result)
+
+        groups = list(groups.items())
+        parts = []
+        for slot, positions in groups:
+            part = chain.from_iterable(items[p * step:(p + 1) * step]
+                                       for p in positions)
+            parts.append((slot, (command,) + tuple(part), options))
+        replies = yield self._execute_parts(parts)
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+
+        merge = SPLIT_COMMANDS[command]
+        if merge is not None:
+            raise gen.Return(merge(replies))
+        # MGET, put the values back in the order of the keys
+        response = [None] * (len(items) // step)
+        for (_, positions), reply in izip(groups, replies):
+            for position, value in izip(positions, reply):
+                response[position] = value
+        raise gen.Return(response)
+
+    def pipeline(self, transaction=False, shard_hint=None):
+        """ Return a pipeline whose commands are sent as one pipeline per
+        node, transactions aren't supported across nodes.
+        """
+        if transaction:
+            raise ValueError("Transactions are not supported by "
+                             "AsyncStrictRedisCluster")
+        return self.pipeline_class(self)
+
+
+class AsyncStrictClusterPipeline(StrictRedis):
+    """ Pipeline of :class:`AsyncStrictRedisCluster`, ``execute()`` returns a
+    future of the replies in the order of the commands.
+
+    The commands are sent as one pipeline per node, the nodes run
+    concurrently. Commands whose keys span several slots run after them.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.command_stack = []
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def execute_command(self, *args, **options):
+        self.command_stack.append((args, options))
+        return self
+
+    def reset(self):
+        self.command_stack = []
+
+    @gen.coroutine
+    def execute(self, raise_on_error=True):
+        "Execute all the commands in the current pipeline"
+        stack, self.command_stack = self.command_stack, []
+        if not stack:
+            raise gen.Return([])
+        cluster = self.cluster
+        if not cluster._primaries:
+            yield cluster.refresh_slots()
+
+        # commands spanning several slots run on their own, after the others
+        parts, indexes, separate = [], [], []
+        for i, (args, options) in enumerate(stack):
+            command = args[0]
+            if (command in ALL_NODES_COMMANDS or command == 'SCAN' or
+                    command in SPLIT_COMMANDS and
+                    len(cluster._split(args)[2]) > 1):
+                separate.append(i)
+            else:
+                parts.append((cluster._command_slot(args), args, options))
+                indexes.append(i)
+
+        replies = [None] * len(stack)
+        part_replies = yield cluster._execute_parts(parts)
+        for i, reply in izip(indexes, part_replies):
+            replies[i] = reply
+        separate_replies = yield [self._execute_separate(*stack[i])
+                                  for i in separate]
+        for i, reply in izip(separate, separate_replies):
+            replies[i] = reply
+
+        if raise_on_error:
+            for i, reply in enumerate(replies):
+                if isinstance(reply, Exception):
+                    raise reply
+        raise gen.Return(replies)
+
+    @gen.coroutine
+    def _execute_separate(self, args, options):
+        try:
+            result = yield self.cluster.execute_command(*args, **options)
+        except (ConnectionError, TimeoutError, ResponseError) as e:
+            result = e
+        raise gen.Return(result)
+
+
+class AsyncClusterPipeline(AsyncStrictClusterPipeline, Redis):
+    "Pipeline of :class:`AsyncRedisCluster`"
+    pass
+
+
+class AsyncRedisCluster(AsyncStrictRedisCluster, Redis):
+    "Asynchronous Redis Cluster client with the :class:`redis.Redis` API"
+
+    node_class = AsyncRedis
+    pipeline_class = AsyncClusterPipeline
+
+
+AsyncStrictRedisCluster.pipeline_class = AsyncStrictClusterPipeline
@@ -6,100 +6,300 @@ asynchronous.
 from __future__ import unicode_literals, print_function, division
 
 import sys
+import codecs
 import socket
 import weakref
+import datetime
 
-from select import select
+from collections import deque
+from itertools import chain, repeat
 
 from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.concurrent import Future, is_future
 from tornado.tcpclient import TCPClient
 from tornado.iostream import StreamClosedError
 from redis.connection import (
-    Connection, ConnectionError, PythonParser, SocketBuffer,
-    SERVER_CLOSED_CONNECTION_ERROR, TimeoutError, SYM_CRLF, DefaultParser)
-from redis._compat import byte_to_chr, nativestr
+    Connection, ConnectionError, PythonParser,
+    SERVER_CLOSED_CONNECTION_ERROR, TimeoutError, SYM_CRLF, SYM_EMPTY,
+    DefaultParser, ConnectionPool)
+from redis._compat import nativestr
 from redis.exceptions import (
     InvalidResponse, RedisError, AuthenticationError,
     ResponseError)
 
 
-class StreamBuffer(SocketBuffer):
+NOT_ENOUGH_DATA = object()
+
+# decoding of the replies, besides the one of ``decode_responses``
+DECODE_RAW = "raw"
+DECODE_LAZY = "lazy"
+DECODINGS = (None, DECODE_RAW, DECODE_LAZY)
+
+# encodings in which a NUL byte is always the NUL character, the items of a
+# multi-bulk reply can be decoded all at once joined by NULs
+_NUL_SAFE_ENCODINGS = frozenset(['utf-8', 'ascii', 'iso8859-1', 'cp1252'])
+_nul_safe = {}
+# average size in bytes under which the items are decoded in one pass
+BATCH_ITEM_SIZE = 16
+
+
+def _is_nul_safe(encoding):
+    safe = _nul_safe.get(encoding)
+    if safe is None:
+        try:
+            safe = codecs.lookup(encoding).name in _NUL_SAFE_ENCODINGS
+        except LookupError:
+            safe = False
+        _nul_safe[encoding] = safe
+    return safe
+
+
+def decode_reply(response, encoding, errors):
+    """ Decode the ``bytes`` of a complete reply. The short items of a
+    multi-bulk reply are joined by NULs and decoded in one pass, the longer
+    ones are decoded without a Python level loop.
+    """
+    if response.__class__ is bytes:
+        return response.decode(encoding, errors)
+    if response.__class__ is not list or not response:
+        return response
+
+    length = len(response)
+    try:
+        if (len(response[0]) < BATCH_ITEM_SIZE and
+                _is_nul_safe(encoding)):
+            joined = b'\0'.join(response)
+            # no NUL in the items and they are short, splitting a long
+            # string costs more than decoding its parts
+            if (joined.count(b'\0') == length - 1 and
+                    len(joined) < BATCH_ITEM_SIZE * length):
+                return joined.decode(encoding, errors).split('\0')
+        return list(map(bytes.decode, response, repeat(encoding, length),
+                        repeat(errors, length)))
+    except TypeError:
+        # nil, integers, errors or nested replies
+        return [decode_reply(item, encoding, errors) for item in response]
+
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # Python 2
+    from collections import Sequence
+
+
+class LazyList(Sequence):
+    """ A multi-bulk reply whose items are only decoded when they are
+    accessed, nested replies are :class:`LazyList` too.
+    """
+
+    __slots__ = ('_items', '_encoding', '_errors')
+
+    def __init__(self, items, encoding, errors):
+        self._items = items
+        self._encoding = encoding
+        self._errors = errors
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyList(self._items[index], self._encoding, self._errors)
+        item = self._items[index]
+        cls = item.__class__
+        if cls is bytes:
+            # decoded once
+            item = self._items[index] = item.decode(self._encoding,
+                                                    self._errors)
+        elif cls is list:
+            item = self._items[index] = LazyList(item, self._encoding,
+                                                 self._errors)
+        return item
+
+    def __iter__(self):
+        for index in range(len(self._items)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, LazyList)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "LazyList(%r)" % (list(self), )
+
+    @property
+    def raw(self):
+        "The items not decoded yet are still ``bytes`` in this list"
+        return self._items
+
+
+class StreamBuffer(object):
+    """ Receive buffer of a stream.
+
+    The data received is kept in one ``bytes`` object consumed from
+    ``bytes_read`` on: lines are found with ``find`` and every value is
+    sliced out with a single copy. The consumed bytes are only dropped when
+    more data arrives, a chunk arriving while everything was consumed
+    becomes the buffer without a copy.
+    """
+
     def __init__(self, stream, socket_read_size):
-        super(StreamBuffer, self).__init__(None, socket_read_size)
         self._stream = stream
+        self.socket_read_size = socket_read_size
+        self._buffer = SYM_EMPTY
+        # offset of the first byte not consumed yet
+        self.bytes_read = 0
+        self._pending_read = None
+        # total bytes read from the stream, unlike ``bytes_read`` it is
+        # never reset
+        self.bytes_received = 0
 
-    @gen.coroutine
-    def _read_from_stream(self, length=None):
-        buf = self._buffer
-        buf.seek(self.bytes_written)
-        marker = 0
+    @property
+    def length(self):
+        "Number of bytes received but not consumed yet"
+        return len(self._buffer) - self.bytes_read
 
-        try:
-            while True:
-                try:
-                    data = yield self._stream.read_until_regex(b'\r\n')
-                except StreamClosedError:
-                    raise socket.error(SERVER_CLOSED_CONNECTION_ERROR)
+    def _read_from_stream(self, length=None):
+        """ Fill the buffer from the stream.
 
-                buf.write(data)
+        Without ``length`` whatever is available is read, up to
+        ``socket_read_size`` bytes in one chunk, otherwise exactly ``length``
+        bytes are read. While a read is pending its future is returned, so
+        a read abandoned by a timeout still fills the buffer.
+        """
+        if self._pending_read is not None:
+            return self._pending_read
 
-                data_length = len(data)
-                self.bytes_written += data_length
-                marker += data_length
+        future = self._fill(length)
+        if not future.done():
+            self._pending_read = future
+        return future
 
-                if length is not None and length > marker:
-                    continue
-                break
-        except socket.timeout:
-            raise TimeoutError("Timeout reading from stream")
+    @gen.coroutine
+    def _fill(self, length):
+        try:
+            if length is None:
+                data = yield self._stream.read_bytes(self.socket_read_size,
+                                                     partial=True)
+            else:
+                data = yield self._stream.read_bytes(length)
+        except StreamClosedError:
+            raise ConnectionError("Error while reading from stream: %s" %
+                                  (SERVER_CLOSED_CONNECTION_ERROR, ))
         except socket.error:
             e = sys.exc_info()[1]
             raise ConnectionError(
                 "Error while reading from stream: %s" % (e.args, ))
+        finally:
+            self._pending_read = None
+        self.append(data)
 
-    @gen.coroutine
-    def read(self, length):
-        length = length + 2
+    def append(self, data):
+        "Add the ``data`` received to the buffer"
+        buf = self._buffer
+        if buf is None:
+            # closed while reading
+            return
+        self.bytes_received += len(data)
+        if self.bytes_read < len(buf):
+            self._buffer = buf[self.bytes_read:] + data
+        else:
+            self._buffer = data
+        self.bytes_read = 0
 
-        if length > self.length:
-            yield self._read_from_stream(length - self.length)
+    def read(self, length):
+        """ Return a bulk payload of ``length`` bytes, or ``None`` when it
+        isn't completely buffered yet.
+        """
+        buf = self._buffer
+        start = self.bytes_read
+        end = start + length
+        if end + 2 > len(buf):
+            return None
+        self._consumed(end + 2)
+        return buf[start:end]
 
-        self._buffer.seek(self.bytes_read)
-        data = self._buffer.read(length)
-        self.bytes_read += len(data)
+    @gen.coroutine
+    def read_chunk(self, size):
+        """ Return up to ``size`` bytes of a payload being streamed, they
+        come straight from the stream once the buffer is drained.
+        """
+        while self._pending_read is not None:
+            yield self._pending_read
 
-        if self.bytes_read == self.bytes_written:
-            self.purge()
+        if self.length:
+            buf = self._buffer
+            start = self.bytes_read
+            end = start + min(size, self.length)
+            self._consumed(end)
+            raise gen.Return(buf[start:end])
 
-        raise gen.Return(data[:-2])
+        try:
+            data = yield self._stream.read_bytes(size, partial=True)
+        except StreamClosedError:
+            raise ConnectionError("Error while reading from stream: %s" %
+                                  (SERVER_CLOSED_CONNECTION_ERROR, ))
+        except socket.error:
+            e = sys.exc_info()[1]
+            raise ConnectionError(
+                "Error while reading from stream: %s" % (e.args, ))
+        self.bytes_received += len(data)
+        raise gen.Return(data)
 
-    @gen.coroutine
     def readline(self):
+        """ Return a line without CRLF, or ``None`` when no complete line is
+        buffered yet.
+        """
         buf = self._buffer
-        buf.seek(self.bytes_read)
-        data = buf.readline()
-
-        while not data.endswith(SYM_CRLF):
-            yield self._read_from_stream()
-            buf.seek(self.bytes_read)
-            data = buf.readline()
+        start = self.bytes_read
+        end = buf.find(SYM_CRLF, start)
+        if end < 0:
+            return None
+        self._consumed(end + 2)
+        return buf[start:end]
 
-        self.bytes_read += len(data)
+    def _consumed(self, position):
+        "Mark the buffer read up to ``position``"
+        if position < len(self._buffer):
+            self.bytes_read = position
+        else:
+            # don't keep a large reply until the next one arrives
+            self._buffer = SYM_EMPTY
+            self.bytes_read = 0
 
-        if self.bytes_read == self.bytes_written:
-            self.purge()
+    def purge(self):
+        "Drop everything buffered"
+        self._buffer = SYM_EMPTY
+        self.bytes_read = 0
 
-        raise gen.Return(data[:-2])
+    def close(self):
+        self._buffer = None
 
 
 class AsyncParser(PythonParser):
-    """ Parser class for connections using tornado asynchronous """
+    """ Parser class for connections using tornado asynchronous
+
+    Every complete reply already in the buffer is decoded without yielding,
+    nested multi-bulk replies are kept on an explicit stack so the parser
+    can suspend anywhere and resume when more bytes arrived.
+    """
 
     def __init__(self, socket_read_size):
         self.socket_read_size = socket_read_size
         self.encoder = None
         self._stream = None
         self._buffer = None
+        # DECODE_RAW or DECODE_LAZY for the replies of the current command
+        self.decoding = None
+        self._reset_state()
 
     def __del__(self):
         try:
@@ -107,15 +307,26 @@ class AsyncParser(PythonParser):
         except Exception:
             pass
 
+    def _reset_state(self):
+        # unfinished multi-bulk replies as [elements, remaining] pairs
+        self._stack = []
+        # length of a bulk payload whose header has been consumed
+        self._bulk_length = None
+
     def on_connect(self, connection):
         """ Called when stream connects """
         self._stream = weakref.proxy(connection._stream)
         self._buffer = StreamBuffer(self._stream, self.socket_read_size)
         self.encoder = connection.encoder
+        self._reset_state()
 
     def on_disconnect(self):
         if self._stream is not None:
-            self._stream.close()
+            try:
+                self._stream.close()
+            except ReferenceError:
+                # the stream was already collected
+                pass
             self._stream = None
 
         if self._buffer is not None:
@@ -123,63 +334,157 @@ class AsyncParser(PythonParser):
             self._buffer = None
 
         self.encoding = None
+        self._reset_state()
 
     def can_read(self):
         return self._buffer and bool(self._buffer.length)
 
     @gen.coroutine
     def read_response(self):
-        response = yield self._buffer.readline()
+        buf = self._buffer
+        while True:
+            response = self._parse()
+            if response is not NOT_ENOUGH_DATA:
+                raise gen.Return(response)
+
+            if self._bulk_length is None:
+                yield buf._read_from_stream()
+            else:
+                # read the rest of the payload with one exact-length read
+                yield buf._read_from_stream(
+                    self._bulk_length + 2 - buf.length)
 
-        if not response:
+    @gen.coroutine
+    def read_bulk_length(self):
+        """ Read the header of a bulk reply, return the length of its payload
+        or ``None`` for a nil reply. The payload is left to
+        ``StreamBuffer.read_chunk`` and ``read_bulk_end``.
+        """
+        buf = self._buffer
+        line = buf.readline()
+        while line is None:
+            yield buf._read_from_stream()
+            line = buf.readline()
+        if not line:
             raise ConnectionError(SERVER_CLOSED_CONNECTION_ERROR)
 
-        byte, response = byte_to_chr(response[0]), response[1:]
-
-        if byte not in ('-', '+', ':', '$', '*'):
-            raise InvalidResponse("Protocol Error: %s, %s" %
-                                  (str(byte), str(response)))
-
-        # server returned an error
-        if byte == '-':
-            response = nativestr(response)
-            error = self.parse_error(response)
-            # if the error is a ConnectionError, raise immediately so the user
-            # is notified
-            if isinstance(error, ConnectionError):
-                raise error
-            # otherwise, we're dealing with a ResponseError that might belong
-            # inside a pipeline response. the connection's read_response()
-            # and/or the pipeline's execute() will raise this error if
-            # necessary, so just return the exception instance here.
-            raise gen.Return(error)
-        # single value
-        elif byte == '+':
-            pass
-        # int value
-        elif byte == ':':
-            response = int(response)
-        # bulk response
-        elif byte == '$':
-            length = int(response)
-            if length == -1:
-                raise gen.Return(None)
-            response = yield self._buffer.read(length)
-        # multi-bulk response
-        elif byte == '*':
-            length = int(response)
-            if length == -1:
-                raise gen.Return(None)
-            response = []
-
-            for i in range(length):
-                res = yield self.read_response()
-                response.append(res)
-
-        if isinstance(response, bytes):
-            response = self.encoder.decode(response)
+        byte, line = line[:1], line[1:]
+        if byte == b'-':
+            raise self.parse_error(nativestr(line))
+        if byte != b'$':
+            raise InvalidResponse("Protocol Error: expected a bulk reply, "
+                                  "got %s, %s" % (str(byte), str(line)))
+        length = int(line)
+        raise gen.Return(None if length == -1 else length)
 
-        raise gen.Return(response)
+    @gen.coroutine
+    def read_bulk_end(self):
+        "Read the CRLF after a streamed bulk payload"
+        buf = self._buffer
+        while buf.read(0) is None:
+            yield buf._read_from_stream(2 - buf.length)
+
+    def read_buffered_responses(self):
+        "Return every reply which is completely buffered, without waiting"
+        responses = []
+        while self._buffer.length or self._bulk_length is not None:
+            response = self._parse()
+            if response is NOT_ENOUGH_DATA:
+                break
+            responses.append(response)
+        return responses
+
+    def _parse(self):
+        """ Decode a reply from the buffered data, return
+        ``NOT_ENOUGH_DATA`` if it's incomplete.
+
+        The values are kept as ``bytes`` until the reply is complete, then
+        it is decoded at once.
+        """
+        buf = self._buffer
+        stack = self._stack
+
+        while True:
+            if self._bulk_length is not None:
+                response = buf.read(self._bulk_length)
+                if response is None:
+                    return NOT_ENOUGH_DATA
+                self._bulk_length = None
+            else:
+                response = buf.readline()
+                if response is None:
+                    return NOT_ENOUGH_DATA
+
+                if not response:
+                    raise ConnectionError(SERVER_CLOSED_CONNECTION_ERROR)
+
+                byte, response = response[:1], response[1:]
+
+                # bulk response
+                if byte == b'$':
+                    length = int(response)
+                    if length == -1:
+                        response = None
+                    else:
+                        self._bulk_length = length
+                        continue
+                # int value
+                elif byte == b':':
+                    response = int(response)
+                    if not stack:
+                        # nothing to decode
+                        return response
+                # multi-bulk response
+                elif byte == b'*':
+                    length = int(response)
+                    if length == -1:
+                        response = None
+                    elif length == 0:
+                        response = []
+                    else:
+                        stack.append([[], length])
+                        continue
+                # single value
+                elif byte == b'+':
+                    pass
+                # server returned an error
+                elif byte == b'-':
+                    response = nativestr(response)
+                    response = self.parse_error(response)
+                    # if the error is a ConnectionError, raise immediately so
+                    # the user is notified
+                    if isinstance(response, ConnectionError):
+                        raise response
+                    # otherwise, we're dealing with a ResponseError that
+                    # might belong inside a pipeline response. the
+                    # connection's read_response() and/or the pipeline's
+                    # execute() will raise this error if necessary, so just
+                    # return the exception instance here.
+                else:
+                    raise InvalidResponse("Protocol Error: %s, %s" %
+                                          (str(byte), str(response)))
+
+            # a complete value, pop all the multi-bulk replies it completes
+            while stack:
+                top = stack[-1]
+                top[0].append(response)
+                top[1] -= 1
+                if top[1]:
+                    break
+                response = stack.pop()[0]
+            else:
+                return self._decode(response)
+
+    def _decode(self, response):
+        "Decode a complete reply the way the current command wants"
+        encoder = self.encoder
+        if not encoder.decode_responses or self.decoding == DECODE_RAW:
+            return response
+        if self.decoding == DECODE_LAZY and response.__class__ is list:
+            return LazyList(response, encoder.encoding,
+                            encoder.encoding_errors)
+        return decode_reply(response, encoder.encoding,
+                            encoder.encoding_errors)
 
 
 class AsyncConnection(Connection, TCPClient):
@@ -188,17 +493,74 @@ class AsyncConnection(Connection, TCPClient):
         TCPClient.__init__(self, kwargs.pop("resolver", None),
                            kwargs.pop("io_loop", None))
 
+        self.write_buffer_high_water = kwargs.pop("write_buffer_high_water",
+                                                  65536)
+        # bytes written but not flushed to the socket yet
+        self._write_pending = 0
+        # IOLoop time after which connect, write and read fail, set by the
+        # client for the command using the connection
+        self.deadline = None
+
         Connection.__init__(self, parser_class=AsyncParser, *args, **kwargs)
 
         self._stream = None
 
+        # state of multiplexed mode, see ``execute_multiplexed``
+        self._pending = deque()
+        self._outgoing = []
+        self._multiplex_reading = False
+        self._multiplex_ready = False
+
+    @property
+    def decoding(self):
+        """ ``DECODE_RAW`` or ``DECODE_LAZY`` for the replies of the
+        command using the connection, set by the client
+        """
+        return self._parser.decoding
+
+    @decoding.setter
+    def decoding(self, decoding):
+        self._parser.decoding = decoding
+
+    @property
+    def bytes_received(self):
+        "Bytes read from the server since the connection was opened"
+        buf = getattr(self._parser, '_buffer', None)
+        return buf.bytes_received if buf is not None else 0
+
+    def _time_left(self, timeout):
+        """ Return the seconds an operation limited to ``timeout`` seconds
+        may take before the deadline, ``None`` if it isn't limited
+        """
+        if self.deadline is None:
+            return timeout
+        left = max(self.deadline - IOLoop.current().time(), 0)
+        if timeout is None or left < timeout:
+            return left
+        return timeout
+
+    def _limit(self, future, timeout):
+        "Return ``future``, failing with ``gen.TimeoutError`` after ``timeout``"
+        if timeout is None or future.done():
+            return future
+        return gen.with_timeout(datetime.timedelta(seconds=timeout), future,
+                                quiet_exceptions=(ConnectionError,
+                                                  StreamClosedError))
+
     @gen.coroutine
     def connect(self):
 
         if self._stream:
             return
+        connecting = self._connect()
         try:
-            stream = yield self._connect()
+            stream = yield self._limit(
+                connecting, self._time_left(self.socket_connect_timeout))
+        except gen.TimeoutError:
+            # close the stream if it connects after all
+            connecting.add_done_callback(
+                lambda f: f.exception() is None and f.result().close())
+            raise TimeoutError("Timeout connecting to server")
         except socket.error:
             e = sys.exc_info()[1]
             raise ConnectionError(self._error_message(e))
@@ -211,6 +573,13 @@ class AsyncConnection(Connection, TCPClient):
             self.disconnect()
             raise
 
+        # run any user callbacks. right now the only internal callback
+        # is for pubsub channel/pattern resubscription
+        for callback in self._connect_callbacks:
+            result = callback(self)
+            if is_future(result):
+                yield result
+
     @gen.coroutine
     def _connect(self):
         stream = yield TCPClient.connect(self, self.host, self.port)
@@ -246,15 +615,28 @@ class AsyncConnection(Connection, TCPClient):
 
     @gen.coroutine
     def send_packed_command(self, command):
-        "Send an already packed command to the Redis server"
-        if not self._sock:
+        """Send an already packed command to the Redis server
+
+        The chunks are written at once, the stream is only waited for when
+        more than ``write_buffer_high_water`` bytes are not flushed yet.
+        """
+        if not self._stream:
             yield self.connect()
         try:
-            if isinstance(command, str):
-                command = [command]
-            for item in command:
-                yield self._stream.write(item)
+            if not isinstance(command, bytes):
+                command = SYM_EMPTY.join(command)
+            future = self._stream.write(command)
+
+            size = len(command)
+            self._write_pending += size
+            future.add_done_callback(
+                lambda f: self._on_write_flushed(f, size))
+            if self._write_pending > self.write_buffer_high_water:
+                yield self._limit(future, self._time_left(self.socket_timeout))
 
+        except gen.TimeoutError:
+            self.disconnect()
+            raise TimeoutError("Timeout writing to socket")
         except StreamClosedError:
             self.disconnect()
             raise TimeoutError("Timeout writing to socket")
@@ -271,6 +653,11 @@ class AsyncConnection(Connection, TCPClient):
             self.disconnect()
             raise
 
+    def _on_write_flushed(self, future, size):
+        self._write_pending -= size
+        # a failed write is noticed by the read of its reply
+        future.exception()
+
     @gen.coroutine
     def send_command(self, *args):
         "Pack and send a command to the Redis server"
@@ -278,19 +665,52 @@ class AsyncConnection(Connection, TCPClient):
 
     @gen.coroutine
     def can_read(self, timeout=0):
-        "Poll the socket to see if there's data that can be read."
-        sock = self._stream
-        if not sock:
+        "Check whether there's data that can be read, without blocking"
+        readable = yield self.wait_readable(timeout)
+        raise gen.Return(readable)
+
+    @gen.coroutine
+    def wait_readable(self, timeout=None):
+        """ Wait until there's data that can be read, return ``False`` if
+        ``timeout`` seconds passed first. ``timeout`` 0 only checks the data
+        already received.
+        """
+        if not self._stream:
             yield self.connect()
-            sock = self._stream.socket
-        raise gen.Return(self._parser.can_read() or
-                         bool(select([sock], [], [], timeout)[0]))
+        if self._parser.can_read():
+            raise gen.Return(True)
+
+        try:
+            read = self._parser._buffer._read_from_stream()
+            if timeout is None:
+                yield read
+            elif timeout <= 0:
+                if not read.done():
+                    raise gen.Return(False)
+                read.result()
+            else:
+                yield gen.with_timeout(datetime.timedelta(seconds=timeout),
+                                       read, quiet_exceptions=ConnectionError)
+        except gen.TimeoutError:
+            raise gen.Return(False)
+        except ConnectionError:
+            self.disconnect()
+            raise
+        raise gen.Return(True)
 
     @gen.coroutine
-    def read_response(self):
-        "Read the response from a previously sent command"
+    def read_response(self, blocking=False):
+        """ Read the response from a previously sent command, in at most
+        ``socket_timeout`` seconds. The reply of a ``blocking`` command is
+        only limited by the deadline.
+        """
+        timeout = self._time_left(None if blocking else self.socket_timeout)
         try:
-            response = yield self._parser.read_response()
+            response = yield self._limit(self._parser.read_response(), timeout)
+        except gen.TimeoutError:
+            # the rest of the reply must not be read by the next command
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
         except:
             self.disconnect()
             raise
@@ -300,6 +720,127 @@ class AsyncConnection(Connection, TCPClient):
 
         raise gen.Return(response)
 
+    @gen.coroutine
+    def read_bulk_length(self):
+        """ Read the header of a bulk reply without its payload, return the
+        length of the payload or ``None`` for a nil reply. The payload must
+        then be read with ``read_bulk_chunk`` and ``read_bulk_end``.
+        """
+        try:
+            length = yield self._limit(self._parser.read_bulk_length(),
+                                       self._time_left(self.socket_timeout))
+        except ResponseError:
+            raise
+        except gen.TimeoutError:
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
+        except:
+            self.disconnect()
+            raise
+        raise gen.Return(length)
+
+    @gen.coroutine
+    def read_bulk_chunk(self, size):
+        "Return up to ``size`` bytes of the payload of a bulk reply"
+        try:
+            data = yield self._limit(self._parser._buffer.read_chunk(size),
+                                     self._time_left(self.socket_timeout))
+        except gen.TimeoutError:
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
+        except:
+            self.disconnect()
+            raise
+        raise gen.Return(data)
+
+    @gen.coroutine
+    def read_bulk_end(self):
+        "Read the end of a bulk reply whose payload was completely read"
+        try:
+            yield self._limit(self._parser.read_bulk_end(),
+                              self._time_left(self.socket_timeout))
+        except gen.TimeoutError:
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
+        except:
+            self.disconnect()
+            raise
+
+    def read_buffered_responses(self):
+        """ Return the replies which already are completely received, error
+        replies are returned as exception instances.
+        """
+        try:
+            return self._parser.read_buffered_responses()
+        except:
+            self.disconnect()
+            raise
+
+    def execute_multiplexed(self, commands):
+        """ Send ``commands`` without waiting for the replies of earlier
+        ones and return a future of the reply for each of them.
+
+        A single reader loop resolves the futures in the order the commands
+        were written, so any number of coroutines can share the connection.
+        The connection must not be used by ``send_command`` and
+        ``read_response`` in this mode.
+        """
+        futures = [Future() for _ in commands]
+        self._pending.extend(futures)
+        self._outgoing.extend(self.pack_commands(commands))
+
+        if not self._multiplex_reading:
+            self._multiplex_reading = True
+            self._read_multiplexed()
+        elif self._multiplex_ready:
+            self._flush_outgoing()
+        return futures
+
+    @property
+    def pending_replies(self):
+        "Number of multiplexed commands waiting for a reply"
+        return len(self._pending)
+
+    def _flush_outgoing(self):
+        data = SYM_EMPTY.join(self._outgoing)
+        del self._outgoing[:]
+        try:
+            future = self._stream.write(data)
+        except StreamClosedError:
+            # the reader loop fails the pending futures
+            return
+        # errors are reported by the reader loop
+        future.add_done_callback(lambda f: f.exception())
+
+    @gen.coroutine
+    def _read_multiplexed(self):
+        pending = self._pending
+        try:
+            yield self.connect()
+            self._flush_outgoing()
+            self._multiplex_ready = True
+            while pending:
+                response = yield self._limit(self._parser.read_response(),
+                                             self.socket_timeout)
+                future = pending.popleft()
+                if isinstance(response, ResponseError):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
+        except Exception:
+            error = sys.exc_info()[1]
+            if isinstance(error, StreamClosedError):
+                error = ConnectionError(SERVER_CLOSED_CONNECTION_ERROR)
+            elif isinstance(error, gen.TimeoutError):
+                error = TimeoutError("Timeout reading from socket")
+            self.disconnect()
+            del self._outgoing[:]
+            while pending:
+                pending.popleft().set_exception(error)
+        finally:
+            self._multiplex_reading = False
+            self._multiplex_ready = False
+
     def to_blocking_connection(self, socket_read_size=65536):
         """ Convert asynchronous connection to blocking socket connection
         """
@@ -312,3 +853,233 @@ class AsyncConnection(Connection, TCPClient):
 
         conn._sock = self._stream.socket
         return conn
+
+
+class AsyncConnectionPool(ConnectionPool):
+    """ Connection pool for :class:`AsyncConnection`.
+
+    When ``max_connections`` connections are in use callers wait for a
+    released one instead of getting a "Too many connections" error, the
+    wait is limited to ``timeout`` seconds if it's given.
+
+    ``min_connections`` connections are opened in advance and kept alive,
+    the others are closed after being idle for ``idle_timeout`` seconds.
+    A connection idle for more than ``health_check_interval`` seconds is
+    checked with ``PING`` before handing it out.
+
+    With ``multiplexed_connections`` the pool also keeps that many shared
+    connections for :meth:`AsyncConnection.execute_multiplexed`, they are
+    not counted in ``max_connections``.
+
+    With ``blocking_connections`` the blocking commands get a pool of their
+    own of at most that many connections, see :meth:`get_blocking_pool`.
+    """
+
+    def __init__(self, connection_class=AsyncConnection, max_connections=None,
+                 min_connections=0, timeout=None, idle_timeout=None,
+                 health_check_interval=None, multiplexed_connections=0,
+                 blocking_connections=None, **connection_kwargs):
+        self.min_connections = min_connections
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.multiplexed_connections = multiplexed_connections
+        self.blocking_connections = blocking_connections
+        self._blocking_pool = None
+        self._connect_callbacks = []
+
+        ConnectionPool.__init__(self, connection_class, max_connections,
+                                **connection_kwargs)
+
+        if self.min_connections > self.max_connections:
+            raise ValueError('"min_connections" must not be greater than '
+                             '"max_connections"')
+        if self.min_connections:
+            IOLoop.current().add_callback(self.warm_up)
+
+    def reset(self):
+        if getattr(self, "_reaper", None) is not None:
+            self._reaper.stop()
+        ConnectionPool.reset(self)
+        self._waiters = deque()
+        self._released_at = {}
+        self._reaper = None
+        self._multiplexed = []
+
+    def register_connect_callback(self, callback):
+        """ Run ``callback`` with the connection whenever a connection of the
+        pool has connected, it may return a future.
+        """
+        self._connect_callbacks.append(callback)
+        for connection in chain(self._available_connections,
+                                self._in_use_connections, self._multiplexed):
+            self._register_callbacks(connection)
+
+    def _register_callbacks(self, connection):
+        # ``PubSub.reset()`` clears the callbacks of its connection
+        for callback in self._connect_callbacks:
+            if callback not in connection._connect_callbacks:
+                connection.register_connect_callback(callback)
+
+    def make_connection(self):
+        "Create a new connection"
+        connection = ConnectionPool.make_connection(self)
+        self._register_callbacks(connection)
+        return connection
+
+    @gen.coroutine
+    def warm_up(self):
+        "Open connections until ``min_connections`` of them are alive"
+        connections = []
+        while self._created_connections < self.min_connections:
+            connection = self.make_connection()
+            self._in_use_connections.add(connection)
+            connections.append(connection)
+        try:
+            yield [connection.connect() for connection in connections]
+        finally:
+            for connection in connections:
+                self.release(connection)
+
+    @gen.coroutine
+    def get_connection(self, command_name, *keys, **options):
+        "Get a connection from the pool, wait for one if all are in use"
+        self._checkpid()
+        released_at = None
+        try:
+            connection = self._available_connections.pop()
+        except IndexError:
+            if self._created_connections < self.max_connections:
+                connection = self.make_connection()
+            else:
+                connection = yield self._wait_for_connection()
+        else:
+            released_at = self._released_at.pop(connection)
+
+        self._in_use_connections.add(connection)
+        try:
+            yield self._check_health(connection, released_at)
+        except:
+            self.release(connection)
+            raise
+        raise gen.Return(connection)
+
+    @gen.coroutine
+    def _wait_for_connection(self):
+        waiter = Future()
+        self._waiters.append(waiter)
+        if self.timeout is None:
+            connection = yield waiter
+            raise gen.Return(connection)
+
+        try:
+            connection = yield gen.with_timeout(
+                datetime.timedelta(seconds=self.timeout), waiter)
+        except gen.TimeoutError:
+            # the connection may be handed over after the timeout fired
+            if waiter.done():
+                raise gen.Return(waiter.result())
+            self._waiters.remove(waiter)
+            raise ConnectionError("No connection available.")
+        raise gen.Return(connection)
+
+    @gen.coroutine
+    def _check_health(self, connection, released_at):
+        stream = connection._stream
+        if stream is None:
+            return
+        if stream.closed():
+            connection.disconnect()
+            return
+
+        interval = self.health_check_interval
+        if interval is None or released_at is None:
+            return
+        if IOLoop.current().time() - released_at < interval:
+            return
+        try:
+            yield connection.send_command('PING')
+            response = yield connection.read_response()
+            if nativestr(response) != 'PONG':
+                raise ConnectionError('Bad response for PING: %r' % response)
+        except (ConnectionError, TimeoutError):
+            # the connection will be reestablished by the next command
+            connection.disconnect()
+
+    def release(self, connection):
+        "Releases the connection back to the pool"
+        self._checkpid()
+        if connection.pid != self.pid:
+            return
+        if connection not in self._in_use_connections:
+            return
+        self._register_callbacks(connection)
+        connection.deadline = None
+        connection.decoding = None
+
+        # hand the connection over to the first caller still waiting
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return
+
+        self._in_use_connections.remove(connection)
+        self._available_connections.append(connection)
+        self._released_at[connection] = IOLoop.current().time()
+
+        if self.idle_timeout is not None and self._reaper is None:
+            self._reaper = PeriodicCallback(self._reap_idle_connections,
+                                            self.idle_timeout * 1000 / 2)
+            self._reaper.start()
+
+    def _reap_idle_connections(self):
+        deadline = IOLoop.current().time() - self.idle_timeout
+        # the longest idle connections are at the head
+        for connection in list(self._available_connections):
+            if self._created_connections <= self.min_connections:
+                break
+            if self._released_at[connection] > deadline:
+                break
+            self._available_connections.remove(connection)
+            del self._released_at[connection]
+            self._created_connections -= 1
+            connection.disconnect()
+
+    def get_multiplexed_connection(self):
+        "Get the shared connection with the fewest replies pending"
+        self._checkpid()
+        if self._multiplexed:
+            connection = min(self._multiplexed,
+                             key=lambda c: c.pending_replies)
+            if (not connection.pending_replies or
+                    len(self._multiplexed) >= self.multiplexed_connections):
+                return connection
+        connection = self.connection_class(**self.connection_kwargs)
+        self._register_callbacks(connection)
+        self._multiplexed.append(connection)
+        return connection
+
+    def get_blocking_pool(self):
+        """ Return the pool of the connections of the blocking commands, or
+        ``None`` without ``blocking_connections``
+        """
+        if self.blocking_connections is None:
+            return None
+        if self._blocking_pool is None:
+            self._blocking_pool = AsyncConnectionPool(
+                self.connection_class, self.blocking_connections,
+                timeout=self.timeout, idle_timeout=self.idle_timeout,
+                **self.connection_kwargs)
+        return self._blocking_pool
+
+    def disconnect(self):
+        "Disconnects all connections in the pool"
+        if self._reaper is not None:
+            self._reaper.stop()
+            self._reaper = None
+        ConnectionPool.disconnect(self)
+        for connection in self._multiplexed:
+            connection.disconnect()
+        if self._blocking_pool is not None:
+            self._blocking_pool.disconnect()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Instrumentation hooks of the command execution.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import math
+from timeit import default_timer as timer
+
+from redis.exceptions import TimeoutError
+
+# commands whose arguments are all keys, or key value pairs
+MULTI_KEY_COMMANDS = frozenset([
+    'MGET', 'DEL', 'EXISTS', 'UNLINK', 'TOUCH', 'WATCH', 'SINTER', 'SUNION',
+    'SDIFF', 'PFCOUNT',
+])
+PAIRS_COMMANDS = frozenset(['MSET', 'MSETNX'])
+
+
+class CommandEvent(object):
+    """ What happened while a command was executed, passed to the hooks of
+    an :class:`Instrument`.
+
+    Times are in seconds. ``pool_wait``, ``connect_time``, ``round_trip``,
+    ``bytes_written`` and ``bytes_read`` are only measured for commands
+    sent on a pooled connection of their own, they are ``None`` for
+    multiplexed and auto pipelined commands and for the commands of the
+    ``blocking_connections``. ``connect_time`` is also
+    ``None`` when the connection was already open.
+
+    ``hedged`` is set when the command was sent a second time because of
+    ``hedge_after``.
+    """
+
+    __slots__ = ('command', 'args', 'keys', 'started_at', 'duration',
+                 'pool_wait', 'connect_time', 'round_trip', 'bytes_written',
+                 'bytes_read', 'error', 'hedged')
+
+    def __init__(self, args):
+        self.command = args[0]
+        self.args = args
+        if self.command in MULTI_KEY_COMMANDS:
+            self.keys = len(args) - 1
+        elif self.command in PAIRS_COMMANDS:
+            self.keys = (len(args) - 1) // 2
+        else:
+            self.keys = 1 if len(args) > 1 else 0
+        self.started_at = timer()
+        self.duration = None
+        self.pool_wait = None
+        self.connect_time = None
+        self.round_trip = None
+        self.bytes_written = None
+        self.bytes_read = None
+        self.error = None
+        self.hedged = False
+
+
+class Instrument(object):
+    """ Hooks called around every command of a client, given with its
+    ``instruments`` option. Subclasses override the hooks they need, they
+    must not block.
+    """
+
+    def before_command(self, event):
+        "Called with the :class:`CommandEvent` before sending the command"
+
+    def after_command(self, event):
+        """ Called with the complete :class:`CommandEvent` once the reply
+        was parsed, or the command failed with ``event.error``
+        """
+
+
+class LatencyHistogram(Instrument):
+    """ Latency histogram of each command, with four buckets per power of
+    two microseconds, i.e. about 19% wide.
+
+    .. code-block:: python
+
+        histogram = LatencyHistogram()
+        client = AsyncRedis(instruments=[histogram])
+        ...
+        print(histogram.snapshot()["GET"]["p99"])
+    """
+
+    SUB_BUCKETS = 4
+
+    def __init__(self):
+        # command -> [count, total, max, {bucket index: count}, timeouts,
+        # hedged]
+        self._commands = {}
+
+    def after_command(self, event):
+        duration = event.duration
+        stats = self._commands.get(event.command)
+        if stats is None:
+            stats = self._commands[event.command] = [0, 0.0, 0.0, {}, 0, 0]
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
+        index = self.bucket(duration)
+        buckets = stats[3]
+        buckets[index] = buckets.get(index, 0) + 1
+        if isinstance(event.error, TimeoutError):
+            stats[4] += 1
+        if event.hedged:
+            stats[5] += 1
+
+    @classmethod
+    def bucket(cls, duration):
+        "Return the index of the bucket of ``duration`` seconds"
+        micros = duration * 1e6
+        if micros < 1:
+            return 0
+        mantissa, exponent = math.frexp(micros)
+        return (exponent * cls.SUB_BUCKETS +
+                int((mantissa - 0.5) * 2 * cls.SUB_BUCKETS))
+
+    @classmethod
+    def upper_bound(cls, index):
+        "Return the upper bound of the bucket ``index``, in seconds"
+        exponent, sub = divmod(index, cls.SUB_BUCKETS)
+        if not exponent:
+            return 1e-6
+        return (2.0 ** (exponent - 1) *
+                (1 + (sub + 1) / cls.SUB_BUCKETS)) / 1e6
+
+    def _percentile(self, buckets, count, percentile):
+        rank = count * percentile / 100.0
+        seen = 0
+        for index in sorted(buckets):
+            seen += buckets[index]
+            if seen >= rank:
+                return self.upper_bound(index)
+        return None
+
+    def snapshot(self):
+        """ Return the statistics of each command: ``count``, ``total`` and
+        ``max`` seconds, the ``p50``, ``p90``, ``p99`` and ``p999`` upper
+        bounds, the ``buckets`` as ``(upper bound, count)`` pairs and the
+        number of ``timeouts`` and of ``hedged`` commands.
+        """
+        result = {}
+        for command, stats in self._commands.items():
+            count, total, maximum, buckets, timeouts, hedged = stats
+            result[command] = {
+                'count': count,
+                'total': total,
+                'max': maximum,
+                'timeouts': timeouts,
+                'hedged': hedged,
+                'p50': self._percentile(buckets, count, 50),
+                'p90': self._percentile(buckets, count, 90),
+                'p99': self._percentile(buckets, count, 99),
+                'p999': self._percentile(buckets, count, 99.9),
+                'buckets': [(self.upper_bound(index), buckets[index])
+                            for index in sorted(buckets)],
+            }
+        return result
+
+    def reset(self):
+        "Forget everything recorded"
+        self._commands = {}
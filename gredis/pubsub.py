@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Share one Redis pub/sub connection between many local subscribers.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+from tornado import gen
+from tornado.log import app_log
+
+
+class PubSubHub(object):
+    """ Fan out the messages of one :class:`gredis.client.AsyncPubSub` to
+    any number of local listeners.
+
+    Channel and pattern subscriptions are reference counted: ``SUBSCRIBE``
+    is only sent for the first listener of a channel and ``UNSUBSCRIBE``
+    after the last one went away. A listener is a callable which gets the
+    message dict, e.g. a :class:`gredis.client.MessageQueue`.
+
+    .. code-block:: python
+
+        hub = PubSubHub(client)
+        queue = MessageQueue(maxsize=100)
+        yield hub.subscribe("chat", queue)
+        message = yield queue.get()
+        yield hub.unsubscribe("chat", queue)
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._pubsub = client.pubsub()
+        self._channels = {}
+        self._patterns = {}
+        self._listener = None
+
+    def _normalize(self, name):
+        encoder = self._pubsub.encoder
+        return encoder.decode(encoder.encode(name))
+
+    @gen.coroutine
+    def subscribe(self, channel, listener):
+        "Pass the messages of ``channel`` to ``listener``"
+        channel = self._normalize(channel)
+        listeners = self._channels.setdefault(channel, [])
+        listeners.append(listener)
+        if len(listeners) == 1:
+            yield self._pubsub.subscribe(channel)
+            self._start()
+
+    @gen.coroutine
+    def unsubscribe(self, channel, listener):
+        "Stop passing the messages of ``channel`` to ``listener``"
+        channel = self._normalize(channel)
+        if self._remove(self._channels, channel, listener):
+            yield self._pubsub.unsubscribe(channel)
+
+    @gen.coroutine
+    def psubscribe(self, pattern, listener):
+        "Pass the messages of channels matching ``pattern`` to ``listener``"
+        pattern = self._normalize(pattern)
+        listeners = self._patterns.setdefault(pattern, [])
+        listeners.append(listener)
+        if len(listeners) == 1:
+            yield self._pubsub.psubscribe(pattern)
+            self._start()
+
+    @gen.coroutine
+    def punsubscribe(self, pattern, listener):
+        "Stop passing the messages matching ``pattern`` to ``listener``"
+        pattern = self._normalize(pattern)
+        if self._remove(self._patterns, pattern, listener):
+            yield self._pubsub.punsubscribe(pattern)
+
+    def _remove(self, subscriptions, name, listener):
+        "Remove ``listener``, return whether it was the last one of ``name``"
+        listeners = subscriptions.get(name)
+        if not listeners or listener not in listeners:
+            return False
+        listeners.remove(listener)
+        if listeners:
+            return False
+        del subscriptions[name]
+        return True
+
+    def _start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = self._pubsub.listen(self._dispatch)
+
+    def _dispatch(self, message):
+        message_type = message['type']
+        if message_type == 'message':
+            listeners = self._channels.get(message['channel'])
+        elif message_type == 'pmessage':
+            listeners = self._patterns.get(message['pattern'])
+        else:
+            self._sync_subscription(message)
+            return
+
+        for listener in tuple(listeners or ()):
+            try:
+                listener(message)
+            except Exception:
+                app_log.exception("Exception in pub/sub listener %r",
+                                  listener)
+
+    def _sync_subscription(self, message):
+        # the confirmation of an UNSUBSCRIBE sent before a new SUBSCRIBE of
+        # the same channel makes the pubsub forget it, remember it again so
+        # it's resubscribed after a reconnect
+        if message['type'] in ('subscribe', 'unsubscribe'):
+            subscriptions, wanted = self._pubsub.channels, self._channels
+        else:
+            subscriptions, wanted = self._pubsub.patterns, self._patterns
+        name = message['channel']
+        if name in wanted:
+            subscriptions.setdefault(name, None)
+
+    @property
+    def channels(self):
+        "Channels which have local listeners"
+        return list(self._channels)
+
+    @property
+    def patterns(self):
+        "Patterns which have local listeners"
+        return list(self._patterns)
+
+    def close(self):
+        "Drop every listener and close the pub/sub connection"
+        self._channels.clear()
+        self._patterns.clear()
+        self._pubsub.close()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Asynchronous iteration of the SCAN family of commands.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+from collections import deque
+
+from tornado import gen
+from tornado.queues import Queue
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:  # Python < 3.5, there is no ``async for``
+    class StopAsyncIteration(Exception):
+        pass
+
+_DONE = object()
+
+
+def _reverse_bits(value, width):
+    result = 0
+    for _ in range(width):
+        result = (result << 1) | (value & 1)
+        value >>= 1
+    return result
+
+
+class ScanIterator(object):
+    """ Walk the pages of a ``*SCAN`` command, returned by the ``*scan_iter``
+    methods of :class:`gredis.client.AsyncStrictRedis`.
+
+    ``fetch`` takes a cursor and returns a future of the next cursor and the
+    items of the page. The next page is requested as soon as a page
+    arrived, up to ``prefetch`` pages are kept until they are consumed.
+
+    With ``lanes`` (a power of two) the cursor space is split by its low
+    bits, the lanes are scanned concurrently on as many connections. Like a
+    plain ``SCAN``, an item may be returned more than once.
+
+    .. code-block:: python
+
+        keys = client.scan_iter(match="user:*", count=1000)
+        while True:
+            batch = yield keys.next_batch()
+            if batch is None:
+                break
+
+    On Python 3.5+ the items can also be iterated with ``async for``.
+    """
+
+    def __init__(self, fetch, lanes=1, prefetch=1):
+        if lanes < 1 or lanes & (lanes - 1):
+            raise ValueError("lanes must be a power of two")
+        if prefetch < 1:
+            raise ValueError("prefetch must be positive")
+        self._fetch = fetch
+        self.lanes = lanes
+        self._pages = Queue(maxsize=prefetch)
+        self._items = deque()
+        self._running = None
+        self._closed = False
+        self._finished = False
+
+    def _start(self):
+        if self._running is not None:
+            return
+        self._running = self.lanes
+        width = self.lanes.bit_length() - 1
+        for lane in range(self.lanes):
+            self._scan_lane(_reverse_bits(lane, width))
+
+    @gen.coroutine
+    def _scan_lane(self, start):
+        # SCAN increments the reversed bits of the cursor, so the cursors
+        # of a lane share their low bits until the lane is complete
+        mask = self.lanes - 1
+        cursor = start
+        # nobody reads the pages once closed, putting one could block the
+        # lane forever
+        try:
+            while not self._closed:
+                cursor, items = yield self._fetch(cursor)
+                if self._closed:
+                    break
+                yield self._pages.put(items)
+                if cursor == 0 or cursor & mask != start:
+                    break
+        except Exception as e:
+            if not self._closed:
+                yield self._pages.put(e)
+        finally:
+            self._running -= 1
+        if not self._running and not self._closed:
+            yield self._pages.put(_DONE)
+
+    @gen.coroutine
+    def next_batch(self):
+        "Return the items of the next page, or ``None`` once it's complete"
+        if self._finished:
+            raise gen.Return(None)
+        self._start()
+        page = yield self._pages.get()
+        if page is _DONE:
+            self._finished = True
+            raise gen.Return(None)
+        if isinstance(page, Exception):
+            self.close()
+            raise page
+        raise gen.Return(page)
+
+    def close(self):
+        "Stop scanning, the pages in flight are dropped"
+        self._closed = True
+        self._finished = True
+        self._items.clear()
+        # also releases the lanes waiting to put a page
+        while self._pages.qsize():
+            self._pages.get_nowait()
+
+    def __aiter__(self):
+        return self
+
+    @gen.coroutine
+    def __anext__(self):
+        while not self._items:
+            batch = yield self.next_batch()
+            if batch is None:
+                raise StopAsyncIteration
+            self._items.extend(batch)
+        raise gen.Return(self._items.popleft())
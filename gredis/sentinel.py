@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Asynchronous Redis Sentinel support and read routing to replicas.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import copy
+import random
+import weakref
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.tcpclient import TCPClient
+
+from redis._compat import iteritems, nativestr
+from redis.exceptions import (
+    ConnectionError, ResponseError, ReadOnlyError, TimeoutError)
+from redis.sentinel import MasterNotFoundError, SlaveNotFoundError
+
+from gredis.client import AsyncStrictRedis, AsyncRedis, READ_ONLY_COMMANDS
+from gredis.connection import AsyncConnection, AsyncConnectionPool
+
+# commands served by replicas with ``AsyncStrictSentinelRedis``
+REPLICA_COMMANDS = READ_ONLY_COMMANDS
+
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+class AsyncSentinelManagedConnection(AsyncConnection):
+    "Connection asking the sentinels for the address of its server"
+
+    def __init__(self, **kwargs):
+        self.connection_pool = kwargs.pop('connection_pool')
+        super(AsyncSentinelManagedConnection, self).__init__(**kwargs)
+
+    def __repr__(self):
+        pool = self.connection_pool
+        s = '%s<service=%s%%s>' % (type(self).__name__, pool.service_name)
+        if self.host:
+            host_info = ',host=%s,port=%s' % (self.host, self.port)
+            s = s % host_info
+        return s
+
+    @gen.coroutine
+    def _connect(self):
+        pool = self.connection_pool
+        if pool.is_master:
+            addresses = [(yield pool.get_master_address())]
+        else:
+            addresses = yield pool.get_slave_addresses()
+
+        error = None
+        for host, port in addresses:
+            try:
+                stream = yield TCPClient.connect(self, host, port)
+            except Exception as e:
+                error = e
+                continue
+            self.host, self.port = host, port
+            raise gen.Return(stream)
+        raise error
+
+    @gen.coroutine
+    def on_connect(self):
+        yield super(AsyncSentinelManagedConnection, self).on_connect()
+        if self.connection_pool.check_connection:
+            yield self.send_command('PING')
+            if nativestr((yield self.read_response())) != 'PONG':
+                raise ConnectionError('PING failed')
+
+    @gen.coroutine
+    def read_response(self, blocking=False):
+        try:
+            response = yield super(AsyncSentinelManagedConnection,
+                                   self).read_response(blocking)
+        except ReadOnlyError:
+            if self.connection_pool.is_master:
+                # the master we're still connected to has been demoted, the
+                # next connect() asks the sentinels for the new one
+                self.disconnect()
+                raise ConnectionError('The previous master is now a slave')
+            raise
+        raise gen.Return(response)
+
+
+class AsyncSentinelConnectionPool(AsyncConnectionPool):
+    """ Sentinel backed :class:`gredis.connection.AsyncConnectionPool`, the
+    address of the master, or of a replica, is resolved on every connect.
+
+    If ``check_connection`` flag is set to True, a PING is sent right after
+    establishing the connection.
+    """
+
+    def __init__(self, service_name, sentinel_manager, **kwargs):
+        kwargs['connection_class'] = kwargs.get(
+            'connection_class', AsyncSentinelManagedConnection)
+        self.is_master = kwargs.pop('is_master', True)
+        self.check_connection = kwargs.pop('check_connection', False)
+        super(AsyncSentinelConnectionPool, self).__init__(**kwargs)
+        self.connection_kwargs['connection_pool'] = weakref.proxy(self)
+        self.service_name = service_name
+        self.sentinel_manager = sentinel_manager
+
+    def __repr__(self):
+        return "%s<service=%s(%s)" % (
+            type(self).__name__,
+            self.service_name,
+            self.is_master and 'master' or 'slave',
+        )
+
+    def reset(self):
+        super(AsyncSentinelConnectionPool, self).reset()
+        self.master_address = None
+        self.slave_rr_counter = None
+
+    @gen.coroutine
+    def get_master_address(self):
+        master_address = yield self.sentinel_manager.discover_master(
+            self.service_name)
+        if self.is_master:
+            if self.master_address is None:
+                self.master_address = master_address
+            elif master_address != self.master_address:
+                # the master changed, close the connections to the old one
+                self.master_address = master_address
+                self.disconnect()
+        raise gen.Return(master_address)
+
+    @gen.coroutine
+    def get_slave_addresses(self):
+        """ Return the addresses of the replicas to try, round robin, then
+        the master as a fallback
+        """
+        addresses = []
+        slaves = yield self.sentinel_manager.discover_slaves(self.service_name)
+        if slaves:
+            if self.slave_rr_counter is None:
+                self.slave_rr_counter = random.randint(0, len(slaves) - 1)
+            self.slave_rr_counter = (self.slave_rr_counter + 1) % len(slaves)
+            counter = self.slave_rr_counter
+            addresses.extend(slaves[counter:] + slaves[:counter])
+        try:
+            addresses.append((yield self.get_master_address()))
+        except MasterNotFoundError:
+            pass
+        if not addresses:
+            raise SlaveNotFoundError('No slave found for %r' %
+                                     (self.service_name,))
+        raise gen.Return(addresses)
+
+
+class AsyncSentinel(object):
+    """ Asynchronous version of :class:`redis.sentinel.Sentinel`, the
+    discovery methods return futures.
+
+    ``sentinels`` is a list of sentinel nodes. Each node is represented by
+    a pair (hostname, port).
+
+    ``min_other_sentinels`` defined a minimum number of peers for a sentinel.
+    When querying a sentinel, if it doesn't meet this threshold, responses
+    from that sentinel won't be considered valid.
+
+    ``sentinel_kwargs`` is a dictionary of connection arguments used when
+    connecting to sentinel instances. If it's not specified, any
+    socket_timeout and socket_keepalive options specified in
+    ``connection_kwargs`` will be used.
+
+    ``connection_kwargs`` are keyword arguments that will be used when
+    establishing a connection to a Redis server.
+    """
+
+    def __init__(self, sentinels, min_other_sentinels=0, sentinel_kwargs=None,
+                 **connection_kwargs):
+        if sentinel_kwargs is None:
+            sentinel_kwargs = dict([(k, v)
+                                    for k, v in iteritems(connection_kwargs)
+                                    if k.startswith('socket_')
+                                    ])
+        self.sentinel_kwargs = sentinel_kwargs
+
+        self.sentinels = [AsyncStrictRedis(hostname, port,
+                                           **self.sentinel_kwargs)
+                          for hostname, port in sentinels]
+        self.min_other_sentinels = min_other_sentinels
+        self.connection_kwargs = connection_kwargs
+
+    def __repr__(self):
+        sentinel_addresses = []
+        for sentinel in self.sentinels:
+            sentinel_addresses.append('%s:%s' % (
+                sentinel.connection_pool.connection_kwargs['host'],
+                sentinel.connection_pool.connection_kwargs['port'],
+            ))
+        return '%s<sentinels=[%s]>' % (
+            type(self).__name__,
+            ','.join(sentinel_addresses))
+
+    def check_master_state(self, state, service_name):
+        if not state['is_master'] or state['is_sdown'] or state['is_odown']:
+            return False
+        # Check if our sentinel doesn't see other nodes
+        if state['num-other-sentinels'] < self.min_other_sentinels:
+            return False
+        return True
+
+    @gen.coroutine
+    def discover_master(self, service_name):
+        """
+        Asks sentinel servers for the Redis master's address corresponding
+        to the service labeled ``service_name``.
+
+        Returns a pair (address, port) or raises MasterNotFoundError if no
+        master is found.
+        """
+        for sentinel_no, sentinel in enumerate(self.sentinels):
+            try:
+                masters = yield sentinel.sentinel_masters()
+            except (ConnectionError, TimeoutError):
+                continue
+            state = masters.get(service_name)
+            if state and self.check_master_state(state, service_name):
+                # Put this sentinel at the top of the list
+                self.sentinels[0], self.sentinels[sentinel_no] = (
+                    sentinel, self.sentinels[0])
+                raise gen.Return((state['ip'], state['port']))
+        raise MasterNotFoundError("No master found for %r" % (service_name,))
+
+    def filter_slaves(self, slaves):
+        "Remove slaves that are in an ODOWN or SDOWN state"
+        slaves_alive = []
+        for slave in slaves:
+            if slave['is_odown'] or slave['is_sdown']:
+                continue
+            slaves_alive.append((slave['ip'], slave['port']))
+        return slaves_alive
+
+    @gen.coroutine
+    def discover_slaves(self, service_name):
+        "Returns a list of alive slaves for service ``service_name``"
+        for sentinel in self.sentinels:
+            try:
+                slaves = yield sentinel.sentinel_slaves(service_name)
+            except (ConnectionError, ResponseError, TimeoutError):
+                continue
+            slaves = self.filter_slaves(slaves)
+            if slaves:
+                raise gen.Return(slaves)
+        raise gen.Return([])
+
+    def master_for(self, service_name, redis_class=AsyncStrictRedis,
+                   connection_pool_class=AsyncSentinelConnectionPool,
+                   **kwargs):
+        """ Returns a redis client instance for the ``service_name``
+        master, the connections to the old master are closed once it
+        changed.
+        """
+        kwargs['is_master'] = True
+        connection_kwargs = dict(self.connection_kwargs)
+        connection_kwargs.update(kwargs)
+        return redis_class(connection_pool=connection_pool_class(
+            service_name, self, **connection_kwargs))
+
+    def slave_for(self, service_name, redis_class=AsyncStrictRedis,
+                  connection_pool_class=AsyncSentinelConnectionPool,
+                  **kwargs):
+        """ Returns redis client instance for the ``service_name``
+        slave(s), each connection picks a slave round robin.
+        """
+        kwargs['is_master'] = False
+        connection_kwargs = dict(self.connection_kwargs)
+        connection_kwargs.update(kwargs)
+        return redis_class(connection_pool=connection_pool_class(
+            service_name, self, **connection_kwargs))
+
+    def client_for(self, service_name, redis_class=None, **kwargs):
+        """ Returns a client which sends writes to the ``service_name``
+        master and reads to its slaves, see
+        :class:`AsyncStrictSentinelRedis`.
+        """
+        if redis_class is None:
+            redis_class = AsyncStrictSentinelRedis
+        return redis_class(self, service_name, **kwargs)
+
+
+class AsyncStrictSentinelRedis(AsyncStrictRedis):
+    """ Client sending the read-only commands of :data:`REPLICA_COMMANDS` to
+    the replicas of a Sentinel service and everything else to its master.
+
+    ``balancing`` picks the replica of each read: ``"round_robin"``, or
+    ``"least_outstanding"`` for the one with the fewest replies pending.
+    The replicas are discovered again in the background every
+    ``refresh_interval`` seconds and after a replica failed, reads fall
+    back to the master while there are none. A replica may lag behind the
+    master, a read right after a write can miss it.
+
+    ``command_timeout`` and :meth:`with_timeout` also limit the reads sent
+    to the replicas, a read falling back to the master keeps its deadline.
+    The ``decoding`` of :meth:`with_decoding` applies to them too.
+    """
+
+    replica_class = AsyncStrictRedis
+
+    def __init__(self, sentinel, service_name, balancing=ROUND_ROBIN,
+                 refresh_interval=30, **kwargs):
+        if balancing not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError("Unknown balancing %r" % (balancing,))
+        self.sentinel = sentinel
+        self.service_name = service_name
+        self.balancing = balancing
+        self.refresh_interval = refresh_interval
+        # options of this client only, its cache and its instruments also
+        # cover the reads sent to the replicas
+        client_options = dict((name, kwargs.pop(name))
+                              for name in ('client_cache', 'instruments',
+                                           'coalesce_blocking',
+                                           'command_timeout', 'hedge_after',
+                                           'decoding')
+                              if name in kwargs)
+        client_options['auto_pipeline'] = kwargs.get('auto_pipeline', False)
+        self.replica_kwargs = dict(sentinel.connection_kwargs)
+        self.replica_kwargs.update(kwargs)
+
+        pool_kwargs = dict(self.replica_kwargs, is_master=True)
+        pool_kwargs.pop('auto_pipeline', None)
+        super(AsyncStrictSentinelRedis, self).__init__(
+            connection_pool=AsyncSentinelConnectionPool(
+                service_name, sentinel, **pool_kwargs),
+            **client_options)
+
+        # address -> client of the replica
+        self.replicas = {}
+        self._replica_addresses = []
+        # address -> replies pending
+        self._outstanding = {}
+        self._counter = 0
+        self._refreshing = None
+        self._refreshed_at = None
+
+    @gen.coroutine
+    def _discover_replicas(self):
+        addresses = yield self.sentinel.discover_slaves(self.service_name)
+        self._refreshed_at = IOLoop.current().time()
+        for address in addresses:
+            if address not in self.replicas:
+                host, port = address
+                self.replicas[address] = self.replica_class(
+                    host, port, **self.replica_kwargs)
+                self._outstanding[address] = 0
+        for address in list(self.replicas):
+            if address not in addresses:
+                self.replicas.pop(address).connection_pool.disconnect()
+                del self._outstanding[address]
+        self._replica_addresses = addresses
+
+    def refresh_replicas(self):
+        "Discover the replicas, concurrent calls share one discovery"
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = self._discover_replicas()
+        return self._refreshing
+
+    def _refresh_in_background(self):
+        future = self.refresh_replicas()
+        # reads go to the master meanwhile
+        IOLoop.current().add_future(future, lambda f: f.exception())
+
+    def _pick_replica(self):
+        addresses = self._replica_addresses
+        if not addresses:
+            return None
+        if self.balancing == LEAST_OUTSTANDING:
+            outstanding = self._outstanding
+            return min(addresses, key=lambda a: outstanding[a])
+        self._counter = (self._counter + 1) % len(addresses)
+        return addresses[self._counter]
+
+    def _execute_command(self, args, options, event):
+        if args[0] in REPLICA_COMMANDS:
+            return self._execute_on_replica(args, options, event)
+        return super(AsyncStrictSentinelRedis, self)._execute_command(
+            args, options, event)
+
+    def _replica_client(self, address, deadline):
+        """ Return the client of the replica at ``address``, failing at the
+        IOLoop time ``deadline`` and decoding like this client
+        """
+        replica = self.replicas[address]
+        if (deadline is None and self.hedge_after is None and
+                self.decoding is None):
+            return replica
+        replica = copy.copy(replica)
+        replica._batch = None
+        replica.hedge_after = self.hedge_after
+        replica.decoding = self.decoding
+        if deadline is not None:
+            replica.command_timeout = max(
+                deadline - IOLoop.current().time(), 0)
+        return replica
+
+    @gen.coroutine
+    def _execute_on_replica(self, args, options, event):
+        # the deadline of the whole read, replica and master included
+        deadline = self._deadline()
+        if self._refreshed_at is None:
+            try:
+                yield self.refresh_replicas()
+            except (ConnectionError, TimeoutError):
+                pass
+        elif (IOLoop.current().time() - self._refreshed_at >
+              self.refresh_interval):
+            self._refresh_in_background()
+
+        address = self._pick_replica()
+        if address is not None:
+            self._outstanding[address] += 1
+            try:
+                replica = self._replica_client(address, deadline)
+                result = yield replica._execute_command(args, options, event)
+                raise gen.Return(result)
+            except (ConnectionError, TimeoutError):
+                # stop reading from it until the sentinels list it again
+                if address in self._replica_addresses:
+                    self._replica_addresses = [
+                        a for a in self._replica_addresses if a != address]
+                    self._refresh_in_background()
+                if (deadline is not None and
+                        IOLoop.current().time() >= deadline):
+                    raise
+            finally:
+                if address in self._outstanding:
+                    self._outstanding[address] -= 1
+
+        master = super(AsyncStrictSentinelRedis, self)
+        if deadline is not None:
+            master = super(AsyncStrictSentinelRedis, self.with_timeout(
+                max(deadline - IOLoop.current().time(), 0)))
+        result = yield master._execute_command(args, options, event)
+        raise gen.Return(result)
+
+
+class AsyncSentinelRedis(AsyncStrictSentinelRedis, AsyncRedis):
+    "Routing client of :class:`AsyncSentinel` with the ``Redis`` API"
+
+    replica_class = AsyncRedis
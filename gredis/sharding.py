@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Client side sharding over independent Redis servers.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import bisect
+import hashlib
+import struct
+from itertools import chain
+
+from tornado import gen
+
+from redis._compat import izip
+from redis.client import StrictRedis, Redis
+
+from gredis.cluster import (
+    hash_tag, split_scan_cursor, join_scan_cursor, ALL_NODES_COMMANDS,
+    SPLIT_COMMANDS, PAIRS_COMMANDS, KEYLESS_COMMANDS)
+from gredis.scan import ScanIterator
+
+
+class HashRing(object):
+    """ Consistent hash ring, each node gets ``vnodes`` points times its
+    weight (ketama). Adding or removing a node only moves the keys of that
+    node.
+    """
+
+    def __init__(self, nodes=(), vnodes=160):
+        self.vnodes = vnodes
+        self.weights = {}
+        self._points = []
+        self._nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(self.weights)
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.md5(data).digest()
+
+    def add_node(self, node, weight=1):
+        "Add ``node``, a name, to the ring"
+        self.weights[node] = weight
+        self._build()
+
+    def remove_node(self, node):
+        "Remove ``node`` from the ring"
+        del self.weights[node]
+        self._build()
+
+    def _build(self):
+        ring = []
+        for node, weight in self.weights.items():
+            # each md5 digest gives 4 points
+            for i in range(self.vnodes * weight // 4):
+                digest = self._digest("{0}-{1}".format(node, i).encode())
+                for point in struct.unpack("<4I", digest):
+                    ring.append((point, node))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get_node(self, key):
+        "Return the node of the encoded ``key``"
+        if not self._points:
+            raise ValueError("The ring has no nodes")
+        point = struct.unpack("<I", self._digest(key)[:4])[0]
+        index = bisect.bisect(self._points, point)
+        if index == len(self._points):
+            index = 0
+        return self._nodes[index]
+
+
+class AsyncStrictShardedRedis(StrictRedis):
+    """ Spread keys over several independent servers with a consistent
+    hash ring, every command returns a future.
+
+    ``shards`` maps a stable name to an :class:`gredis.client.AsyncStrictRedis`
+    client, a list of clients is named by ``host:port/db``. Only the part of
+    a key between ``{`` and ``}`` is hashed if it has one, so related keys
+    can be kept together.
+
+    ``MGET``, ``MSET``, ``DEL``, ``UNLINK`` and ``TOUCH`` are split per
+    shard, the shards run concurrently and the replies are merged in the
+    order of the keys.
+
+    ``SCAN`` walks the shards one after the other in the order of their
+    names, its cursor tells the shard and the cursor on it. It's only valid
+    while the shards stay the same.
+
+    .. code-block:: python
+
+        client = AsyncStrictShardedRedis({
+            "cache1": AsyncStrictRedis("10.0.0.1"),
+            "cache2": AsyncStrictRedis("10.0.0.2"),
+        })
+        values = yield client.mget(keys)
+    """
+
+    pipeline_class = None  # AsyncStrictShardedPipeline, set below
+
+    def __init__(self, shards, vnodes=160):
+        if not isinstance(shards, dict):
+            shards = dict((self._shard_name(client), client)
+                          for client in shards)
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.response_callbacks = self.__class__.RESPONSE_CALLBACKS.copy()
+        self.shards = dict(shards)
+        self.ring = HashRing(sorted(self.shards), vnodes)
+        self.encoder = next(iter(self.shards.values())
+                            ).connection_pool.get_encoder()
+
+    @staticmethod
+    def _shard_name(client):
+        kwargs = client.connection_pool.connection_kwargs
+        return "{0}:{1}/{2}".format(kwargs.get('host', 'localhost'),
+                                    kwargs.get('port', 6379),
+                                    kwargs.get('db', 0))
+
+    def add_shard(self, name, client, weight=1):
+        "Add a shard, the keys it now owns are not moved"
+        self.shards[name] = client
+        self.ring.add_node(name, weight)
+
+    def remove_shard(self, name):
+        "Remove a shard and return its client"
+        self.ring.remove_node(name)
+        return self.shards.pop(name)
+
+    def get_shard_name(self, key):
+        "Return the name of the shard of ``key``"
+        return self.ring.get_node(hash_tag(self.encoder.encode(key)))
+
+    def get_shard(self, key):
+        "Return the client of the shard of ``key``"
+        return self.shards[self.get_shard_name(key)]
+
+    def _command_key(self, args):
+        command = args[0]
+        if command in ('EVAL', 'EVALSHA'):
+            if len(args) > 3 and int(args[2]) > 0:
+                return args[3]
+            return None
+        if command in KEYLESS_COMMANDS or len(args) < 2:
+            return None
+        return args[1]
+
+    def _split_command(self, args):
+        """ Return the ``(shard name, args, key positions)`` parts of a
+        command, positions are ``None`` when it isn't split and the index of
+        the shard for ``SCAN``
+        """
+        command = args[0]
+        if command == 'SCAN':
+            names = sorted(self.shards)
+            index, cursor = split_scan_cursor(args[1], len(names))
+            return [(names[index], (command, cursor) + args[2:], index)]
+        if command in ALL_NODES_COMMANDS:
+            return [(name, args, None) for name in sorted(self.shards)]
+
+        if command in SPLIT_COMMANDS:
+            step = 2 if command in PAIRS_COMMANDS else 1
+            items = args[1:]
+            groups = {}
+            for i in range(0, len(items), step):
+                name = self.get_shard_name(items[i])
+                groups.setdefault(name, []).append(i // step)
+            if len(groups) > 1:
+                parts = []
+                for name, positions in groups.items():
+                    part = chain.from_iterable(items[p * step:(p + 1) * step]
+                                               for p in positions)
+                    parts.append((name, (command,) + tuple(part), positions))
+                return parts
+
+        key = self._command_key(args)
+        if key is None:
+            return [(sorted(self.shards)[0], args, None)]
+        return [(self.get_shard_name(key), args, None)]
+
+    def _merge(self, args, parts, replies):
+        "Merge the replies of the parts of a command, or return an error"
+        for reply in replies:
+            if isinstance(reply, Exception):
+                return reply
+        if len(parts) == 1 and parts[0][2] is None:
+            return replies[0]
+
+        command = args[0]
+        if command == 'SCAN':
+            cursor, items = replies[0]
+            return (join_scan_cursor(parts[0][2], cursor, len(self.shards)),
+                    items)
+        if command in ALL_NODES_COMMANDS:
+            return ALL_NODES_COMMANDS[command](replies)
+        merge = SPLIT_COMMANDS[command]
+        if merge is not None:
+            return merge(replies)
+        # MGET, put the values back in the order of the keys
+        response = [None] * (len(args) - 1)
+        for (_, _, positions), reply in izip(parts, replies):
+            for position, value in izip(positions, reply):
+                response[position] = value
+        return response
+
+    @gen.coroutine
+    def execute_command(self, *args, **options):
+        "Execute a command on the shards of its keys"
+        parts = self._split_command(args)
+        if len(parts) == 1 and parts[0][2] is None:
+            name, args, _ = parts[0]
+            result = yield self.shards[name].execute_command(*args, **options)
+            raise gen.Return(result)
+
+        replies = yield [self.shards[name].execute_command(*part, **options)
+                         for name, part, _ in parts]
+        result = self._merge(args, parts, replies)
+        if isinstance(result, Exception):
+            raise result
+        raise gen.Return(result)
+
+    def scan_iter(self, match=None, count=None, prefetch=1):
+        """ Return a :class:`gredis.scan.ScanIterator` of the key names of
+        every shard
+        """
+        def fetch(cursor):
+            return self.scan(cursor, match=match, count=count)
+        return ScanIterator(fetch, prefetch=prefetch)
+
+    def pipeline(self, transaction=False, shard_hint=None):
+        """ Return a pipeline sending one pipeline to each shard, a
+        transaction only spans the commands of one shard.
+        """
+        return self.pipeline_class(self, transaction)
+
+
+class AsyncStrictShardedPipeline(StrictRedis):
+    """ Pipeline of :class:`AsyncStrictShardedRedis`, ``execute()`` returns a
+    future of the replies in the order of the commands.
+
+    Each shard gets one pipeline with its commands in order, the shards run
+    concurrently. With ``transaction`` each shard runs its part in a
+    ``MULTI``/``EXEC`` block.
+    """
+
+    def __init__(self, client, transaction=False):
+        self.client = client
+        self.transaction = transaction
+        self.command_stack = []
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def execute_command(self, *args, **options):
+        self.command_stack.append((args, options))
+        return self
+
+    def reset(self):
+        self.command_stack = []
+
+    @gen.coroutine
+    def execute(self, raise_on_error=True):
+        "Execute all the commands in the current pipeline"
+        stack, self.command_stack = self.command_stack, []
+        if not stack:
+            raise gen.Return([])
+
+        client = self.client
+        pipelines = {}
+        plan = []
+        for args, options in stack:
+            parts = client._split_command(args)
+            indexes = []
+            for name, part, _ in parts:
+                pipeline = pipelines.get(name)
+                if pipeline is None:
+                    pipeline = client.shards[name].pipeline(self.transaction)
+                    pipelines[name] = pipeline
+                indexes.append(len(pipeline.command_stack))
+                pipeline.execute_command(*part, **options)
+            plan.append((args, parts, indexes))
+
+        names = list(pipelines)
+        results = yield [pipelines[name].execute(raise_on_error=False)
+                         for name in names]
+        results = dict(izip(names, results))
+
+        replies = []
+        for args, parts, indexes in plan:
+            part_replies = [results[name][index]
+                            for (name, _, _), index in izip(parts, indexes)]
+            replies.append(client._merge(args, parts, part_replies))
+
+        if raise_on_error:
+            for reply in replies:
+                if isinstance(reply, Exception):
+                    raise reply
+        raise gen.Return(replies)
+
+
+class AsyncShardedPipeline(AsyncStrictShardedPipeline, Redis):
+    "Pipeline of :class:`AsyncShardedRedis`"
+    pass
+
+
+class AsyncShardedRedis(AsyncStrictShardedRedis, Redis):
+    "Sharded client with the :class:`redis.Redis` API"
+
+    pipeline_class = AsyncShardedPipeline
+
+
+AsyncStrictShardedRedis.pipeline_class = AsyncStrictShardedPipeline
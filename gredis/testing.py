@@ -0,0 +1,559 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""In-process stand-ins for Redis servers, to test without a real server.
+"""
+from __future__ import absolute_import, print_function, division, with_statement
+
+import fnmatch
+
+from tornado import gen
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+from tornado.testing import bind_unused_port
+
+from redis._compat import b, long
+
+from gredis.cluster import key_slot, CLUSTER_SLOTS
+
+
+class Status(bytes):
+    "A simple string reply"
+
+
+OK = Status(b"OK")
+PONG = Status(b"PONG")
+
+
+class ReplyError(Exception):
+    "Raised by a command handler to reply with an error"
+
+
+class Replies(list):
+    "Several replies to one command, e.g. ``SUBSCRIBE`` to several channels"
+
+
+def encode_reply(reply, chunks):
+    "Append the RESP encoding of ``reply`` to ``chunks``"
+    if isinstance(reply, Replies):
+        for item in reply:
+            encode_reply(item, chunks)
+    elif reply is None:
+        chunks.append(b"$-1\r\n")
+    elif isinstance(reply, Status):
+        chunks.append(b"+" + reply + b"\r\n")
+    elif isinstance(reply, ReplyError):
+        chunks.append(b("-" + str(reply) + "\r\n"))
+    elif isinstance(reply, bool):
+        chunks.append(b":1\r\n" if reply else b":0\r\n")
+    elif isinstance(reply, (int, long)):
+        chunks.append(b(":%d\r\n" % reply))
+    elif isinstance(reply, bytes):
+        chunks.append(b("$%d\r\n" % len(reply)))
+        chunks.append(reply)
+        chunks.append(b"\r\n")
+    elif isinstance(reply, (list, tuple)):
+        chunks.append(b("*%d\r\n" % len(reply)))
+        for item in reply:
+            encode_reply(item, chunks)
+    else:
+        encode_reply(b(str(reply)), chunks)
+
+
+def parse_commands(buf):
+    """ Parse the complete commands at the start of ``buf``, return them and
+    the number of bytes they took.
+    """
+    commands = []
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        end = buf.find(b"\r\n", pos)
+        if end < 0:
+            break
+        if buf[pos:pos + 1] != b"*":
+            # inline command
+            commands.append(buf[pos:end].split())
+            pos = end + 2
+            continue
+        count = int(buf[pos + 1:end])
+        cursor = end + 2
+        args = []
+        while len(args) < count:
+            end = buf.find(b"\r\n", cursor)
+            if end < 0:
+                break
+            length = int(buf[cursor + 1:end])
+            start = end + 2
+            if start + length + 2 > size:
+                break
+            args.append(buf[start:start + length])
+            cursor = start + length + 2
+        if len(args) < count:
+            break
+        commands.append(args)
+        pos = cursor
+    return commands, pos
+
+
+class Client(object):
+    "State of a connection to a :class:`FakeRedisServer`"
+
+    def __init__(self, stream, address):
+        self.stream = stream
+        self.address = address
+        self.asking = False
+        # stopped answering, see ``FakeRedisServer.stall``
+        self.stalled = False
+        # subscriptions of pub/sub
+        self.channels = set()
+        self.patterns = set()
+
+
+class FakeRedisServer(TCPServer):
+    """ A Tornado server answering the Redis protocol from a dict, good
+    enough for tests and benchmarks of the client.
+
+    It knows a few string, list, pub/sub and server commands, with
+    ``readonly`` it refuses writes like a replica does. A command ``FOO`` is
+    handled by a ``cmd_foo(client, *args)`` method, which returns the reply
+    or raises :class:`ReplyError`. The replies of the commands received in
+    one read are sent in one write.
+
+    .. code-block:: python
+
+        server = FakeRedisServer()
+        server.start()
+        client = AsyncRedis("127.0.0.1", server.port)
+    """
+
+    # commands refused by a read-only replica
+    WRITE_COMMANDS = frozenset([
+        "set", "mset", "del", "incr", "incrby", "rpush", "flushdb",
+        "flushall",
+    ])
+
+    def __init__(self, host="127.0.0.1", readonly=False, **kwargs):
+        TCPServer.__init__(self, **kwargs)
+        self.host = host
+        self.port = None
+        self.readonly = readonly
+        self.data = {}
+        self.clients = set()
+        # number of commands handled, by name
+        self.calls = {}
+        self.stalls = 0
+
+    @property
+    def name(self):
+        return "{0}:{1}".format(self.host, self.port)
+
+    def start(self, port=None):
+        "Listen on ``port``, an unused one by default"
+        if port is None:
+            sock, self.port = bind_unused_port()
+            self.add_sockets([sock])
+        else:
+            self.port = port
+            self.listen(port, self.host)
+
+    def stall(self, commands=1):
+        """ The connections receiving the next ``commands`` commands stop
+        answering, like a stuck server
+        """
+        self.stalls += commands
+
+    def disconnect_clients(self):
+        "Close the connections of every client"
+        for client in list(self.clients):
+            client.stream.close()
+
+    def stop(self):
+        TCPServer.stop(self)
+        self.disconnect_clients()
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        client = Client(stream, address)
+        self.clients.add(client)
+        buf = b""
+        try:
+            while True:
+                buf += yield stream.read_bytes(65536, partial=True)
+                commands, pos = parse_commands(buf)
+                buf = buf[pos:]
+                if not commands:
+                    continue
+                chunks = []
+                for args in commands:
+                    if self.stalls and not client.stalled:
+                        self.stalls -= 1
+                        client.stalled = True
+                    if client.stalled:
+                        break
+                    encode_reply(self.execute(client, args), chunks)
+                if chunks:
+                    stream.write(b"".join(chunks))
+        except StreamClosedError:
+            pass
+        finally:
+            self.clients.discard(client)
+
+    def execute(self, client, args):
+        "Return the reply to the command ``args`` of ``client``"
+        name = args[0].decode("latin-1").lower()
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.readonly and name in self.WRITE_COMMANDS:
+            return ReplyError("READONLY You can't write against a read only "
+                              "slave.")
+        handler = getattr(self, "cmd_" + name, None)
+        if handler is None:
+            return ReplyError("ERR unknown command '{0}'".format(name))
+        try:
+            return handler(client, *args[1:])
+        except ReplyError as e:
+            return e
+        except TypeError:
+            return ReplyError("ERR wrong number of arguments for '{0}' "
+                              "command".format(name))
+
+    def _get(self, key, kind):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise ReplyError("WRONGTYPE Operation against a key holding the "
+                             "wrong kind of value")
+        return value
+
+    # SERVER COMMANDS
+    def cmd_ping(self, client, message=None):
+        return PONG if message is None else message
+
+    def cmd_echo(self, client, message):
+        return message
+
+    def cmd_select(self, client, db):
+        return OK
+
+    def cmd_flushdb(self, client):
+        self.data.clear()
+        return OK
+
+    cmd_flushall = cmd_flushdb
+
+    def cmd_dbsize(self, client):
+        return len(self.data)
+
+    def cmd_keys(self, client, pattern):
+        pattern = pattern.decode("latin-1")
+        return [key for key in self.data
+                if fnmatch.fnmatchcase(key.decode("latin-1"), pattern)]
+
+    def cmd_scan(self, client, cursor, *options):
+        # the cursor is an offset in the sorted key names
+        pattern, count = "*", 10
+        options = list(options)
+        while options:
+            option = options.pop(0).upper()
+            if option == b"MATCH" and options:
+                pattern = options.pop(0).decode("latin-1")
+            elif option == b"COUNT" and options:
+                count = int(options.pop(0))
+            else:
+                raise ReplyError("ERR syntax error")
+        start = int(cursor)
+        keys = sorted(self.data)[start:start + count]
+        cursor = start + count if start + count < len(self.data) else 0
+        return [b(str(cursor)),
+                [key for key in keys
+                 if fnmatch.fnmatchcase(key.decode("latin-1"), pattern)]]
+
+    def cmd_del(self, client, *keys):
+        if not keys:
+            raise TypeError()
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def cmd_exists(self, client, *keys):
+        if not keys:
+            raise TypeError()
+        return sum(key in self.data for key in keys)
+
+    # STRING COMMANDS
+    def cmd_get(self, client, key):
+        return self._get(key, bytes)
+
+    def cmd_set(self, client, key, value, *options):
+        options = [option.upper() for option in options]
+        if b"NX" in options and key in self.data:
+            return None
+        if b"XX" in options and key not in self.data:
+            return None
+        self.data[key] = value
+        return OK
+
+    def cmd_mget(self, client, *keys):
+        if not keys:
+            raise TypeError()
+        return [self.data.get(key) if isinstance(self.data.get(key), bytes)
+                else None for key in keys]
+
+    def cmd_mset(self, client, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise TypeError()
+        for i in range(0, len(pairs), 2):
+            self.data[pairs[i]] = pairs[i + 1]
+        return OK
+
+    def cmd_incrby(self, client, key, amount):
+        try:
+            value = int(self._get(key, bytes) or 0) + int(amount)
+        except ValueError:
+            raise ReplyError("ERR value is not an integer or out of range")
+        self.data[key] = b(str(value))
+        return value
+
+    def cmd_incr(self, client, key):
+        return self.cmd_incrby(client, key, b"1")
+
+    # LIST COMMANDS
+    def cmd_rpush(self, client, key, *values):
+        if not values:
+            raise TypeError()
+        lst = self._get(key, list)
+        if lst is None:
+            lst = self.data[key] = []
+        lst.extend(values)
+        return len(lst)
+
+    def cmd_lrange(self, client, key, start, end):
+        lst = self._get(key, list) or []
+        start, end = int(start), int(end)
+        if start < 0:
+            start = max(len(lst) + start, 0)
+        if end < 0:
+            end += len(lst)
+        return lst[start:end + 1]
+
+    # PUBSUB COMMANDS
+    def _subscribe(self, client, kind, subscriptions, names):
+        replies = Replies()
+        for name in names:
+            subscriptions.add(name)
+            replies.append([kind, name,
+                            len(client.channels) + len(client.patterns)])
+        return replies
+
+    def _unsubscribe(self, client, kind, subscriptions, names):
+        names = names or sorted(subscriptions)
+        if not names:
+            return [kind, None, len(client.channels) + len(client.patterns)]
+        replies = Replies()
+        for name in names:
+            subscriptions.discard(name)
+            replies.append([kind, name,
+                            len(client.channels) + len(client.patterns)])
+        return replies
+
+    def cmd_subscribe(self, client, *channels):
+        if not channels:
+            raise TypeError()
+        return self._subscribe(client, b"subscribe", client.channels, channels)
+
+    def cmd_unsubscribe(self, client, *channels):
+        return self._unsubscribe(client, b"unsubscribe", client.channels,
+                                 channels)
+
+    def cmd_psubscribe(self, client, *patterns):
+        if not patterns:
+            raise TypeError()
+        return self._subscribe(client, b"psubscribe", client.patterns,
+                               patterns)
+
+    def cmd_punsubscribe(self, client, *patterns):
+        return self._unsubscribe(client, b"punsubscribe", client.patterns,
+                                 patterns)
+
+    def cmd_publish(self, client, channel, message):
+        receivers = 0
+        name = channel.decode("latin-1")
+        for subscriber in list(self.clients):
+            messages = []
+            if channel in subscriber.channels:
+                messages.append([b"message", channel, message])
+            for pattern in subscriber.patterns:
+                if fnmatch.fnmatchcase(name, pattern.decode("latin-1")):
+                    messages.append([b"pmessage", pattern, channel, message])
+            if messages:
+                receivers += len(messages)
+                chunks = []
+                encode_reply(Replies(messages), chunks)
+                try:
+                    subscriber.stream.write(b"".join(chunks))
+                except StreamClosedError:
+                    pass
+        return receivers
+
+
+class FakeClusterNode(FakeRedisServer):
+    "A node of a :class:`FakeRedisCluster`"
+
+    # commands whose arguments are all keys, or key value pairs
+    KEYS_COMMANDS = frozenset([b"MGET", b"DEL", b"EXISTS"])
+    PAIRS_COMMANDS = frozenset([b"MSET"])
+
+    def __init__(self, cluster, **kwargs):
+        FakeRedisServer.__init__(self, **kwargs)
+        self.cluster = cluster
+
+    def command_keys(self, args):
+        command = args[0].upper()
+        if command in self.KEYS_COMMANDS:
+            return args[1:]
+        if command in self.PAIRS_COMMANDS:
+            return args[1::2]
+        if command in (b"CLUSTER", b"PING", b"ECHO", b"SELECT", b"ASKING",
+                       b"FLUSHDB", b"FLUSHALL", b"DBSIZE", b"KEYS", b"SCAN"):
+            return []
+        return args[1:2]
+
+    def execute(self, client, args):
+        asking, client.asking = client.asking, False
+        keys = self.command_keys(args)
+        if keys:
+            slots = set(key_slot(key) for key in keys)
+            if len(slots) > 1:
+                return ReplyError("CROSSSLOT Keys in request don't hash to "
+                                  "the same slot")
+            slot = slots.pop()
+            cluster = self.cluster
+            owner = cluster.slots[slot]
+            if owner is not self:
+                if not (asking and cluster.migrating.get(slot) is self):
+                    return ReplyError("MOVED {0} {1}".format(
+                        slot, owner.name))
+            else:
+                target = cluster.migrating.get(slot)
+                if target is not None and not all(k in self.data
+                                                   for k in keys):
+                    return ReplyError("ASK {0} {1}".format(slot, target.name))
+        return FakeRedisServer.execute(self, client, args)
+
+    def cmd_asking(self, client):
+        client.asking = True
+        return OK
+
+    def cmd_cluster(self, client, subcommand, *args):
+        if subcommand.upper() == b"SLOTS":
+            return self.cluster.cluster_slots()
+        raise ReplyError("ERR unknown subcommand")
+
+
+class FakeRedisCluster(object):
+    """ Several :class:`FakeClusterNode` sharing the 16384 slots evenly.
+
+    :meth:`move_slot` reassigns a slot, so clients with the old slot map
+    get ``MOVED``. :meth:`migrate_slot` starts a migration, the source node
+    replies ``ASK`` for the keys it doesn't have.
+    """
+
+    def __init__(self, nodes=3, host="127.0.0.1"):
+        self.nodes = [FakeClusterNode(self, host=host) for _ in range(nodes)]
+        self.slots = []
+        for i, node in enumerate(self.nodes):
+            end = CLUSTER_SLOTS * (i + 1) // nodes
+            self.slots.extend([node] * (end - len(self.slots)))
+        # slot -> node it's being migrated to
+        self.migrating = {}
+
+    @property
+    def startup_nodes(self):
+        return [{"host": node.host, "port": node.port} for node in self.nodes]
+
+    def start(self):
+        for node in self.nodes:
+            node.start()
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop()
+
+    def node_for_key(self, key):
+        return self.slots[key_slot(b(key) if not isinstance(key, bytes)
+                                   else key)]
+
+    def _slot_keys(self, node, slot):
+        return [key for key in node.data if key_slot(key) == slot]
+
+    def move_slot(self, slot, node):
+        "Assign ``slot`` and its keys to ``node``"
+        source = self.slots[slot]
+        for key in self._slot_keys(source, slot):
+            node.data[key] = source.data.pop(key)
+        self.slots[slot] = node
+        self.migrating.pop(slot, None)
+
+    def migrate_slot(self, slot, node, keys=()):
+        "Start migrating ``slot`` to ``node``, with ``keys`` already moved"
+        source = self.slots[slot]
+        for key in keys:
+            key = b(key) if not isinstance(key, bytes) else key
+            if key in source.data:
+                node.data[key] = source.data.pop(key)
+        self.migrating[slot] = node
+
+    def cluster_slots(self):
+        "The reply to ``CLUSTER SLOTS``"
+        ranges = []
+        start = 0
+        for slot in range(1, CLUSTER_SLOTS + 1):
+            if (slot == CLUSTER_SLOTS or
+                    self.slots[slot] is not self.slots[start]):
+                node = self.slots[start]
+                ranges.append([start, slot - 1,
+                               [b(node.host), node.port, b(node.name)]])
+                start = slot
+        return ranges
+
+
+class FakeSentinel(FakeRedisServer):
+    """ Answers the ``SENTINEL`` commands about the services added with
+    :meth:`add_service`, a failover is done with :meth:`failover`.
+    """
+
+    def __init__(self, **kwargs):
+        FakeRedisServer.__init__(self, **kwargs)
+        # service name -> [master, slaves]
+        self.services = {}
+
+    def add_service(self, name, master, slaves=()):
+        "Announce ``master`` and its ``slaves``, all FakeRedisServer"
+        master.readonly = False
+        for slave in slaves:
+            slave.readonly = True
+        self.services[name] = [master, list(slaves)]
+
+    def failover(self, name, slave):
+        "Promote ``slave``, the old master becomes one of its slaves"
+        master, slaves = self.services[name]
+        slaves = [s for s in slaves if s is not slave] + [master]
+        self.add_service(name, slave, slaves)
+
+    def _state(self, server, flags, name=None):
+        return [b"name", b(name or server.name), b"ip", b(server.host),
+                b"port", b(str(server.port)), b"flags", b(flags),
+                b"num-other-sentinels", b"0"]
+
+    def cmd_sentinel(self, client, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == b"MASTERS":
+            return [self._state(master, "master", name)
+                    for name, (master, _) in self.services.items()]
+        if not args:
+            raise TypeError()
+        service = self.services.get(args[0].decode("latin-1"))
+        if service is None:
+            raise ReplyError("ERR No such master with that name")
+        master, slaves = service
+        if subcommand == b"SLAVES":
+            return [self._state(slave, "slave") for slave in slaves]
+        if subcommand == b"GET-MASTER-ADDR-BY-NAME":
+            return [b(master.host), b(str(master.port))]
+        raise ReplyError("ERR unknown subcommand")
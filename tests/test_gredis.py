@@ -8,17 +8,43 @@
 #
 from __future__ import absolute_import, print_function, division, with_statement
 
+import io
 import os
+import codecs
+import unittest
+from tornado import gen
+from tornado.concurrent import Future
 from tornado.testing import gen_test, AsyncTestCase
+from redis.exceptions import (
+    ConnectionError, DataError, ResponseError, TimeoutError, WatchError)
 
-from gredis.client import AsyncRedis
+from gredis.blocking import CancelledError
+from gredis.cache import ClientCache
+from gredis.client import AsyncRedis, MessageQueue
+from gredis.cluster import AsyncRedisCluster
+from gredis.connection import StreamBuffer, decode_reply
+from gredis.instrument import Instrument, LatencyHistogram
+from gredis.pubsub import PubSubHub
+from gredis.scan import ScanIterator, StopAsyncIteration
+from gredis.sentinel import AsyncSentinel
+from gredis.sharding import AsyncShardedRedis
+from gredis.testing import FakeRedisServer, FakeRedisCluster, FakeSentinel
 
+try:
+    import asyncio
+    from gredis.aio import AioRedis
+except (ImportError, SyntaxError):  # Python < 3.5
+    AioRedis = None
+
+# the Redis server most tests need
+HOST = os.environ.get("GREDIS_TEST_HOST", "127.0.0.1")
+PORT = int(os.environ.get("GREDIS_TEST_PORT", 6379))
 
 class GRedisTest(AsyncTestCase):
     def setUp(self):
         super(GRedisTest, self).setUp()
         self.client = AsyncRedis(
-            "192.168.1.50", 6379, encoding="utf8",
+            HOST, PORT, encoding="utf8",
             decode_responses=True,
         )
 
@@ -34,7 +60,7 @@ class GRedisTest(AsyncTestCase):
     @gen_test
     def test_list(self):
         key = "g_test_list_key"
-        self.client.delete(key)
+        yield self.client.delete(key)
         yield self.client.lpush(key, "w")
         key, response = yield self.client.blpop(key)
         print(response)
@@ -45,6 +71,117 @@ class GRedisTest(AsyncTestCase):
         _lst = yield self.client.lrange(key, 0, -1)
         self.assertListEqual(lst, _lst)
 
+    @gen_test
+    def test_multi_bulk(self):
+        key = "g_multi_bulk_list"
+        hash_key = "g_multi_bulk_hash"
+        zset_key = "g_multi_bulk_zset"
+        yield self.client.delete(key, hash_key, zset_key)
+
+        self.assertListEqual((yield self.client.lrange(key, 0, -1)), [])
+
+        lst = ["{0}\r\n{1}".format(i, "v" * (i % 100)) for i in range(5000)]
+        yield self.client.rpush(key, *lst)
+        _lst = yield self.client.lrange(key, 0, -1)
+        self.assertListEqual(lst, _lst)
+
+        mapping = {"a": "1", "b": "", "c": "3"}
+        yield self.client.hmset(hash_key, mapping)
+        self.assertDictEqual((yield self.client.hgetall(hash_key)), mapping)
+        self.assertListEqual(
+            (yield self.client.hmget(hash_key, "a", "missing", "b")),
+            ["1", None, ""])
+
+        yield self.client.zadd(zset_key, 1, "one", 2, "two")
+        self.assertListEqual(
+            (yield self.client.zrange(zset_key, 0, -1, withscores=True)),
+            [("one", 1.0), ("two", 2.0)])
+
+    @gen_test
+    def test_decoding(self):
+        key = "g_decoding_list"
+        yield self.client.delete(key)
+        lst = ["a", u"\u00e9t\u00e9", "", "nul\x00byte"]
+        yield self.client.rpush(key, *lst)
+        yield self.client.rpush(key, u"\u00e9")
+
+        # an item holding a NUL is decoded on its own
+        self.assertListEqual((yield self.client.lrange(key, 0, -1)),
+                             lst + [u"\u00e9"])
+        self.assertListEqual(
+            (yield self.client.lrange(key, 0, 1)), lst[:2])
+        self.assertListEqual(
+            (yield self.client.sort(key, by="nosort", get=["#", "missing"])),
+            [value for item in lst + [u"\u00e9"] for value in (item, None)])
+
+        raw = self.client.with_decoding("raw")
+        self.assertListEqual((yield raw.lrange(key, 0, 1)),
+                             [b"a", u"\u00e9t\u00e9".encode("utf8")])
+        self.assertEqual((yield raw.lindex(key, 1)),
+                         u"\u00e9t\u00e9".encode("utf8"))
+        self.assertEqual((yield raw.llen(key)), 5)
+        self.assertEqual((yield self.client.lindex(key, 1)), u"\u00e9t\u00e9")
+
+        lazy = self.client.with_decoding("lazy")
+        values = yield lazy.lrange(key, 0, -1)
+        self.assertEqual(len(values), 5)
+        self.assertEqual(values.raw[1], u"\u00e9t\u00e9".encode("utf8"))
+        self.assertEqual(values[1], u"\u00e9t\u00e9")
+        self.assertEqual(values.raw[1], u"\u00e9t\u00e9")
+        self.assertEqual(values[1:3], lst[1:3])
+        self.assertEqual(values, lst + [u"\u00e9"])
+        self.assertEqual((yield lazy.get("g_decoding_missing")), None)
+
+        with self.assertRaises(ValueError):
+            self.client.with_decoding("eager")
+
+    def test_decode_reply(self):
+        # the error handler sees the bytes given to the decoder
+        decoded = []
+
+        def record(error):
+            decoded.append(error.object)
+            return u"?", error.end
+        codecs.register_error("gredis_test_record", record)
+
+        self.assertListEqual(
+            decode_reply([b"a", b"", b"\xff"], "utf8", "gredis_test_record"),
+            ["a", "", "?"])
+        self.assertListEqual(decoded, [b"a\x00\x00\xff"])
+
+        del decoded[:]
+        self.assertListEqual(
+            decode_reply([b"a\x00", b"\xff"], "utf8", "gredis_test_record"),
+            ["a\x00", "?"])
+        self.assertListEqual(decoded, [b"\xff"])
+
+        del decoded[:]
+        self.assertListEqual(
+            decode_reply([b"a" * 32, b"\xff"], "utf8", "gredis_test_record"),
+            ["a" * 32, "?"])
+        self.assertListEqual(decoded, [b"\xff"])
+
+        self.assertListEqual(
+            decode_reply([b"a", None, 1, [b"b", None]], "utf8", "strict"),
+            ["a", None, 1, ["b", None]])
+
+    @gen_test
+    def test_large_value(self):
+        key = "g_large_value_key"
+        value = "gredis\r\n" * (1024 * 1024)
+        yield self.client.set(key, value)
+        self.assertEqual((yield self.client.get(key)), value)
+        connection = self.client.connection_pool._available_connections[0]
+        self.assertEqual(len(connection._parser._buffer._buffer), 0)
+        self.assertEqual((yield self.client.strlen(key)), len(value))
+
+        client = AsyncRedis(HOST, PORT, encoding="utf8",
+                            decode_responses=True, write_buffer_high_water=0)
+        self.assertTrue((yield client.set(key, "w")))
+        self.assertEqual((yield client.get(key)), "w")
+        connection = client.connection_pool._available_connections[0]
+        self.assertEqual(connection._write_pending, 0)
+
     @gen_test
     def test_to_blocking_client(self):
         key = "g_test_1_key"
@@ -60,7 +197,7 @@ class GRedisTest(AsyncTestCase):
     def test_blocking_pipeline(self):
         key = "g_pipeline_test"
         key1 = "g_pipeline_test1"
-        pipeline = self.client.pipeline()
+        pipeline = self.client.to_blocking_client().pipeline()
 
         pipeline.set(key, "gredis")
         pipeline.set(key1, "gredis1")
@@ -71,6 +208,88 @@ class GRedisTest(AsyncTestCase):
         ret1 = yield self.client.get(key1)
         self.assertEqual(ret1, "gredis1")
 
+    @gen_test
+    def test_pipeline(self):
+        key = "g_async_pipeline_test"
+        key1 = "g_async_pipeline_test1"
+        yield self.client.delete(key, key1)
+        pipeline = self.client.pipeline(transaction=False)
+
+        pipeline.set(key, "gredis").incr(key1).incr(key1).get(key)
+        response = yield pipeline.execute()
+        self.assertListEqual(response, [True, 1, 2, "gredis"])
+        self.assertEqual(len(pipeline), 0)
+
+        pipeline.lpush(key, "w")
+        with self.assertRaises(ResponseError):
+            yield pipeline.execute()
+
+        pipeline.lpush(key, "w").get(key1)
+        response = yield pipeline.execute(raise_on_error=False)
+        self.assertIsInstance(response[0], ResponseError)
+        self.assertEqual(response[1], "2")
+
+    @gen_test
+    def test_pipeline_transaction(self):
+        key = "g_async_transaction_test"
+        yield self.client.delete(key)
+        pipeline = self.client.pipeline()
+
+        pipeline.incr(key).incr(key).get(key)
+        response = yield pipeline.execute()
+        self.assertListEqual(response, [1, 2, "2"])
+
+        yield pipeline.watch(key)
+        value = yield pipeline.get(key)
+        self.assertEqual(value, "2")
+        pipeline.multi()
+        pipeline.set(key, int(value) + 1)
+        response = yield pipeline.execute()
+        self.assertListEqual(response, [True])
+
+        yield pipeline.watch(key)
+        yield self.client.set(key, "changed")
+        pipeline.multi()
+        pipeline.set(key, "pipeline")
+        with self.assertRaises(WatchError):
+            yield pipeline.execute()
+        value = yield self.client.get(key)
+        self.assertEqual(value, "changed")
+
+    @gen_test
+    def test_transaction(self):
+        key = "g_async_transaction_helper"
+        yield self.client.delete(key)
+        calls = []
+
+        @gen.coroutine
+        def increment(pipe):
+            calls.append(1)
+            value = yield pipe.get(key)
+            if len(calls) <= 10:
+                # the first attempts all read before any of them writes
+                yield gen.sleep(0.01)
+            pipe.multi()
+            pipe.set(key, int(value or 0) + 1)
+            raise gen.Return(int(value or 0) + 1)
+
+        # the concurrent transactions conflict and retry
+        values = yield [self.client.transaction(
+            increment, key, value_from_callable=True, watch_delay=0.001,
+            max_watch_delay=0.01) for _ in range(10)]
+        self.assertListEqual(sorted(values), list(range(1, 11)))
+        self.assertEqual((yield self.client.get(key)), "10")
+        self.assertGreater(len(calls), 10)
+
+        def conflict(pipe):
+            pipe.multi()
+            pipe.set(key, "pipeline")
+            return self.client.set(key, "changed")
+
+        with self.assertRaises(WatchError):
+            yield self.client.transaction(conflict, key, max_retries=2)
+        self.assertEqual((yield self.client.get(key)), "changed")
+
     @gen_test
     def test_async_pubsub(self):
         pubsub = self.client.pubsub()
@@ -82,3 +301,1292 @@ class GRedisTest(AsyncTestCase):
         response = yield pubsub.get_message(True)
         self.assertEqual(response["type"], "message")
         self.assertEqual(response["data"], "test")
+
+
+class ChunkStream(object):
+    "Stream giving its data in the given chunks"
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    @gen.coroutine
+    def read_bytes(self, num_bytes, partial=False):
+        raise gen.Return(self.chunks.pop(0))
+
+
+class StreamBufferTest(AsyncTestCase):
+    @gen_test
+    def test_split_replies(self):
+        stream = ChunkStream([b"+OK\r", b"\n$5\r\nab\r", b"de\r\n:1\r\n"])
+        buf = StreamBuffer(stream, 65536)
+        self.assertIsNone(buf.readline())
+        yield buf._read_from_stream()
+        self.assertIsNone(buf.readline())
+        yield buf._read_from_stream()
+        self.assertEqual(buf.readline(), b"+OK")
+        self.assertEqual(buf.readline(), b"$5")
+        self.assertIsNone(buf.read(5))
+        yield buf._read_from_stream()
+        self.assertEqual(buf.read(5), b"ab\rde")
+        self.assertEqual(buf.readline(), b":1")
+        self.assertEqual(buf.length, 0)
+        self.assertEqual(buf.bytes_received, 20)
+        # the data read isn't kept until the next reply
+        self.assertEqual(buf._buffer, b"")
+
+
+class AsyncConnectionPoolTest(AsyncTestCase):
+    def make_client(self, **kwargs):
+        return AsyncRedis(HOST, PORT, encoding="utf8",
+                          decode_responses=True, **kwargs)
+
+    @gen_test
+    def test_wait_for_connection(self):
+        client = self.make_client(max_connections=2)
+        pool = client.connection_pool
+        key = "g_pool_wait_key"
+        yield client.delete(key)
+        connections = yield [pool.get_connection("GET") for _ in range(2)]
+
+        futures = [client.incr(key) for _ in range(3)]
+        self.assertEqual(len(pool._waiters), 3)
+        for connection in connections:
+            pool.release(connection)
+        responses = yield futures
+        self.assertListEqual(sorted(responses), [1, 2, 3])
+        self.assertEqual(pool._created_connections, 2)
+        self.assertEqual(len(pool._waiters), 0)
+
+    @gen_test
+    def test_acquire_timeout(self):
+        client = self.make_client(max_connections=1, pool_timeout=0.05)
+        pool = client.connection_pool
+        connection = yield pool.get_connection("GET")
+        with self.assertRaises(ConnectionError):
+            yield client.get("g_pool_timeout_key")
+        self.assertEqual(len(pool._waiters), 0)
+        pool.release(connection)
+        response = yield client.set("g_pool_timeout_key", "w")
+        self.assertTrue(response)
+
+    @gen_test
+    def test_warm_up_and_reap(self):
+        client = self.make_client(min_connections=1, idle_timeout=0.05)
+        pool = client.connection_pool
+        yield pool.warm_up()
+        self.assertEqual(pool._created_connections, 1)
+        self.assertIsNotNone(pool._available_connections[0]._stream)
+
+        connections = yield [pool.get_connection("PING") for _ in range(5)]
+        yield [connection.connect() for connection in connections]
+        for connection in connections:
+            pool.release(connection)
+        self.assertEqual(pool._created_connections, 5)
+        yield gen.sleep(0.2)
+        self.assertEqual(pool._created_connections, 1)
+        self.assertEqual(len(pool._available_connections), 1)
+
+    @gen_test
+    def test_health_check(self):
+        client = self.make_client(health_check_interval=0)
+        pool = client.connection_pool
+        yield client.ping()
+        connection = pool._available_connections[0]
+        yield client.client_kill("{0}:{1}".format(
+            *connection._stream.socket.getsockname()))
+        response = yield client.ping()
+        self.assertTrue(response)
+
+
+class MultiplexedConnectionTest(AsyncTestCase):
+    def setUp(self):
+        super(MultiplexedConnectionTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True, multiplexed_connections=1,
+        )
+
+    @gen_test
+    def test_concurrent_commands(self):
+        key = "g_multiplexed_key"
+        list_key = "g_multiplexed_list_key"
+        pool = self.client.connection_pool
+        yield self.client.delete(key, list_key)
+
+        responses = yield [self.client.incr(key) for _ in range(100)]
+        self.assertListEqual(responses, list(range(1, 101)))
+        self.assertEqual(len(pool._multiplexed), 1)
+        self.assertEqual(pool._created_connections, 0)
+
+        futures = [self.client.lpush(key, "w"), self.client.get(key)]
+        with self.assertRaises(ResponseError):
+            yield futures[0]
+        self.assertEqual((yield futures[1]), "100")
+
+        # blocking commands use a pooled connection
+        yield self.client.rpush(list_key, "w")
+        response = yield self.client.blpop(list_key)
+        self.assertEqual(response, (list_key, "w"))
+        self.assertEqual(pool._created_connections, 1)
+
+    @gen_test
+    def test_reconnect(self):
+        yield self.client.ping()
+        connection = self.client.connection_pool._multiplexed[0]
+        connection._stream.close()
+        self.assertTrue((yield self.client.ping()))
+
+
+class AutoPipelineTest(AsyncTestCase):
+    def make_client(self, **kwargs):
+        return AsyncRedis(HOST, PORT, encoding="utf8",
+                          decode_responses=True, auto_pipeline=True,
+                          **kwargs)
+
+    @gen_test
+    def test_batch_commands(self):
+        client = self.make_client()
+        pool = client.connection_pool
+        key = "g_auto_pipeline_key"
+        yield client.delete(key)
+
+        futures = [client.incr(key) for _ in range(50)]
+        self.assertEqual(len(client._batch), 50)
+        responses = yield futures
+        self.assertListEqual(responses, list(range(1, 51)))
+        self.assertEqual(pool._created_connections, 1)
+        self.assertIsNone(client._batch)
+
+        futures = [client.lpush(key, "w"), client.get(key),
+                   client.exists(key)]
+        with self.assertRaises(ResponseError):
+            yield futures[0]
+        self.assertListEqual((yield futures[1:]), ["50", True])
+
+    @gen_test
+    def test_batch_multiplexed(self):
+        client = self.make_client(multiplexed_connections=1)
+        pool = client.connection_pool
+        key = "g_auto_pipeline_multiplexed_key"
+        yield client.delete(key)
+        responses = yield [client.incr(key) for _ in range(50)]
+        self.assertListEqual(responses, list(range(1, 51)))
+        self.assertEqual(pool._created_connections, 0)
+
+
+class BlockingLaneTest(AsyncTestCase):
+    def make_client(self, **kwargs):
+        return AsyncRedis(HOST, PORT, encoding="utf8",
+                          decode_responses=True, **kwargs)
+
+    @gen_test
+    def test_lane(self):
+        client = self.make_client(max_connections=1, blocking_connections=2)
+        pool = client.connection_pool
+        key = "g_blocking_lane_key"
+        yield client.delete(key)
+
+        futures = [client.blpop(key), client.brpop(key)]
+        # the other commands still get the connection of the pool
+        yield client.set("g_blocking_lane_other_key", "w")
+        yield client.rpush(key, "a", "b")
+        responses = yield futures
+        self.assertListEqual(sorted(responses), [(key, "a"), (key, "b")])
+        self.assertEqual(pool._created_connections, 1)
+        self.assertEqual(pool.get_blocking_pool()._created_connections, 2)
+
+        response = yield client.execute_command(
+            "XREAD", "COUNT", 1, "STREAMS", "g_blocking_lane_stream", 0)
+        self.assertIsNone(response)
+        self.assertEqual(pool._created_connections, 1)
+
+        with self.assertRaises(TimeoutError):
+            yield client.with_timeout(0.05).blpop(key)
+
+        # the server may still pop a value for the closed connection
+        raw_key = "g_blocking_lane_raw_key"
+        yield client.delete(raw_key)
+        yield client.rpush(raw_key, "c")
+        response = yield client.with_decoding("raw").blpop(raw_key)
+        self.assertEqual(response, (raw_key.encode("utf8"), b"c"))
+
+    @gen_test
+    def test_cancel(self):
+        client = self.make_client(blocking_connections=1)
+        blocking_pool = client.connection_pool.get_blocking_pool()
+        key = "g_blocking_cancel_key"
+        yield client.delete(key)
+
+        future = client.blpop(key)
+        waiting = client.brpop(key)
+        yield gen.moment
+        self.assertTrue(client.cancel(waiting))
+        self.assertTrue(client.cancel(future))
+        self.assertFalse(client.cancel(future))
+        for cancelled in (future, waiting):
+            with self.assertRaises(CancelledError):
+                yield cancelled
+
+        # the connection was closed and went back to the lane
+        yield client.rpush(key, "w")
+        response = yield client.blpop(key, 1)
+        self.assertEqual(response, (key, "w"))
+        self.assertEqual(blocking_pool._created_connections, 1)
+
+    @gen_test
+    def test_coalesce(self):
+        client = self.make_client(blocking_connections=1,
+                                  coalesce_blocking=True)
+        blocking_pool = client.connection_pool.get_blocking_pool()
+        key = "g_blocking_coalesce_key"
+        yield client.delete(key)
+
+        futures = [client.blpop(key) for _ in range(5)]
+        yield gen.moment
+        cancelled = futures.pop()
+        self.assertTrue(client.cancel(cancelled))
+        with self.assertRaises(CancelledError):
+            yield cancelled
+        yield client.rpush(key, *range(4))
+        responses = yield futures
+        self.assertListEqual(responses, [(key, str(i)) for i in range(4)])
+        self.assertEqual(blocking_pool._created_connections, 1)
+
+        with self.assertRaises(TimeoutError):
+            yield client.with_timeout(0.05).blpop(key)
+
+        # the shared command stops once its last waiter left
+        future = client.blpop(key)
+        yield gen.sleep(0.05)
+        self.assertTrue(client.cancel(future))
+        with self.assertRaises(CancelledError):
+            yield future
+        yield gen.sleep(0.05)
+        self.assertDictEqual(client.blocking_lane._groups, {})
+        self.assertEqual(len(blocking_pool._available_connections), 1)
+        yield client.rpush(key, "w")
+        self.assertEqual((yield client.lrange(key, 0, -1)), ["w"])
+
+
+class PubSubTest(AsyncTestCase):
+    def setUp(self):
+        super(PubSubTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+
+    @gen_test
+    def test_get_message_without_blocking(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        channel = "g_test_poll"
+        yield pubsub.subscribe(channel)
+
+        response = yield pubsub.get_message()
+        self.assertIsNone(response)
+        start = self.io_loop.time()
+        response = yield pubsub.get_message(timeout=0.05)
+        self.assertIsNone(response)
+        self.assertGreaterEqual(self.io_loop.time() - start, 0.05)
+
+        # the read abandoned by the timeout must not lose any data
+        self.io_loop.call_later(0.05, self.client.publish, channel, "test")
+        response = yield pubsub.get_message(timeout=1)
+        self.assertEqual(response["data"], "test")
+        yield self.client.publish(channel, "test1")
+        response = yield pubsub.get_message(block=True)
+        self.assertEqual(response["data"], "test1")
+
+    @gen_test
+    def test_listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        channel = "g_test_listen"
+        received = []
+        queue = MessageQueue(maxsize=10)
+        newest_queue = MessageQueue(maxsize=10,
+                                    overflow=MessageQueue.DROP_NEWEST)
+        others = []
+        yield pubsub.subscribe(**{channel: received.append,
+                                  channel + "_queue": queue,
+                                  channel + "_newest": newest_queue})
+        yield pubsub.psubscribe(channel + "_other*")
+        listener = pubsub.listen(others.append)
+
+        for i in range(100):
+            yield [self.client.publish(channel, i),
+                   self.client.publish(channel + "_queue", i),
+                   self.client.publish(channel + "_newest", i),
+                   self.client.publish(channel + "_other", i)]
+        yield pubsub.unsubscribe()
+        yield pubsub.punsubscribe()
+        yield listener
+
+        self.assertListEqual([m["data"] for m in received],
+                             [str(i) for i in range(100)])
+        self.assertListEqual([m["data"] for m in others],
+                             [str(i) for i in range(100)])
+        self.assertEqual(others[0]["pattern"], channel + "_other*")
+
+        self.assertEqual(queue.dropped, 90)
+        message = yield queue.get()
+        self.assertEqual(message["data"], "90")
+        self.assertEqual(newest_queue.dropped, 90)
+        message = yield newest_queue.get()
+        self.assertEqual(message["data"], "0")
+
+    @gen_test
+    def test_listen_resubscribe(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        channel = "g_test_listen_resubscribe"
+        queue = MessageQueue()
+        yield pubsub.subscribe(**{channel: queue})
+        listener = pubsub.listen()
+
+        yield self.client.client_kill("{0}:{1}".format(
+            *pubsub.connection._stream.socket.getsockname()))
+        while True:
+            numsub = yield self.client.pubsub_numsub(channel)
+            if numsub[0][1]:
+                break
+            yield gen.sleep(0.01)
+        yield self.client.publish(channel, "test")
+        message = yield queue.get()
+        self.assertEqual(message["data"], "test")
+
+        pubsub.close()
+        yield listener
+
+
+class PubSubHubTest(AsyncTestCase):
+    def setUp(self):
+        super(PubSubHubTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+        self.hub = PubSubHub(self.client)
+
+    def tearDown(self):
+        self.hub.close()
+        super(PubSubHubTest, self).tearDown()
+
+    @gen.coroutine
+    def wait_for_numsub(self, channel, count):
+        while True:
+            numsub = yield self.client.pubsub_numsub(channel)
+            if numsub[0][1] == count:
+                return
+            yield gen.sleep(0.01)
+
+    @gen_test
+    def test_shared_subscription(self):
+        channel = "g_test_hub"
+        first, second = MessageQueue(), MessageQueue()
+        yield self.hub.subscribe(channel, first)
+        yield self.hub.subscribe(channel, second)
+        yield self.wait_for_numsub(channel, 1)
+
+        yield self.client.publish(channel, "test")
+        self.assertEqual((yield first.get())["data"], "test")
+        self.assertEqual((yield second.get())["data"], "test")
+
+        yield self.hub.unsubscribe(channel, first)
+        yield self.client.publish(channel, "test1")
+        self.assertEqual((yield second.get())["data"], "test1")
+        self.assertEqual(first.qsize(), 0)
+
+        yield self.hub.unsubscribe(channel, second)
+        self.assertListEqual(self.hub.channels, [])
+        yield self.wait_for_numsub(channel, 0)
+
+        # subscribe again right after the last listener left
+        yield self.hub.subscribe(channel, first)
+        yield self.wait_for_numsub(channel, 1)
+        yield self.client.publish(channel, "test2")
+        self.assertEqual((yield first.get())["data"], "test2")
+
+    @gen_test
+    def test_shared_pattern(self):
+        pattern = "g_test_hub_pattern_*"
+        first, second = MessageQueue(), MessageQueue()
+        yield self.hub.psubscribe(pattern, first)
+        yield self.hub.psubscribe(pattern, second)
+        self.assertEqual((yield self.client.pubsub_numpat()), 1)
+
+        yield self.client.publish("g_test_hub_pattern_1", "test")
+        message = yield first.get()
+        self.assertEqual(message["pattern"], pattern)
+        self.assertEqual((yield second.get())["data"], "test")
+
+        yield self.hub.punsubscribe(pattern, first)
+        yield self.hub.punsubscribe(pattern, second)
+        self.assertListEqual(self.hub.patterns, [])
+
+
+class BulkStreamTest(AsyncTestCase):
+    def setUp(self):
+        super(BulkStreamTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+        self.key = "g_test_bulk_key"
+        # CRLFs inside must not confuse the reader
+        self.value = b"0123456789abcd\r\n" * 65536
+
+    @gen_test
+    def test_set_and_get(self):
+        self.assertTrue((yield self.client.set_stream(
+            self.key, io.BytesIO(self.value), ex=60)))
+        self.assertGreater((yield self.client.ttl(self.key)), 0)
+
+        reader = yield self.client.get_stream(self.key, chunk_size=10000)
+        self.assertEqual(reader.length, len(self.value))
+        chunks = []
+        while True:
+            chunk = yield reader.next_chunk()
+            if chunk is None:
+                break
+            self.assertLessEqual(len(chunk), 10000)
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), self.value)
+
+        buffer = bytearray(len(self.value) + 10)
+        self.assertEqual((yield self.client.get_into(self.key, buffer)),
+                         len(self.value))
+        self.assertEqual(bytes(buffer[:len(self.value)]), self.value)
+
+        fileobj = io.BytesIO()
+        self.assertEqual((yield self.client.get_to_file(self.key, fileobj)),
+                         len(self.value))
+        self.assertEqual(fileobj.getvalue(), self.value)
+
+        yield self.client.delete(self.key)
+        self.assertIsNone((yield self.client.get_stream(self.key)))
+
+    @gen_test
+    def test_append(self):
+        yield self.client.set(self.key, "a")
+        size = yield self.client.append_stream(
+            self.key, iter([b"bc", bytearray(b"de")]), length=4)
+        self.assertEqual(size, 5)
+        self.assertEqual((yield self.client.get(self.key)), "abcde")
+
+        with self.assertRaises(DataError):
+            yield self.client.append_stream(self.key, iter([b"f"]))
+        with self.assertRaises(DataError):
+            yield self.client.append_stream(self.key, iter([b"fg"]),
+                                            length=3)
+        self.assertEqual((yield self.client.get(self.key)), "abcde")
+
+    @gen_test
+    def test_close(self):
+        yield self.client.set_stream(self.key, io.BytesIO(self.value))
+        reader = yield self.client.get_stream(self.key)
+        self.assertTrue((yield reader.next_chunk()))
+        reader.close()
+        self.assertIsNone((yield reader.next_chunk()))
+        self.assertEqual((yield self.client.strlen(self.key)),
+                         len(self.value))
+
+        yield self.client.delete(self.key)
+        yield self.client.rpush(self.key, "a")
+        with self.assertRaises(ResponseError):
+            yield self.client.get_stream(self.key)
+        self.assertEqual((yield self.client.llen(self.key)), 1)
+
+
+class ClientCacheTest(AsyncTestCase):
+    def setUp(self):
+        super(ClientCacheTest, self).setUp()
+        self.cache = ClientCache(max_size=2)
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True, client_cache=self.cache,
+        )
+        self.other = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+
+    def tearDown(self):
+        if self.cache.pubsub is not None:
+            self.cache.pubsub.close()
+        super(ClientCacheTest, self).tearDown()
+
+    @gen_test
+    def test_hit_and_invalidate(self):
+        key = "g_test_cache_key"
+        yield self.client.set(key, "w")
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+        # a write through the same client evicts the reply
+        yield self.client.set(key, "w1")
+        self.assertEqual(self.cache.invalidations, 1)
+        self.assertEqual((yield self.client.get(key)), "w1")
+
+        # the reply of TTL changes without any write
+        yield self.client.expire(key, 100)
+        yield self.client.ttl(key)
+        yield self.client.ttl(key)
+        self.assertEqual(self.cache.hits, 1)
+
+        # a copy of a cached list is returned
+        list_key = "g_test_cache_list"
+        yield self.client.delete(list_key)
+        yield self.client.rpush(list_key, "a", "b")
+        (yield self.client.lrange(list_key, 0, -1)).append("c")
+        self.assertListEqual(
+            (yield self.client.lrange(list_key, 0, -1)), ["a", "b"])
+
+    @gen_test
+    def test_concurrent_commands(self):
+        key = "g_test_cache_concurrent"
+        other = "g_test_cache_concurrent_other"
+        yield self.client.set(key, "w")
+
+        # unrelated commands running meanwhile don't prevent storing it
+        replies = yield [self.client.get(key), self.client.set(other, key),
+                         self.client.mget(key, other), self.client.ping()]
+        self.assertListEqual(replies, ["w", True, ["w", key], True])
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual(self.cache.hits, 1)
+
+        # a value equal to the name of a cached key doesn't evict it
+        yield self.client.rpush(other + "_list", key)
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual(self.cache.hits, 2)
+
+        # a write of the key during the read does
+        self.cache.clear()
+        yield [self.client.get(key), self.client.set(key, "w1")]
+        self.assertEqual((yield self.client.get(key)), "w1")
+
+    @gen_test
+    def test_pipeline(self):
+        key = "g_test_cache_pipeline"
+        yield self.client.set(key, "old")
+        self.assertEqual((yield self.client.get(key)), "old")
+
+        for transaction in (True, False):
+            pipe = self.client.pipeline(transaction)
+            pipe.set(key, transaction)
+            pipe.get(key)
+            self.assertListEqual((yield pipe.execute()),
+                                 [True, str(transaction)])
+            self.assertEqual((yield self.client.get(key)), str(transaction))
+
+        # commands sent before MULTI
+        pipe = self.client.pipeline()
+        yield pipe.watch(key)
+        yield pipe.set(key, "immediate")
+        pipe.reset()
+        self.assertEqual((yield self.client.get(key)), "immediate")
+
+    @gen_test
+    def test_transaction(self):
+        key = "g_test_cache_transaction"
+        yield self.client.set(key, "1")
+        self.assertEqual((yield self.client.get(key)), "1")
+
+        @gen.coroutine
+        def increment(pipe):
+            value = yield pipe.get(key)
+            pipe.multi()
+            pipe.set(key, int(value) + 1)
+
+        yield self.client.transaction(increment, key)
+        self.assertEqual((yield self.client.get(key)), "2")
+
+    @gen_test
+    def test_eviction_and_ttl(self):
+        keys = ["g_test_cache_{0}".format(i) for i in range(3)]
+        for key in keys:
+            yield self.client.set(key, key)
+            yield self.client.get(key)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.clear()
+        self.cache.ttl = 0.05
+        yield self.client.get(keys[0])
+        yield gen.sleep(0.1)
+        yield self.client.get(keys[0])
+        self.assertEqual(self.cache.hits, 0)
+
+    @gen_test
+    def test_listen_keyspace(self):
+        key = "g_test_cache_keyspace"
+        yield self.other.config_set("notify-keyspace-events", "KA")
+        yield self.cache.listen_keyspace(self.client)
+        yield self.client.set(key, "w")
+        self.assertEqual((yield self.client.get(key)), "w")
+
+        yield self.other.set(key, "w1")
+        for _ in range(50):
+            if not len(self.cache):
+                break
+            yield gen.sleep(0.01)
+        self.assertEqual((yield self.client.get(key)), "w1")
+
+
+class ScanIteratorTest(AsyncTestCase):
+    def setUp(self):
+        super(ScanIteratorTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+
+    @gen.coroutine
+    def collect(self, iterator):
+        items = []
+        while True:
+            batch = yield iterator.next_batch()
+            if batch is None:
+                break
+            items.extend(batch)
+        raise gen.Return(items)
+
+    @gen_test
+    def test_scan_iter(self):
+        keys = set("g_test_scan_{0}".format(i) for i in range(300))
+        yield self.client.mset(dict((key, "w") for key in keys))
+
+        for lanes in (1, 4):
+            found = yield self.collect(self.client.scan_iter(
+                match="g_test_scan_*", count=50, lanes=lanes, prefetch=2))
+            self.assertSetEqual(set(found), keys)
+
+        iterator = self.client.scan_iter(match="g_test_scan_*", count=10)
+        found = set()
+        while True:
+            try:
+                key = yield iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            found.add(key)
+        self.assertSetEqual(found, keys)
+
+    @gen_test
+    def test_close(self):
+        fetches = []
+
+        def fetch(cursor):
+            fetches.append(Future())
+            return fetches[-1]
+
+        iterator = ScanIterator(fetch, lanes=2, prefetch=1)
+        batch = iterator.next_batch()
+        fetches[0].set_result((2, ["a"]))
+        fetches[1].set_result((3, ["b"]))
+        self.assertListEqual((yield batch), ["a"])
+        yield gen.moment
+        # the lanes are fetching again, or waiting to put a page
+        iterator.close()
+        for future in fetches[2:]:
+            future.set_result((0, ["c"]))
+        for _ in range(3):
+            yield gen.moment
+        self.assertEqual(iterator._running, 0)
+        self.assertEqual(iterator._pages.qsize(), 0)
+        self.assertFalse(iterator._pages._putters)
+        self.assertIsNone((yield iterator.next_batch()))
+
+    @gen_test
+    def test_collection_scan_iter(self):
+        set_key = "g_test_sscan"
+        hash_key = "g_test_hscan"
+        zset_key = "g_test_zscan"
+        yield self.client.delete(set_key, hash_key, zset_key)
+        members = ["m{0}".format(i) for i in range(200)]
+        yield self.client.sadd(set_key, *members)
+        yield self.client.hmset(hash_key, dict((m, m) for m in members))
+        yield self.client.zadd(zset_key, **dict((m, 1) for m in members))
+
+        found = yield self.collect(self.client.sscan_iter(set_key, count=20))
+        self.assertSetEqual(set(found), set(members))
+        found = yield self.collect(self.client.hscan_iter(hash_key, count=20))
+        self.assertDictEqual(dict(found), dict((m, m) for m in members))
+        found = yield self.collect(self.client.zscan_iter(zset_key))
+        self.assertDictEqual(dict(found), dict((m, 1.0) for m in members))
+
+
+class AsyncScriptTest(AsyncTestCase):
+    def setUp(self):
+        super(AsyncScriptTest, self).setUp()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+        )
+        self.script = self.client.register_script(
+            "return redis.call('INCRBY', KEYS[1], ARGV[1])")
+
+    @gen_test
+    def test_call(self):
+        key = "g_test_script_key"
+        yield self.client.delete(key)
+        self.assertEqual((yield self.script(keys=[key], args=[2])), 2)
+
+        # NOSCRIPT makes it load the script again
+        yield self.client.script_flush()
+        self.assertEqual((yield self.script(keys=[key], args=[2])), 4)
+
+    @gen_test
+    def test_load_on_connect(self):
+        key = "g_test_script_key"
+        yield self.client.delete(key)
+        yield self.client.script_flush()
+        self.client.connection_pool.disconnect()
+
+        loads = []
+        script_load = self.client.script_load
+        self.client.script_load = lambda s: loads.append(s) or script_load(s)
+        self.assertEqual((yield self.script(keys=[key], args=[1])), 1)
+        self.assertListEqual(loads, [])
+
+    @gen_test
+    def test_pipeline(self):
+        key = "g_test_script_key"
+        yield self.client.delete(key)
+        yield self.client.script_flush()
+        pipeline = self.client.pipeline()
+        self.script(keys=[key], args=[3], client=pipeline)
+        pipeline.get(key)
+        self.assertListEqual((yield pipeline.execute()), [3, "3"])
+
+
+class FakeRedisServerTest(AsyncTestCase):
+    def setUp(self):
+        super(FakeRedisServerTest, self).setUp()
+        self.server = FakeRedisServer()
+        self.server.start()
+        self.client = AsyncRedis(
+            "127.0.0.1", self.server.port, encoding="utf8",
+            decode_responses=True,
+        )
+
+    def tearDown(self):
+        self.client.connection_pool.disconnect()
+        self.server.stop()
+        super(FakeRedisServerTest, self).tearDown()
+
+    @gen_test
+    def test_pubsub(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        received = []
+        yield pubsub.subscribe("g_test_fake")
+        yield pubsub.psubscribe("g_test_fake*")
+        listener = pubsub.listen(received.append)
+
+        self.assertEqual((yield self.client.publish("g_test_fake", "a")), 2)
+        self.assertEqual((yield self.client.publish("g_test_fake2", "b")), 1)
+        self.assertEqual((yield self.client.publish("other", "c")), 0)
+        yield pubsub.unsubscribe()
+        yield pubsub.punsubscribe()
+        yield listener
+
+        self.assertListEqual([(m["type"], m["data"]) for m in received],
+                             [("message", "a"), ("pmessage", "a"),
+                              ("pmessage", "b")])
+
+
+class TimeoutTest(AsyncTestCase):
+    def setUp(self):
+        super(TimeoutTest, self).setUp()
+        self.server = FakeRedisServer()
+        self.server.start()
+        self.histogram = LatencyHistogram()
+
+    def tearDown(self):
+        self.server.stop()
+        super(TimeoutTest, self).tearDown()
+
+    def make_client(self, **kwargs):
+        return AsyncRedis("127.0.0.1", self.server.port, encoding="utf8",
+                          decode_responses=True,
+                          instruments=[self.histogram], **kwargs)
+
+    @gen_test
+    def test_socket_timeout(self):
+        client = self.make_client(socket_timeout=0.05)
+        yield client.set("g_timeout_key", "w")
+        self.server.stall()
+        with self.assertRaises(TimeoutError):
+            yield client.get("g_timeout_key")
+        # the connection was closed, not handed out with a reply pending
+        connection = client.connection_pool._available_connections[0]
+        self.assertIsNone(connection._stream)
+        self.assertEqual((yield client.get("g_timeout_key")), "w")
+        self.assertEqual(self.histogram.snapshot()["GET"]["timeouts"], 1)
+
+    @gen_test
+    def test_command_timeout(self):
+        client = self.make_client()
+        self.server.stall()
+        with self.assertRaises(TimeoutError):
+            yield client.with_timeout(0.05).get("g_timeout_key")
+        self.assertIsNone(client.command_timeout)
+        self.assertTrue((yield client.set("g_timeout_key", "w")))
+
+        client = self.make_client(command_timeout=0.05,
+                                  multiplexed_connections=1)
+        self.server.stall()
+        with self.assertRaises(TimeoutError):
+            yield client.get("g_timeout_key")
+
+    @gen_test
+    def test_hedge(self):
+        client = self.make_client(hedge_after=0.02)
+        yield client.set("g_hedge_key", "w")
+        self.server.stall()
+        self.assertEqual((yield client.get("g_hedge_key")), "w")
+        self.assertEqual(self.server.calls["get"], 1)
+        stats = self.histogram.snapshot()
+        self.assertEqual(stats["GET"]["hedged"], 1)
+        self.assertEqual(stats["SET"]["hedged"], 0)
+
+        # the dropped read gives its connection back once it failed
+        self.server.disconnect_clients()
+        yield gen.sleep(0.01)
+        self.assertSetEqual(client.connection_pool._in_use_connections, set())
+
+
+class AsyncRedisClusterTest(AsyncTestCase):
+    def setUp(self):
+        super(AsyncRedisClusterTest, self).setUp()
+        self.cluster = FakeRedisCluster(nodes=3)
+        self.cluster.start()
+        self.client = AsyncRedisCluster(
+            startup_nodes=self.cluster.startup_nodes[:1], encoding="utf8",
+            decode_responses=True,
+        )
+
+    def tearDown(self):
+        self.cluster.stop()
+        super(AsyncRedisClusterTest, self).tearDown()
+
+    @gen_test
+    def test_routing(self):
+        keys = ["g_test_cluster_{0}".format(i) for i in range(20)]
+        for key in keys:
+            yield self.client.set(key, key)
+        for key in keys:
+            node = self.cluster.node_for_key(key)
+            self.assertEqual(node.data[key.encode()], key.encode())
+        self.assertEqual((yield self.client.get(keys[0])), keys[0])
+        self.assertEqual(len(self.client.primaries), 3)
+        self.assertEqual((yield self.client.dbsize()), 20)
+
+    @gen_test
+    def test_multi_key_commands(self):
+        mapping = dict(("g_test_cluster_{0}".format(i), str(i))
+                       for i in range(20))
+        self.assertTrue((yield self.client.mset(mapping)))
+        keys = sorted(mapping) + ["missing"]
+        self.assertListEqual((yield self.client.mget(keys)),
+                             [mapping.get(key) for key in keys])
+        self.assertEqual((yield self.client.delete(*keys)), 20)
+
+        # a hash tag keeps the keys in one slot
+        yield self.client.mset({"{tag}a": "1", "{tag}b": "2"})
+        self.assertListEqual(
+            (yield self.client.mget("{tag}a", "{tag}b")), ["1", "2"])
+
+    @gen_test
+    def test_scan(self):
+        keys = set("g_test_cluster_{0}".format(i) for i in range(50))
+        yield self.client.mset(dict((key, "w") for key in keys))
+        yield self.client.set("other", "w")
+
+        # the cursor walks every primary in turn
+        cursor, found = 0, []
+        while True:
+            cursor, items = yield self.client.scan(
+                cursor, match="g_test_*", count=7)
+            found.extend(items)
+            if cursor == 0:
+                break
+        self.assertEqual(len(found), 50)
+        self.assertSetEqual(set(found), keys)
+
+        iterator = self.client.scan_iter(match="g_test_*", count=7)
+        found = []
+        while True:
+            batch = yield iterator.next_batch()
+            if batch is None:
+                break
+            found.extend(batch)
+        self.assertSetEqual(set(found), keys)
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.scan(0, count=100)
+        pipe.get("other")
+        (cursor, items), value = yield pipe.execute()
+        self.assertEqual(cursor, 1)
+        self.assertEqual(value, "w")
+
+    @gen_test
+    def test_redirects(self):
+        key = "g_test_cluster_moved"
+        yield self.client.set(key, "w")
+        slot = self.client.key_slot(key)
+        source = self.cluster.slots[slot]
+        target = [n for n in self.cluster.nodes if n is not source][0]
+
+        self.cluster.move_slot(slot, target)
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual(self.client.slots[slot], target.name)
+
+        self.cluster.migrate_slot(slot, source, keys=[key])
+        source.calls.clear()
+        self.assertEqual((yield self.client.get(key)), "w")
+        self.assertEqual(source.calls.get("asking"), 1)
+        # the slot map doesn't change on ASK
+        self.assertEqual(self.client.slots[slot], target.name)
+
+    @gen_test
+    def test_pipeline(self):
+        pipeline = self.client.pipeline()
+        for i in range(10):
+            pipeline.set("g_test_cluster_{0}".format(i), i)
+        pipeline.mget(["g_test_cluster_{0}".format(i) for i in range(10)])
+        pipeline.get("g_test_cluster_3")
+        replies = yield pipeline.execute()
+        self.assertListEqual(replies[:10], [True] * 10)
+        self.assertListEqual(replies[10], [str(i) for i in range(10)])
+        self.assertEqual(replies[11], "3")
+
+        # commands of a moved slot are redirected
+        key = "g_test_cluster_0"
+        slot = self.client.key_slot(key)
+        target = [n for n in self.cluster.nodes
+                  if n is not self.cluster.slots[slot]][0]
+        self.cluster.move_slot(slot, target)
+        pipeline.get(key).incr(key)
+        self.assertListEqual((yield pipeline.execute()), ["0", 1])
+
+        with self.assertRaises(ValueError):
+            self.client.pipeline(transaction=True)
+
+
+class AsyncSentinelTest(AsyncTestCase):
+    def setUp(self):
+        super(AsyncSentinelTest, self).setUp()
+        self.master = FakeRedisServer()
+        self.replicas = [FakeRedisServer(), FakeRedisServer()]
+        self.sentinel_server = FakeSentinel()
+        self.servers = [self.master, self.sentinel_server] + self.replicas
+        for server in self.servers:
+            server.start()
+        self.sentinel_server.add_service("g_test", self.master, self.replicas)
+        self.sentinel = AsyncSentinel(
+            [("127.0.0.1", self.sentinel_server.port)], encoding="utf8",
+            decode_responses=True)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        super(AsyncSentinelTest, self).tearDown()
+
+    @gen_test
+    def test_discover(self):
+        self.assertEqual((yield self.sentinel.discover_master("g_test")),
+                         ("127.0.0.1", self.master.port))
+        slaves = yield self.sentinel.discover_slaves("g_test")
+        self.assertListEqual(slaves, [("127.0.0.1", r.port)
+                                      for r in self.replicas])
+
+        slave = self.sentinel.slave_for("g_test")
+        self.replicas[0].data[b"key"] = self.replicas[1].data[b"key"] = b"r"
+        self.assertEqual((yield slave.get("key")), "r")
+
+    @gen_test
+    def test_failover(self):
+        master = self.sentinel.master_for("g_test")
+        yield master.set("key", "w")
+        self.assertEqual(self.master.data[b"key"], b"w")
+
+        self.sentinel_server.failover("g_test", self.replicas[0])
+        # READONLY from the old master makes it ask the sentinel again
+        yield master.set("key", "w1")
+        self.assertEqual(self.replicas[0].data[b"key"], b"w1")
+
+    @gen_test
+    def test_read_routing(self):
+        client = self.sentinel.client_for("g_test")
+        for server in self.servers:
+            server.data[b"key"] = server.name.encode()
+
+        replies = []
+        for _ in range(4):
+            replies.append((yield client.get("key")))
+        self.assertSetEqual(set(replies), set(r.name for r in self.replicas))
+        yield client.set("key", "w")
+        self.assertEqual(self.master.data[b"key"], b"w")
+
+        # least outstanding requests
+        client = self.sentinel.client_for("g_test",
+                                          balancing="least_outstanding")
+        replies = yield [client.get("key") for _ in range(4)]
+        self.assertSetEqual(set(replies), set(r.name for r in self.replicas))
+
+        # reads fall back to the master when the replicas failed
+        for replica in self.replicas:
+            replica.stop()
+        self.assertEqual((yield client.get("key")), "w")
+
+    @gen_test
+    def test_replica_timeout(self):
+        client = self.sentinel.client_for("g_test", command_timeout=5)
+        for server in self.servers:
+            server.data[b"key"] = b"w"
+        for replica in self.replicas:
+            replica.stall()
+        # the deadline of the caller covers the read sent to a replica
+        with self.assertRaises(TimeoutError):
+            yield client.with_timeout(0.1).get("key")
+        for replica in self.replicas:
+            replica.stalls = 0
+        self.assertEqual((yield client.get("key")), "w")
+
+    @gen_test
+    def test_replica_decoding(self):
+        client = self.sentinel.client_for("g_test")
+        for server in self.servers:
+            server.data[b"key"] = b"w"
+        raw = client.with_decoding("raw")
+        replies = yield [raw.get("key") for _ in range(2)]
+        self.assertListEqual(replies, [b"w", b"w"])
+        self.assertEqual((yield client.get("key")), "w")
+
+
+class AsyncShardedRedisTest(AsyncTestCase):
+    def setUp(self):
+        super(AsyncShardedRedisTest, self).setUp()
+        self.servers = dict(("shard{0}".format(i), FakeRedisServer())
+                            for i in range(3))
+        for server in self.servers.values():
+            server.start()
+        self.client = AsyncShardedRedis(dict(
+            (name, AsyncRedis("127.0.0.1", server.port, encoding="utf8",
+                              decode_responses=True))
+            for name, server in self.servers.items()))
+
+    def tearDown(self):
+        for server in self.servers.values():
+            server.stop()
+        super(AsyncShardedRedisTest, self).tearDown()
+
+    @gen_test
+    def test_routing(self):
+        keys = ["g_test_shard_{0}".format(i) for i in range(100)]
+        for key in keys:
+            yield self.client.set(key, key)
+        for key in keys:
+            server = self.servers[self.client.get_shard_name(key)]
+            self.assertEqual(server.data[key.encode()], key.encode())
+        self.assertTrue(all(server.data for server in self.servers.values()))
+        self.assertEqual((yield self.client.dbsize()), 100)
+
+        # hash tags keep keys on one shard
+        names = set(self.client.get_shard_name("{user1}" + key)
+                    for key in keys)
+        self.assertEqual(len(names), 1)
+
+        # a new shard only takes keys from the others
+        before = dict((key, self.client.get_shard_name(key)) for key in keys)
+        self.client.add_shard("shard3", AsyncRedis("127.0.0.1", 1))
+        moved = [key for key in keys
+                 if self.client.get_shard_name(key) != before[key]]
+        self.assertTrue(0 < len(moved) < 50)
+        self.assertTrue(all(self.client.get_shard_name(key) == "shard3"
+                            for key in moved))
+
+    @gen_test
+    def test_scan(self):
+        keys = set("g_test_shard_{0}".format(i) for i in range(50))
+        yield self.client.mset(dict((key, "w") for key in keys))
+        yield self.client.set("other", "w")
+
+        # the cursor walks every shard in turn
+        cursor, found = 0, []
+        while True:
+            cursor, items = yield self.client.scan(
+                cursor, match="g_test_*", count=7)
+            found.extend(items)
+            if cursor == 0:
+                break
+        self.assertEqual(len(found), 50)
+        self.assertSetEqual(set(found), keys)
+
+        iterator = self.client.scan_iter(match="g_test_*", count=7)
+        found = []
+        while True:
+            batch = yield iterator.next_batch()
+            if batch is None:
+                break
+            found.extend(batch)
+        self.assertSetEqual(set(found), keys)
+
+        pipe = self.client.pipeline()
+        pipe.scan(0, count=100)
+        pipe.get("other")
+        (cursor, items), value = yield pipe.execute()
+        self.assertEqual(cursor, 1)
+        self.assertEqual(value, "w")
+
+    @gen_test
+    def test_multi_key_commands(self):
+        mapping = dict(("g_test_shard_{0}".format(i), str(i))
+                       for i in range(30))
+        self.assertTrue((yield self.client.mset(mapping)))
+        keys = sorted(mapping) + ["missing"]
+        self.assertListEqual((yield self.client.mget(keys)),
+                             [mapping.get(key) for key in keys])
+        self.assertEqual((yield self.client.delete(*keys)), 30)
+
+    @gen_test
+    def test_pipeline(self):
+        keys = ["g_test_shard_{0}".format(i) for i in range(10)]
+        pipeline = self.client.pipeline()
+        for i, key in enumerate(keys):
+            pipeline.set(key, i)
+        pipeline.mget(keys).incr(keys[0]).delete(*keys)
+        replies = yield pipeline.execute()
+        self.assertListEqual(replies[:10], [True] * 10)
+        self.assertListEqual(replies[10], [str(i) for i in range(10)])
+        self.assertListEqual(replies[11:], [1, 10])
+
+
+class EventRecorder(Instrument):
+    def __init__(self):
+        self.before = []
+        self.events = []
+
+    def before_command(self, event):
+        self.before.append(event.command)
+
+    def after_command(self, event):
+        self.events.append(event)
+
+
+class InstrumentTest(AsyncTestCase):
+    def setUp(self):
+        super(InstrumentTest, self).setUp()
+        self.recorder = EventRecorder()
+        self.histogram = LatencyHistogram()
+        self.client = AsyncRedis(
+            HOST, PORT, encoding="utf8",
+            decode_responses=True,
+            instruments=[self.recorder, self.histogram],
+        )
+
+    @gen_test
+    def test_events(self):
+        key = "g_test_instrument_key"
+        yield self.client.set(key, "value")
+        self.assertEqual((yield self.client.get(key)), "value")
+        yield self.client.mget(key, key)
+
+        self.assertListEqual(self.recorder.before, ["SET", "GET", "MGET"])
+        first, get, mget = self.recorder.events
+        self.assertIsNotNone(first.connect_time)
+        self.assertIsNone(get.connect_time)
+        self.assertEqual(mget.keys, 2)
+        for event in self.recorder.events:
+            self.assertIsNone(event.error)
+            self.assertGreaterEqual(event.duration, event.round_trip)
+            self.assertIsNotNone(event.pool_wait)
+        # *2\r\n$3\r\nGET\r\n$21\r\ng_test_instrument_key\r\n
+        self.assertEqual(get.bytes_written, 41)
+        # $5\r\nvalue\r\n
+        self.assertEqual(get.bytes_read, 11)
+
+    @gen_test
+    def test_error(self):
+        key = "g_test_instrument_key"
+        yield self.client.set(key, "value")
+        with self.assertRaises(ResponseError):
+            yield self.client.incr(key)
+        event = self.recorder.events[-1]
+        self.assertEqual(event.command, "INCRBY")
+        self.assertIsInstance(event.error, ResponseError)
+
+    @gen_test
+    def test_histogram(self):
+        key = "g_test_instrument_key"
+        for _ in range(10):
+            yield self.client.get(key)
+        self.client.remove_instrument(self.histogram)
+        yield self.client.get(key)
+
+        stats = self.histogram.snapshot()["GET"]
+        self.assertEqual(stats["count"], 10)
+        self.assertEqual(sum(count for _, count in stats["buckets"]), 10)
+        self.assertLessEqual(stats["p50"], stats["p99"])
+        self.assertGreaterEqual(stats["p999"], stats["max"])
+        self.histogram.reset()
+        self.assertDictEqual(self.histogram.snapshot(), {})
+
+    def test_buckets(self):
+        for duration in (0.0000005, 0.000003, 0.001, 0.25, 2):
+            upper = LatencyHistogram.upper_bound(
+                LatencyHistogram.bucket(duration))
+            self.assertLessEqual(duration, upper)
+            self.assertLess(upper, duration * 1.3 + 1e-6)
+
+
+@unittest.skipIf(AioRedis is None, "needs Python 3.5+")
+class AioRedisTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.client = AioRedis(HOST, PORT, decode_responses=True)
+        self.key = "g_test_aio_key"
+
+    def tearDown(self):
+        self.client.connection_pool.disconnect()
+        # let the transports close
+        self.loop.run_until_complete(asyncio.sleep(0))
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_commands(self):
+        run = self.run_until_complete
+        self.assertTrue(run(self.client.set(self.key, "a\r\n" * 100000)))
+        self.assertEqual(run(self.client.get(self.key)), "a\r\n" * 100000)
+        self.assertEqual(run(self.client.delete(self.key)), 1)
+        self.assertEqual(run(self.client.incr(self.key)), 1)
+        with self.assertRaises(ResponseError):
+            run(self.client.lpush(self.key, 1))
+
+        # each coroutine takes a connection of the pool
+        replies = run(asyncio.gather(
+            *[self.client.incr(self.key) for _ in range(10)]))
+        self.assertListEqual(sorted(replies), list(range(2, 12)))
+
+    def test_pipeline(self):
+        run = self.run_until_complete
+        run(self.client.delete(self.key))
+        pipeline = self.client.pipeline()
+        pipeline.set(self.key, 1).incr(self.key).lpush(self.key, 1)
+        result = run(pipeline.execute(raise_on_error=False))
+        self.assertListEqual(result[:2], [True, 2])
+        self.assertIsInstance(result[2], ResponseError)
+
+        pipeline = self.client.pipeline()
+        run(pipeline.watch(self.key))
+        self.assertEqual(run(pipeline.get(self.key)), "2")
+        pipeline.multi()
+        pipeline.incr(self.key)
+        run(self.client.incr(self.key))
+        with self.assertRaises(WatchError):
+            run(pipeline.execute())
+        self.assertEqual(run(self.client.get(self.key)), "3")